@@ -0,0 +1,85 @@
+"""
+Size, export time and decode time of the static data blob (see
+`MDVProject.convert_data_to_binary`) with each codec in `mdvtools.binary_codecs`,
+for a datasource of numeric and text columns with a rows_as_columns subgroup of
+sparse gene expression. Decoding is timed in Python with the codec's library, so is
+only indicative of the relative speed in the browser. Codecs whose package is not
+installed are skipped.
+
+    python -m benchmarks.binary_codecs [rows] [genes]
+"""
+
+import sys
+import json
+import time
+import zlib
+import numpy
+import pandas
+import scipy.sparse
+from os.path import getsize, join
+from tempfile import TemporaryDirectory
+from mdvtools.mdvproject import MDVProject
+from mdvtools.binary_codecs import CODECS, read_export_index
+
+
+def get_decoder(codec):
+    if codec == "gzip":
+        return lambda data: zlib.decompress(data, wbits=31)
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress
+    return bytes
+
+
+def main(rows=200_000, genes=2000):
+    rng = numpy.random.default_rng(0)
+    df = pandas.DataFrame(
+        {
+            "x": rng.normal(size=rows),
+            "count": rng.integers(0, 1000, rows),
+            "type": pandas.Categorical.from_codes(
+                rng.integers(0, 20, rows), [f"type_{i}" for i in range(20)]
+            ),
+        }
+    )
+    nnz = rows * genes // 20
+    expr = scipy.sparse.csr_matrix(
+        (
+            rng.gamma(2, size=nnz).astype(numpy.float32),
+            (numpy.sort(rng.integers(0, genes, nnz)), rng.integers(0, rows, nnz)),
+        ),
+        shape=(genes, rows),
+    )
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("cells", df)
+        p.add_datasource(
+            "genes", pandas.DataFrame({"name": [f"g{i}" for i in range(genes)]})
+        )
+        p.add_rows_as_columns_link("cells", "genes", "name", "Gene Expr")
+        p.add_rows_as_columns_subgroup("cells", "genes", "expr", expr, sparse=True)
+        for codec in CODECS:
+            try:
+                t = time.perf_counter()
+                p.convert_data_to_binary(dir, codec=codec, incremental=False)
+                export = time.perf_counter() - t
+            except AttributeError as e:
+                print(f"{codec:7} skipped ({e})")
+                continue
+            _, index = read_export_index(json.load(open(join(dir, "cells.json"))))
+            with open(join(dir, "cells.gz"), "rb") as f:
+                data = f.read()
+            decode = get_decoder(codec)
+            t = time.perf_counter()
+            for start, end in index.values():
+                decode(data[start : end + 1])
+            decoding = time.perf_counter() - t
+            print(
+                f"{codec:7} {getsize(join(dir, 'cells.gz')) / 1e6:8.1f}MB "
+                f"export {export:.2f}s decode {decoding:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
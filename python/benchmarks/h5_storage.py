@@ -0,0 +1,82 @@
+"""
+File size and read latency of a project's h5 file with different storage
+options (see `mdvtools.storage`), applied with `MDVProject.repack`. Reads are
+timed with a newly opened file, both for whole columns (as sent to the
+client) and for a small slice of rows. The OS page cache is not dropped, so
+the times are for 'warm' files - cold reads from disk favour smaller files
+even more.
+
+    python -m benchmarks.h5_storage [rows]
+"""
+
+import sys
+import time
+import h5py
+import numpy
+import pandas
+from os.path import getsize
+from tempfile import TemporaryDirectory
+from mdvtools.mdvproject import MDVProject
+
+SETTINGS = {
+    "contiguous": {},
+    "chunked": {"chunks": 65536},
+    "gzip": {"chunks": 65536, "compression": "gzip", "level": 4},
+    "gzip+shuffle": {
+        "chunks": 65536,
+        "compression": "gzip",
+        "level": 4,
+        "shuffle": True,
+    },
+    "lzf+shuffle": {"chunks": 65536, "compression": "lzf", "shuffle": True},
+    "blosc+shuffle": {"chunks": 65536, "compression": "blosc", "shuffle": True},
+}
+
+
+def time_reads(file, columns, repeats=3):
+    whole = part = 0.0
+    for _ in range(repeats):
+        for c in columns:
+            t = time.perf_counter()
+            with h5py.File(file, "r") as h5:
+                h5["data"][c][:]
+            whole += time.perf_counter() - t
+            t = time.perf_counter()
+            with h5py.File(file, "r") as h5:
+                h5["data"][c][1000:2000]
+            part += time.perf_counter() - t
+    n = repeats * len(columns)
+    return whole / n, part / n
+
+
+def main(rows=5_000_000):
+    rng = numpy.random.default_rng(0)
+    df = pandas.DataFrame(
+        {
+            "double": rng.normal(size=rows),
+            "integer": rng.integers(0, 1000, rows),
+            "text": pandas.Categorical.from_codes(
+                rng.integers(0, 20, rows), [f"type_{i}" for i in range(20)]
+            ),
+        }
+    )
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("data", df)
+        for name, options in SETTINGS.items():
+            try:
+                t = time.perf_counter()
+                p.repack(options)
+                repack = time.perf_counter() - t
+            except AttributeError as e:
+                print(f"{name:14} skipped ({e})")
+                continue
+            whole, part = time_reads(p.h5file, df.columns)
+            print(
+                f"{name:14} {getsize(p.h5file) / 1e6:8.1f}MB repack {repack:.2f}s "
+                f"column {whole * 1000:.1f}ms 1000 rows {part * 1000:.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,57 @@
+"""
+Per-column cost of adding numeric columns to a datasource, comparing the
+previous element-wise cleaning (`Series.apply(pandas.to_numeric)`, reading the
+dataset back from the h5 file and one `numpy.percentile` call per quantile)
+with the current `add_column_to_group`.
+
+    python -m benchmarks.numeric_ingest [rows] [columns]
+"""
+
+import sys
+import time
+import h5py
+import numpy
+import pandas
+from tempfile import TemporaryDirectory
+from os.path import join
+from mdvtools.mdvproject import add_column_to_group
+
+
+def old_numeric(col, data, group, length):
+    clean = data.apply(pandas.to_numeric, errors="coerce")
+    ds = group.create_dataset(col["field"], length, data=clean, dtype=numpy.float32)
+    na = numpy.array(ds)
+    na = na[numpy.isfinite(na)]
+    col["minMax"] = [float(str(numpy.amin(na))), float(str(numpy.amax(na)))]
+    col["quantiles"] = {}
+    for q in [0.001, 0.01, 0.05]:
+        col["quantiles"][str(q)] = [
+            numpy.percentile(na, 100 * q),
+            numpy.percentile(na, 100 * (1 - q)),
+        ]
+
+
+def main(rows=10_000_000, ncols=3):
+    rng = numpy.random.default_rng(0)
+    columns = []
+    for i in range(ncols):
+        c = rng.normal(size=rows)
+        c[rng.integers(0, rows, rows // 100)] = numpy.nan
+        columns.append(pandas.Series(c))
+    with TemporaryDirectory() as dir:
+        h5 = h5py.File(join(dir, "bench.h5"), "w")
+        for name, fn in [
+            ("old", lambda c, d, g: old_numeric(c, d, g, rows)),
+            ("new", lambda c, d, g: add_column_to_group(c, d, g, rows, False)),
+        ]:
+            gr = h5.create_group(name)
+            t = time.perf_counter()
+            for i, data in enumerate(columns):
+                fn({"field": f"c{i}", "datatype": "double"}, data, gr)
+            per_col = (time.perf_counter() - t) / ncols
+            print(f"{name}: {per_col:.3f}s per column ({rows:,} rows)")
+        h5.close()
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,68 @@
+"""
+Accuracy and cost of the quantiles in column metadata estimated with a
+`QuantileSketch`, compared with the exact `get_quantiles`, both for a whole
+column and for a column added in chunks to several sketches which are then
+merged (as when ingesting a file in chunks). Accuracy is the largest
+difference between the requested quantile and the rank of the estimate.
+
+    python -m benchmarks.quantile_sketch [rows] [chunks]
+"""
+
+import sys
+import time
+import numpy
+from mdvtools.mdvproject import get_quantiles
+from mdvtools.quantile_sketch import QuantileSketch
+
+
+def rank_error(sorted_values, quantiles):
+    n = len(sorted_values)
+    err = 0.0
+    for q, (lo, hi) in quantiles.items():
+        q = float(q)
+        err = max(err, abs(numpy.searchsorted(sorted_values, lo) / n - q))
+        err = max(err, abs(numpy.searchsorted(sorted_values, hi) / n - (1 - q)))
+    return err
+
+
+def exact(values, chunks):
+    return get_quantiles(values)
+
+
+def sketch(values, chunks):
+    s = QuantileSketch()
+    s.add(values)
+    return s.quantiles()
+
+
+def merged(values, chunks):
+    parts = [QuantileSketch() for _ in range(4)]
+    for i, chunk in enumerate(numpy.array_split(values, chunks)):
+        parts[i % 4].add(chunk)
+    for p in parts[1:]:
+        parts[0].merge(p)
+    return parts[0].quantiles()
+
+
+def main(rows=10_000_000, chunks=100):
+    rng = numpy.random.default_rng(0)
+    data = {
+        "normal": rng.normal(size=rows),
+        "lognormal": rng.lognormal(sigma=2, size=rows),
+        "uniform": rng.uniform(size=rows),
+    }
+    for name, values in data.items():
+        values = values.astype(numpy.float32)
+        s = numpy.sort(values)
+        for method in (exact, sketch, merged):
+            t = time.perf_counter()
+            qs = method(values, chunks)
+            elapsed = time.perf_counter() - t
+            print(
+                f"{name:10} {method.__name__:7} {elapsed:.3f}s "
+                f"max rank error {rank_error(s, qs):.6f}"
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
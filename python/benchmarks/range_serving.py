@@ -0,0 +1,84 @@
+"""
+Throughput and peak memory of serving a large (track) file with HTTP Range requests,
+comparing the previous `get_range` (which read each range into a single bytes object)
+with `mdvtools.file_ranges.send_file_range`, which streams the file in pieces (or
+hands it to the server's `wsgi.file_wrapper`, not used here, which can avoid copying
+it at all). The response bodies are iterated as a WSGI server would.
+
+    python -m benchmarks.range_serving [size_gb] [small_ranges]
+"""
+
+import os
+import sys
+import time
+import random
+import tracemalloc
+import mimetypes
+from flask import Response
+from tempfile import TemporaryDirectory
+from mdvtools.file_ranges import send_file_range
+
+
+def old_get_range(path, start, stop):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(stop - start)
+    rv = Response(
+        data, 206, mimetype=mimetypes.guess_type(path)[0], direct_passthrough=True
+    )
+    rv.headers.add("Content-Range", f"bytes {start}-{stop - 1}/{os.stat(path).st_size}")
+    rv.headers.add("Accept-Ranges", "bytes")
+    return rv.response
+
+
+def new_get_range(path, start, stop):
+    rv = send_file_range(path, f"bytes={start}-{stop - 1}", {})
+    return rv.response
+
+
+def consume(fn, path, ranges):
+    total = 0
+    for start, stop in ranges:
+        for piece in fn(path, start, stop):
+            total += len(piece)
+    return total
+
+
+def run(fn, path, ranges):
+    t = time.perf_counter()
+    total = consume(fn, path, ranges)
+    elapsed = time.perf_counter() - t
+    tracemalloc.start()
+    consume(fn, path, ranges)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return total / elapsed / 1e6, peak / 1e6
+
+
+def main(size_gb=2, small_ranges=2000):
+    size = int(size_gb * 1e9)
+    with TemporaryDirectory() as dir:
+        path = os.path.join(dir, "track.bam")
+        block = os.urandom(16_000_000)
+        with open(path, "wb") as f:
+            for s in range(0, size, len(block)):
+                f.write(block[: size - s])
+        rnd = random.Random(0)
+        tests = {
+            "whole file": [(0, size)],
+            "64MB ranges": [
+                (s, min(s + 64_000_000, size)) for s in range(0, size, 64_000_000)
+            ],
+            "64KB random": [
+                (s, s + 65536)
+                for s in (rnd.randrange(0, size - 65536) for _ in range(small_ranges))
+            ],
+        }
+        for name, ranges in tests.items():
+            for label, fn in (("old", old_get_range), ("new", new_get_range)):
+                rate, peak = run(fn, path, ranges)
+                print(f"{name:12} {label} {rate:8.0f}MB/s peak memory {peak:8.1f}MB")
+
+
+if __name__ == "__main__":
+    main(*[float(x) for x in sys.argv[1:2]], *[int(x) for x in sys.argv[2:3]])
@@ -0,0 +1,44 @@
+"""
+Time and peak (Python-allocated) memory of exporting a datasource with large columns
+(see `MDVProject.convert_data_to_binary`), reading and compressing each column a block
+at a time (`EXPORT_BLOCK_BYTES`) compared with reading each column as a whole. With
+workers > 1, the blocks of each large column are read and compressed by a pool process,
+whose memory (about one block each) is not included in the peak.
+
+    python -m benchmarks.streamed_export [rows] [workers]
+"""
+
+import sys
+import time
+import tracemalloc
+import numpy
+import pandas
+from tempfile import TemporaryDirectory
+from mdvtools import mdvproject
+from mdvtools.mdvproject import MDVProject
+
+
+def main(rows=50_000_000, workers=1):
+    rng = numpy.random.default_rng(0)
+    df = pandas.DataFrame(
+        {"x": rng.normal(size=rows), "count": rng.integers(0, 1000, rows)}
+    )
+    block_bytes = mdvproject.EXPORT_BLOCK_BYTES
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("cells", df)
+        del df
+        for label, size in (("whole columns", 2**62), ("blocks", block_bytes)):
+            mdvproject.EXPORT_BLOCK_BYTES = size
+            tracemalloc.start()
+            t = time.perf_counter()
+            p.convert_data_to_binary(dir, workers=workers, incremental=False)
+            elapsed = time.perf_counter() - t
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{label:13} {elapsed:6.2f}s peak memory {peak / 1e6:8.1f}MB")
+        mdvproject.EXPORT_BLOCK_BYTES = block_bytes
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,130 @@
+"""
+How the data of each column (and rows_as_columns entry) is compressed in a static
+export (see `MDVProject.convert_data_to_binary`). The codec is recorded in the export's
+index (see `export_index`), so the client knows how to decode it.
+
+    gzip: The default.
+    zstd: Faster to compress (requires the zstandard package, which is installed
+        with the 'codecs' extra). The client decodes it with its own decoder
+        (src/dataloaders/zstd.js), as browsers don't support zstd natively.
+    raw: Not compressed, best for projects served locally.
+"""
+
+import zlib
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+# the default compression level of each codec
+CODECS = {"gzip": 6, "zstd": 3, "raw": 0}
+
+
+def check_codec(codec: str, level: Optional[int] = None) -> int:
+    """Checks the codec can be used, returning the compression level to use"""
+    if codec not in CODECS:
+        raise AttributeError(
+            f"unknown codec '{codec}', must be one of {', '.join(CODECS)}"
+        )
+    if codec == "zstd":
+        _get_module("zstandard", codec)
+    return CODECS[codec] if level is None else level
+
+
+def export_index(codec: str, items: dict) -> dict:
+    """Returns the index of a static export's data file: the codec and the [start, end]
+    position of the data of each item (column or rows_as_columns entry) in the file"""
+    return {"codec": codec, "items": items}
+
+
+def read_export_index(index: dict) -> tuple[str, dict]:
+    """Returns the codec and the item positions in a static export's index. The index of
+    older exports only has the positions (of gzip data), which are all lists."""
+    if isinstance(index.get("codec"), str):
+        return index["codec"], index["items"]
+    return "gzip", index
+
+
+def _get_module(name: str, codec: str):
+    try:
+        return __import__(name)
+    except ImportError:
+        raise AttributeError(f"the {name} package is required for the {codec} codec")
+
+
+def compress_payload(data: bytes, codec="gzip", level=6) -> bytes:
+    if codec == "gzip":
+        # a gzip header without a timestamp, so the same data always gives the same output
+        return zlib.compress(data, level, wbits=31)
+    if codec == "zstd":
+        zstandard = _get_module("zstandard", codec)
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return bytes(data)
+
+
+class _RawCompressor:
+    def compress(self, data) -> bytes:
+        return bytes(data)
+
+    def flush(self) -> bytes:
+        return b""
+
+
+def compressobj(codec="gzip", level=6, size: Optional[int] = None):
+    """Returns an object to compress data a piece at a time, with `compress(data)` and
+    `flush()` methods (like `zlib.compressobj`). The output is decoded in the same way
+    as that of `compress_payload`. If given, size is the total size of the data."""
+    if codec == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if codec == "zstd":
+        zstandard = _get_module("zstandard", codec)
+        # the size is recorded in the frame, as with a single compress()
+        return zstandard.ZstdCompressor(level=level).compressobj(
+            size=-1 if size is None else size
+        )
+    return _RawCompressor()
+
+
+def _compress_batch(batch: list[bytes], codec: str, level: int) -> list[bytes]:
+    return [compress_payload(data, codec, level) for data in batch]
+
+
+# the minimum size of the batches of data compressed by each process in `compress_payloads`
+COMPRESS_BATCH_BYTES = 4_000_000
+
+
+def compress_payloads(
+    payloads: Iterable[bytes],
+    codec="gzip",
+    level=6,
+    workers=1,
+    executor: Optional[Executor] = None,
+) -> Iterator[bytes]:
+    """Compresses each of the payloads, in a pool of `workers` processes if workers > 1,
+    yielding them in the same order. Payloads are sent to the pool in batches (of at least
+    `COMPRESS_BATCH_BYTES`, unless they are the last) and only a few batches more than the
+    number of workers are compressed ahead of being consumed, to limit memory use.
+    If given, the pool is `executor` (which is not shut down) rather than a new one.
+    """
+    if workers <= 1:
+        for data in payloads:
+            yield compress_payload(data, codec, level)
+        return
+    if executor is None:
+        with ProcessPoolExecutor(workers) as executor:
+            yield from compress_payloads(payloads, codec, level, workers, executor)
+        return
+    pending = deque()
+    batch, size = [], 0
+    for data in payloads:
+        # buffers (e.g. memory-mapped data) have to be copied to be sent to the pool
+        batch.append(bytes(data))
+        size += len(batch[-1])
+        if size >= COMPRESS_BATCH_BYTES:
+            pending.append(executor.submit(_compress_batch, batch, codec, level))
+            batch, size = [], 0
+            if len(pending) > workers * 2:
+                yield from pending.popleft().result()
+    if batch:
+        pending.append(executor.submit(_compress_batch, batch, codec, level))
+    while pending:
+        yield from pending.popleft().result()
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class ByteCache:
+    """A least recently used cache of the data of columns (as sent to the client),
+    limited by the total number of bytes held rather than the number of items.
+    Items larger than a quarter of the budget are not cached, so that a single large
+    request can't evict everything else. Safe to use from multiple threads.
+
+    Args:
+        max_bytes (int, optional): The maximum size of the cached data. Default 256MB.
+    """
+
+    def __init__(self, max_bytes=256_000_000):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.metrics = {"hits": 0, "misses": 0, "evictions": 0}
+        self._items: OrderedDict[Hashable, bytes | memoryview] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes | memoryview]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.metrics["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.metrics["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value: bytes | memoryview):
+        nbytes = memoryview(value).nbytes
+        if nbytes > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= memoryview(old).nbytes
+            self._items[key] = value
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= memoryview(evicted).nbytes
+                self.metrics["evictions"] += 1
+
+    def discard(self, match):
+        """Removes the items whose keys match, e.g. `discard(lambda k: k[0] == dir)`"""
+        with self._lock:
+            for key in [k for k in self._items if match(k)]:
+                self.size -= memoryview(self._items.pop(key)).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.metrics["hits"] + self.metrics["misses"]
+            return {
+                **self.metrics,
+                "hit_rate": self.metrics["hits"] / lookups if lookups else 0.0,
+                "items": len(self._items),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# shared by all projects in the process, so the memory used is bounded overall
+column_cache = ByteCache()
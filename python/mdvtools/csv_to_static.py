@@ -3,8 +3,13 @@ import json
 import pandas as pd
 import argparse
 import os
-import gzip
 import shutil
+from mdvtools.binary_codecs import (
+    CODECS,
+    check_codec,
+    compress_payload,
+    export_index,
+)
 # import numpy as np
 
 parser = argparse.ArgumentParser(
@@ -21,6 +26,10 @@ parser.add_argument(
     "--group_by", help="group columns by regex", default=r"(.*?)(\d+)(.*)"
 )
 parser.add_argument("-s", "--separator", help="multitext separator", default=";")
+parser.add_argument(
+    "-c", "--codec", help="how the data is compressed", choices=CODECS, default="gzip"
+)
+parser.add_argument("--level", help="compression level", type=int, default=None)
 parse_multitext = True
 
 args = parser.parse_args()
@@ -104,12 +113,10 @@ def get_column_type(name):
 
 
 def get_quantiles(col):
-    qs = {}
-    for q in ["0.001", "0.01", "0.05"]:
-        q1 = col.quantile(float(q))
-        q2 = col.quantile(1 - float(q))
-        qs[q] = [q1, q2]
-    return qs
+    # all the quantiles in one call, so the column is only sorted once
+    levels = ["0.001", "0.01", "0.05"]
+    qs = col.quantile([p for q in levels for p in (float(q), 1 - float(q))]).tolist()
+    return {q: qs[i * 2 : i * 2 + 2] for i, q in enumerate(levels)}
 
 
 def get_text_indices(col):
@@ -217,6 +224,7 @@ def convert_data_to_binary(df):
     """
     Converts the dataframe to binary format.
     """
+    level = check_codec(args.codec, args.level)
     dfile = f"{outdir}/{basename}.gz"
     o = open(dfile, "wb")
     index = {}
@@ -233,7 +241,7 @@ def convert_data_to_binary(df):
         if type == "multitext":
             print(f"converting {name} {type} to uint16")
             df[name] = df[name].astype("uint16")
-        comp = gzip.compress(df[name].to_numpy().tobytes())
+        comp = compress_payload(df[name].to_numpy().tobytes(), args.codec, level)
         new_pos = current_pos + len(comp)
         index[name] = [current_pos, new_pos - 1]
         o.write(comp)
@@ -241,7 +249,7 @@ def convert_data_to_binary(df):
     o.close()
     ifile = dfile[: dfile.rindex(".")] + ".json"
     with open(ifile, "w") as f:
-        f.write(json.dumps(index))
+        f.write(json.dumps(export_index(args.codec, index)))
 
 
 def main():
@@ -0,0 +1,184 @@
+"""
+Serving (parts of) large files, e.g. the indexed track files (bam, bigbed, tabix)
+read by genome browsers with HTTP Range requests.
+
+File data is never read into memory as a whole: single ranges and whole files are
+returned with the server's `wsgi.file_wrapper` if it has one (which can send the file
+with the `sendfile` system call, without copying it into Python), otherwise in pieces.
+Multiple ranges are sent as a multipart/byteranges response.
+
+Project files are sent with validators (`send_cached_file`), so that clients only
+download them again when they have changed.
+"""
+
+import os
+import mimetypes
+from uuid import uuid4
+from typing import Optional
+from datetime import datetime, timezone
+from flask import Response, request, send_file
+from werkzeug.http import parse_range_header, http_date, is_resource_modified
+
+# the size of the pieces read from the file at a time
+PIECE_SIZE = 1_048_576
+
+
+def iter_file(f, start: int, length: int, piece_size=PIECE_SIZE):
+    """Yields `length` bytes of an open file from `start`, in pieces"""
+    f.seek(start)
+    while length > 0:
+        data = f.read(min(piece_size, length))
+        if not data:
+            break
+        length -= len(data)
+        yield data
+
+
+def _file_body(f, start: int, length: int, environ: dict):
+    f.seek(start)
+    if length <= PIECE_SIZE:
+        # e.g. the blocks of an index read by a genome browser
+        with f:
+            return [f.read(length)]
+    wrapper = environ.get("wsgi.file_wrapper")
+    if wrapper:
+        # servers don't send more than the Content-Length (PEP 3333)
+        return wrapper(f, PIECE_SIZE)
+
+    def body():
+        with f:
+            yield from iter_file(f, start, length)
+
+    return body()
+
+
+def get_byte_ranges(range_header: Optional[str], size: int):
+    """Returns the (start, stop) of each satisfiable range in the header, None if there
+    is no (valid) header, in which case the whole file should be sent, or an empty list
+    if none of the ranges can be satisfied"""
+    rng = parse_range_header(range_header) if range_header else None
+    if rng is None or rng.units != "bytes":
+        return None
+    ranges = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            # the last -start bytes
+            start, stop = max(size + start, 0), size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def send_file_range(
+    path: str, range_header: Optional[str], environ: dict, mimetype=None
+) -> Response:
+    """Returns a response with the ranges of the file in the Range header (206), the whole
+    file if there is no header (200), or 416 if none of the ranges are in the file.
+
+    Args:
+        path (str): The path to the file
+        range_header (str): The value of the request's Range header, if any
+        environ (dict): The request's WSGI environment
+        mimetype (str, optional): The file's mimetype, otherwise guessed from its name
+    """
+    size = os.stat(path).st_size
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    ranges = get_byte_ranges(range_header, size)
+    if ranges == []:
+        rv = Response(status=416)
+        rv.headers["Content-Range"] = f"bytes */{size}"
+        return rv
+    f = open(path, "rb")
+    if ranges is None or len(ranges) == 1:
+        start, stop = ranges[0] if ranges else (0, size)
+        rv = Response(
+            _file_body(f, start, stop - start, environ),
+            200 if ranges is None else 206,
+            mimetype=mimetype,
+            direct_passthrough=True,
+        )
+        if ranges:
+            rv.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        rv.content_length = stop - start
+    else:
+        boundary = uuid4().hex
+        parts = [
+            (
+                (
+                    f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                    f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+                ).encode(),
+                start,
+                stop,
+            )
+            for start, stop in ranges
+        ]
+        end = f"\r\n--{boundary}--\r\n".encode()
+
+        def body():
+            with f:
+                for header, start, stop in parts:
+                    yield header
+                    yield from iter_file(f, start, stop - start)
+                yield end
+
+        rv = Response(
+            body(),
+            206,
+            content_type=f"multipart/byteranges; boundary={boundary}",
+            direct_passthrough=True,
+        )
+        rv.content_length = sum(
+            len(h) + stop - start for h, start, stop in parts
+        ) + len(end)
+    rv.headers["Accept-Ranges"] = "bytes"
+    return rv
+
+
+# Cache-Control for each type of project file. Data and json files change when the
+# project is edited, so are always revalidated (which costs little with validators)
+CACHE_CONTROL = {
+    "data": "no-cache",
+    "json": "no-cache",
+    "images": "public, max-age=3600",
+}
+
+
+def file_etag(path) -> tuple[str, datetime]:
+    """Returns a (strong) ETag and the last modified time of a file, from its size and
+    modification time"""
+    st = os.stat(path)
+    mtime = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}", mtime
+
+
+def send_cached_file(path, cache_control: str, ranges=False):
+    """Sends a file with validators (ETag and Last-Modified), responding with 304 Not
+    Modified if the client already has the current version.
+
+    Args:
+        path (str): The path to the file
+        cache_control (str): The Cache-Control header (see `CACHE_CONTROL`)
+        ranges (bool, optional): Whether to respond to Range requests (see `send_file_range`)
+    """
+    if not os.path.isabs(path):
+        path = os.path.join(os.getcwd(), path)
+    etag, mtime = file_etag(path)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=mtime):
+        rv = Response(status=304)
+    else:
+        range_header = request.headers.get("Range") if ranges else None
+        # a partial response is only valid if the client's copy is the current one
+        if_range = request.headers.get("If-Range")
+        if range_header and if_range not in (None, f'"{etag}"'):
+            range_header = None
+        if range_header:
+            rv = send_file_range(path, range_header, request.environ)
+        else:
+            rv = send_file(path, etag=False, conditional=False)
+        rv.headers["Last-Modified"] = http_date(mtime)
+    rv.set_etag(etag)
+    rv.headers["Cache-Control"] = cache_control
+    return rv
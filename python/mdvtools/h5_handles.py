@@ -0,0 +1,201 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional
+import h5py
+import numpy
+
+logger = logging.getLogger(__name__)
+
+
+class H5Handles:
+    """Manages the handles to a project's h5 file.
+
+    Readers share a single long-lived read-only handle, which is closed when the
+    file is written to and reopened on the next read (or if the file has been
+    changed by another process). Reads in different threads run at the same time,
+    as the lock is only held while the handle is (re)opened, and the handle is only
+    closed once the reads using it are finished. Writers get a read/write handle, which is closed
+    after each write unless `hold_write()` is in effect, e.g. for the duration of
+    a batch of changes. Opening the file is retried a limited number of times,
+    with increasing delays, before giving up.
+
+    `version` is incremented whenever the file may have changed (a write handle is
+    released, or the file's modification time or size is different from when it was
+    last checked, e.g. if changed by another process), so it can be used to key
+    cached data.
+    """
+
+    def __init__(self, file: str, max_attempts=8, retry_delay=0.05):
+        self.file = file
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.metrics = {"opened": 0, "closed": 0, "reused": 0, "retries": 0}
+        self._version = 0
+        self._stamp = self._file_stamp()
+        self._read: Optional[h5py.File] = None
+        self._read_stamp: Optional[tuple[int, int]] = None
+        self._write: Optional[h5py.File] = None
+        self._hold = 0
+        self._lock = threading.RLock()
+        # the number of reads using the read handle, and those in the current thread
+        self._readers = 0
+        self._idle = threading.Condition(self._lock)
+        self._local = threading.local()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.file)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self._version += 1
+            return self._version
+
+    def _open(self, mode: str) -> h5py.File:
+        attempt = 0
+        while True:
+            try:
+                h5 = h5py.File(self.file, mode)
+                self.metrics["opened"] += 1
+                return h5
+            except Exception:
+                # certain environments seem to have issues with the handle not being closed instantly
+                # if there are multiple processes trying to access the file, this may also help
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                self.metrics["retries"] += 1
+                logger.warning("error opening h5 file, attempt %d...", attempt)
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+    def _close(self, h5: h5py.File):
+        h5.close()
+        self.metrics["closed"] += 1
+
+    def _wait_for_readers(self):
+        # reads in other threads must be finished before the read handle is closed
+        while self._readers > getattr(self._local, "reads", 0):
+            self._idle.wait()
+
+    def _close_read(self):
+        if self._read:
+            self._close(self._read)
+            self._read = None
+
+    def _close_write(self):
+        if self._write:
+            self._close(self._write)
+            self._write = None
+            self._version += 1
+
+    def _get_read_handle(self) -> h5py.File:
+        # called with the lock held
+        while True:
+            if self._write:
+                self.metrics["reused"] += 1
+                return self._write
+            if not os.path.exists(self.file):
+                # an empty project - create the file so it can be read
+                self._close(self._open("w"))
+            if self._read and self._file_stamp() != self._read_stamp:
+                # changed by another process
+                if self._readers > getattr(self._local, "reads", 0):
+                    # (anything may change while waiting)
+                    self._idle.wait()
+                    continue
+                self._close_read()
+            if self._read:
+                self.metrics["reused"] += 1
+            else:
+                self._read = self._open("r")
+                self._read_stamp = self._file_stamp()
+            return self._read
+
+    @contextmanager
+    def read(self):
+        """Yields a handle for reading, which must not be closed by the caller"""
+        with self._lock:
+            h5 = self._get_read_handle()
+            if h5 is self._write:
+                # a write handle (e.g. in a batch) is only used with the lock held
+                yield h5
+                return
+            self._readers += 1
+        self._local.reads = getattr(self._local, "reads", 0) + 1
+        try:
+            yield h5
+        finally:
+            self._local.reads -= 1
+            with self._lock:
+                self._readers -= 1
+                self._idle.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Yields a handle for writing, which must not be closed by the caller"""
+        with self._lock:
+            self._wait_for_readers()
+            if self._write:
+                self.metrics["reused"] += 1
+            else:
+                self._close_read()
+                self._write = self._open("a")
+            try:
+                yield self._write
+            finally:
+                self._version += 1
+                if self._hold == 0:
+                    self._close_write()
+
+    @contextmanager
+    def hold_write(self):
+        """Keeps any write handle open until the end of the block"""
+        with self._lock:
+            self._hold += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._hold -= 1
+                if self._hold == 0:
+                    self._close_write()
+
+    def close(self):
+        with self._lock:
+            self._wait_for_readers()
+            self._version += 1
+            self._close_read()
+            self._close_write()
+
+
+def dataset_buffer(dset: h5py.Dataset) -> memoryview:
+    """Returns the (raw) bytes of a dataset. Contiguous, unfiltered datasets are
+    memory-mapped from the file, so their data is only read when (and if) it is
+    accessed and is never copied. Others (chunked, compressed etc.) are read into
+    a single array, without the copy made by `tobytes()`."""
+    nbytes = dset.size * dset.dtype.itemsize
+    offset = dset.id.get_offset() if dset.chunks is None and nbytes else None
+    if offset is not None and dset.dtype.kind in "iufbS" and not dset.external:
+        if dset.file.mode != "r":
+            # any data written to this handle must be in the file
+            dset.file.flush()
+        mapped = numpy.memmap(
+            dset.file.filename,
+            dtype=numpy.uint8,
+            mode="r",
+            offset=offset,
+            shape=(nbytes,),
+        )
+        return memoryview(mapped)
+    data = numpy.ascontiguousarray(dset[()]).reshape(-1)
+    return memoryview(data.view(numpy.uint8))
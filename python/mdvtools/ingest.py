@@ -0,0 +1,414 @@
+"""
+Adding a datasource from a delimited text file a chunk of rows at a time, so that
+files much larger than memory can be added (see `MDVProject.add_datasource`).
+
+Each column has an ingester, which encodes the chunks as they are read and appends
+them to a resizable dataset, while keeping track of the column's values, quantiles etc.
+Text columns are first stored as indexes into the values in the order they are seen,
+and rewritten in the final format (which depends on how many values there are)
+once the whole file has been read. The temporary datasets are kept in a separate h5
+file, which is deleted afterwards, as the space they use in the project's h5 file
+would not be reclaimed.
+
+The datatype of columns which aren't supplied is deduced from the first chunk. If a
+later chunk has text in a column deduced to be numeric, an error is raised rather than
+the text becoming NaN.
+"""
+
+import os
+import h5py
+import numpy
+import pandas
+from abc import ABC, abstractmethod
+from typing import Iterable, Optional
+from .mdvproject import (
+    get_column_info,
+    encode_multitext,
+    check_multitext_values,
+    temp_file_name,
+    MAX_MULTITEXT_VALUES,
+)
+from .quantile_sketch import QuantileSketch
+from .storage import dataset_options, merge_storage_options
+
+# rows copied at a time when rewriting temporary datasets
+COPY_ROWS = 1_000_000
+
+NUMERIC_TYPES = ("integer", "double", "int32")
+
+
+def read_chunks(source, separator="\t", chunksize=100_000):
+    """Reads a delimited file (path or file object) a chunk at a time. All values are
+    read as strings (or NaN), so that a column's values are consistent between chunks.
+    """
+    return pandas.read_csv(source, sep=separator, chunksize=chunksize, dtype=str)
+
+
+def infer_types(chunk: pandas.DataFrame) -> pandas.DataFrame:
+    """Converts columns (of strings) which only contain numbers to numeric dtypes, so
+    that `get_column_info` can deduce each column's datatype from the first chunk"""
+    converted = {}
+    for c in chunk.columns:
+        try:
+            converted[c] = pandas.to_numeric(chunk[c])
+        except (ValueError, TypeError):
+            converted[c] = chunk[c]
+    return pandas.DataFrame(converted)
+
+
+class ColumnIngester(ABC):
+    def __init__(
+        self,
+        col: dict,
+        group: h5py.Group,
+        temp: h5py.Group,
+        storage: Optional[dict] = None,
+    ):
+        self.col = col
+        self.group = group
+        self.temp = temp
+        # the options for the final dataset
+        self.storage = merge_storage_options(storage, col.get("storage"))
+        self.length = 0
+
+    @abstractmethod
+    def add(self, data: pandas.Series):
+        """Adds the next chunk of the column's data"""
+
+    @abstractmethod
+    def finish(self):
+        """Writes the final dataset and fills in the column's metadata"""
+
+
+def _append(dset: h5py.Dataset, data: numpy.ndarray):
+    start = dset.shape[0]
+    dset.resize(start + len(data), axis=0)
+    dset[start:] = data
+
+
+class NumericIngester(ColumnIngester):
+    def __init__(self, col, group, temp, storage=None, skip_column_clean=False):
+        super().__init__(col, group, temp, storage)
+        self.skip_column_clean = skip_column_clean
+        self.dtype = numpy.int32 if col["datatype"] == "int32" else numpy.float32
+        # written directly to its final (chunked) dataset
+        self.dset = group.create_dataset(
+            col["field"],
+            (0,),
+            maxshape=(None,),
+            dtype=self.dtype,
+            **dataset_options(self.storage, 0, resizable=True),
+        )
+        self.sketch = QuantileSketch()
+
+    def add(self, data):
+        clean = (
+            data if self.skip_column_clean else pandas.to_numeric(data, errors="coerce")
+        )
+        arr = numpy.asarray(clean, dtype=self.dtype)
+        _append(self.dset, arr)
+        self.length += len(arr)
+        self.sketch.add(arr[numpy.isfinite(arr)])
+
+    def finish(self):
+        if self.sketch.count == 0:
+            raise ValueError(f"no numeric values in column '{self.col['field']}'")
+        s = self.sketch
+        self.col["minMax"] = [
+            float(str(self.dtype(s.min))),
+            float(str(self.dtype(s.max))),
+        ]
+        self.col["quantiles"] = s.quantiles()
+        s.save(self.dset)
+
+
+class UniqueIngester(ColumnIngester):
+    def __init__(self, col, group, temp, storage=None):
+        super().__init__(col, group, temp, storage)
+        self.dset = temp.create_dataset(
+            col["field"],
+            (0,),
+            maxshape=(None,),
+            dtype=h5py.string_dtype("utf-8"),
+            chunks=True,
+        )
+        self.max_len = 0
+
+    def add(self, data):
+        data = data.fillna("NaN").astype(str)
+        if len(data):
+            self.max_len = max(self.max_len, int(data.str.len().max()))
+        _append(self.dset, data.to_numpy(dtype=object))
+        self.length += len(data)
+
+    def finish(self):
+        self.col["datatype"] = "unique"
+        self.col["stringLength"] = self.max_len
+        utf8_type = h5py.string_dtype("utf-8", self.max_len)
+        out = self.group.create_dataset(
+            self.col["field"],
+            self.length,
+            dtype=utf8_type,
+            **dataset_options(self.storage, self.length),
+        )
+        for s in range(0, self.length, COPY_ROWS):
+            out[s : s + COPY_ROWS] = self.dset.asstr()[s : s + COPY_ROWS]
+
+
+class TextIngester(ColumnIngester):
+    """Stores text as indexes into the values, in the order they were first seen,
+    switching to storing the strings themselves if there are too many values"""
+
+    def __init__(self, col, group, temp, storage=None):
+        super().__init__(col, group, temp, storage)
+        self.dset = temp.create_dataset(
+            col["field"], (0,), maxshape=(None,), dtype=numpy.uint32, chunks=True
+        )
+        # supplied values keep their order
+        self.fixed_order = bool(col.get("values"))
+        self.values: list = list(col.get("values", []))
+        self.index = {v: i for i, v in enumerate(self.values)}
+        self.counts = numpy.zeros(len(self.values), dtype=numpy.int64)
+        self.unique: Optional[UniqueIngester] = None
+
+    def add(self, data):
+        if self.unique:
+            self.unique.add(data)
+            return
+        data = data.fillna("NaN")
+        codes, uniques = pandas.factorize(data)
+        mapping = numpy.empty(len(uniques), dtype=numpy.uint32)
+        for i, v in enumerate(uniques):
+            n = self.index.get(v)
+            if n is None:
+                n = self.index[v] = len(self.values)
+                self.values.append(v)
+            mapping[i] = n
+        encoded = mapping[codes]
+        counts = numpy.bincount(encoded, minlength=len(self.values))
+        counts[: len(self.counts)] += self.counts
+        self.counts = counts
+        _append(self.dset, encoded)
+        self.length += len(encoded)
+        if len(self.values) > 65536:
+            self._switch_to_unique()
+
+    def _switch_to_unique(self):
+        values = numpy.array([str(x) for x in self.values], dtype=object)
+        codes_name = self.col["field"] + "__codes"
+        self.temp.move(self.col["field"], codes_name)
+        codes = self.temp[codes_name]
+        self.unique = UniqueIngester(self.col, self.group, self.temp, self.storage)
+        for s in range(0, self.length, COPY_ROWS):
+            self.unique.add(pandas.Series(values[codes[s : s + COPY_ROWS]]))
+        del self.temp[codes_name]
+        self.values = []
+        self.index = {}
+
+    def finish(self):
+        if self.unique:
+            self.unique.finish()
+            return
+        n = len(self.values)
+        t8 = n < 257
+        self.col["datatype"] = "text" if t8 else "text16"
+        dtype = numpy.ubyte if t8 else numpy.uint16
+        if self.fixed_order:
+            order = numpy.arange(n)
+        else:
+            # most frequent first, as with value_counts()
+            order = numpy.argsort(-self.counts, kind="stable")
+        remap = numpy.empty(n, dtype=numpy.uint32)
+        remap[order] = numpy.arange(n)
+        out = self.group.create_dataset(
+            self.col["field"],
+            self.length,
+            dtype=dtype,
+            **dataset_options(self.storage, self.length),
+        )
+        for s in range(0, self.length, COPY_ROWS):
+            out[s : s + COPY_ROWS] = remap[self.dset[s : s + COPY_ROWS]]
+        self.col["values"] = [str(self.values[i]) for i in order]
+
+
+class MultitextIngester(ColumnIngester):
+    """Stores tags as indexes into the values in the order they were first seen, in a
+    2D dataset which is widened if a row has more tags than seen so far"""
+
+    EMPTY = numpy.iinfo(numpy.uint32).max
+
+    def __init__(self, col, group, temp, storage=None):
+        super().__init__(col, group, temp, storage)
+        self.delim = col.get("delimiter", ",")
+        self.dset = temp.create_dataset(
+            col["field"],
+            (0, 0),
+            maxshape=(None, None),
+            dtype=numpy.uint32,
+            chunks=(COPY_ROWS // 16, 4),
+            fillvalue=self.EMPTY,
+        )
+        self.values: list[str] = []
+        self.index: dict[str, int] = {}
+
+    def add(self, data):
+        ndata, values, maxv = encode_multitext(data, self.delim)
+        # map the chunk's indexes to overall ones, with the chunk's empty marker
+        # mapped by the last entry
+        mapping = numpy.empty(len(values) + 1, dtype=numpy.uint32)
+        mapping[-1] = self.EMPTY
+        for i, v in enumerate(values):
+            n = self.index.get(v)
+            if n is None:
+                n = self.index[v] = len(self.values)
+                self.values.append(v)
+            mapping[i] = n
+        check_multitext_values(len(self.values))
+        codes = ndata.astype(numpy.int64)
+        codes[ndata == MAX_MULTITEXT_VALUES] = len(values)
+        rows = mapping[codes].reshape(len(data), maxv)
+        width = max(self.dset.shape[1], maxv)
+        self.dset.resize((self.length + len(data), width))
+        if maxv:
+            self.dset[self.length :, :maxv] = rows
+        self.length += len(data)
+
+    def finish(self):
+        width = self.dset.shape[1]
+        order = sorted(range(len(self.values)), key=lambda i: self.values[i])
+        dtype = numpy.uint16
+        remap = numpy.full(len(self.values) + 1, MAX_MULTITEXT_VALUES, dtype=dtype)
+        remap[order] = numpy.arange(len(self.values))
+        size = self.length * width
+        out = self.group.create_dataset(
+            self.col["field"], size, dtype=dtype, **dataset_options(self.storage, size)
+        )
+        for s in range(0, self.length, COPY_ROWS):
+            block = self.dset[s : s + COPY_ROWS].astype(numpy.int64)
+            # the empty marker maps to the last entry of remap
+            block[block == self.EMPTY] = len(self.values)
+            block = numpy.sort(remap[block], axis=1)
+            out[s * width : s * width + block.size] = block.reshape(-1)
+        self.col["values"] = [self.values[i] for i in order]
+        self.col["stringLength"] = width
+
+
+def ingest_chunks(
+    group: h5py.Group,
+    chunks: Iterable[pandas.DataFrame],
+    columns: Optional[list],
+    supplied_columns_only=False,
+    skip_column_clean=False,
+    storage: Optional[dict] = None,
+):
+    """Adds the data in the chunks (dataframes of strings, see `read_chunks`) to the group.
+    The datatype of columns which aren't supplied is deduced from the first chunk, and an
+    AttributeError is raised if a later chunk has text in a column deduced to be numeric.
+    Datasets are created with the storage options (see `mdvtools.storage`), unless
+    overridden by a column's own options.
+
+    Returns:
+        (columns, size, errors): the metadata of the columns added, the number of rows and
+        a dictionary of the fields of any columns which could not be added and the exceptions raised
+    """
+    temp_file = temp_file_name(group.file.filename)
+    try:
+        with h5py.File(temp_file, "w") as temp:
+            columns, size, errors = _ingest_chunks(
+                group,
+                temp,
+                chunks,
+                columns,
+                supplied_columns_only,
+                skip_column_clean,
+                storage,
+            )
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+    for field in errors:
+        if field in group:
+            del group[field]
+    columns = [x for x in (columns or []) if x["field"] not in errors]
+    return columns, size, errors
+
+
+def _ingest_chunks(
+    group: h5py.Group,
+    temp: h5py.File,
+    chunks: Iterable[pandas.DataFrame],
+    columns: Optional[list],
+    supplied_columns_only: bool,
+    skip_column_clean: bool,
+    storage: Optional[dict],
+):
+    supplied = {c.get("field") or c["name"] for c in columns or []}
+    ingesters: dict[str, ColumnIngester] = {}
+    errors: dict[str, Exception] = {}
+    # numeric columns whose datatype was deduced from the first chunk
+    inferred: set[str] = set()
+    size = 0
+    for chunk in chunks:
+        if size == 0:
+            columns = get_column_info(
+                columns, infer_types(chunk), supplied_columns_only
+            )
+            if not columns:
+                raise AttributeError("no columns to add")
+            for col in columns:
+                if col["field"] not in supplied and col["datatype"] in NUMERIC_TYPES:
+                    inferred.add(col["field"])
+                try:
+                    ingesters[col["field"]] = _get_ingester(
+                        col, group, temp, storage, skip_column_clean
+                    )
+                except Exception as e:
+                    errors[col["field"]] = e
+            first_rows = len(chunk)
+        for field, ing in ingesters.items():
+            if field in errors:
+                continue
+            data = chunk[field]
+            if field in inferred and size:
+                data = check_numeric(data, field, first_rows)
+            try:
+                ing.add(data)
+            except Exception as e:
+                errors[field] = e
+        size += len(chunk)
+    if size == 0:
+        raise AttributeError("no rows to add")
+    for field, ing in ingesters.items():
+        if field in errors:
+            continue
+        try:
+            ing.finish()
+        except Exception as e:
+            errors[field] = e
+    return columns, size, errors
+
+
+def check_numeric(data: pandas.Series, field: str, first_rows: int) -> pandas.Series:
+    """Returns the (string) data of a column deduced to be numeric as numbers, raising an
+    AttributeError if any of the values are not numbers"""
+    try:
+        return pandas.to_numeric(data)
+    except (ValueError, TypeError):
+        clean = pandas.to_numeric(data, errors="coerce")
+        bad = data[clean.isna() & data.notna()]
+        raise AttributeError(
+            f"column '{field}' is numeric in the first {first_rows} rows, but row"
+            f" {bad.index[0] + 1} has the value '{bad.iloc[0]}' - the column's"
+            " datatype needs to be supplied"
+        ) from None
+
+
+def _get_ingester(col, group, temp, storage, skip_column_clean) -> ColumnIngester:
+    dt = col["datatype"]
+    if dt == "text" or dt == "text16":
+        return TextIngester(col, group, temp, storage)
+    elif dt == "unique":
+        return UniqueIngester(col, group, temp, storage)
+    elif dt == "multitext":
+        return MultitextIngester(col, group, temp, storage)
+    return NumericIngester(col, group, temp, storage, skip_column_clean)
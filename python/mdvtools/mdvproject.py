@@ -4,21 +4,42 @@ import h5py
 import numpy
 import pandas
 import json
-import gzip
+import hashlib
 import shlex
 import subprocess
 import fasteners
 import warnings
 import shutil
+import threading
+import time
 import random
 import string
 from os.path import join, split, exists
 from pathlib import Path
 from werkzeug.utils import secure_filename
 from shutil import copytree, ignore_patterns, copyfile
-from typing import Optional, NewType, List, Union, Any
+from typing import Optional, NewType, List, Union, Any, Iterator, Iterable, Callable
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import functools
 from .charts.view import View
-import time
+from .h5_handles import H5Handles, dataset_buffer
+from .byte_cache import ByteCache, column_cache
+from .binary_codecs import (
+    check_codec,
+    compress_payloads,
+    compressobj,
+    export_index,
+    read_export_index,
+)
+from .quantile_sketch import QuantileSketch, QUANTILES
+from .storage import (
+    check_storage_options,
+    copy_h5,
+    dataset_options,
+    merge_storage_options,
+)
 import copy
 
 DataSourceName = str  # NewType("DataSourceName", str)
@@ -82,30 +103,113 @@ class MDVProject:
             with open(self.statefile, "w") as o:
                 o.write(json.dumps({"all_views": []}))
         self._lock = fasteners.InterProcessReaderWriterLock(join(dir, "lock"))
-
+        # parsed json metadata, only re-read when the files change on disk
+        self._datasources_cache = JsonFileCache(self.datasourcesfile)
+        self._views_cache = JsonFileCache(self.viewsfile)
+        self._state_cache = JsonFileCache(self.statefile)
+        self._batch_depth = 0
+        self._h5 = H5Handles(self.h5file)
+        # the data sent to the client of columns which are slow to read (compressed,
+        # subgroups etc.), shared by all projects - can be set to None to disable
+        self.byte_cache: Optional[ByteCache] = column_cache
+        self._cache_id = object()
+        self._cached_version = 0
+        # name -> position lookups for datasources and (per datasource) column fields
+        self._datasource_index = NameIndex("name")
+        self._field_indexes: dict[str, NameIndex] = {}
+
+    # the public properties return copies, so callers can modify them freely
+    # internal methods use the cached objects directly and save them explicitly
     @property
     def datasources(self):
-        return get_json(self.datasourcesfile)
+        return copy_json(self._datasources_cache.get())
 
     @datasources.setter
     def datasources(self, value):
-        save_json(self.datasourcesfile, value)
+        self._datasources_cache.set(value)
+        self._datasource_index.invalidate()
+        self._field_indexes.clear()
 
     @property
     def views(self) -> dict[str, View]:
-        return get_json(self.viewsfile)
+        return copy_json(self._views_cache.get())
 
     @views.setter
     def views(self, value):
-        save_json(self.viewsfile, value)
+        self._views_cache.set(value)
 
     @property
     def state(self):
-        return get_json(self.statefile)
+        return copy_json(self._state_cache.get())
 
     @state.setter
     def state(self, value):
-        save_json(self.statefile, value)
+        self._state_cache.set(value)
+
+    @property
+    def storage_options(self) -> Optional[dict]:
+        """The default chunking/compression of datasets added to the h5 file
+        (see `mdvtools.storage`). Changing them only affects new datasets, use
+        `repack` to apply them to existing ones."""
+        return copy_json(self._state_cache.get().get("storage"))
+
+    @storage_options.setter
+    def storage_options(self, options: Optional[dict]):
+        check_storage_options(options)
+        state = self._state_cache.get()
+        if options:
+            state["storage"] = copy_json(options)
+        else:
+            state.pop("storage", None)
+        self._state_cache.save()
+
+    def _get_storage_options(self, column: Optional[dict] = None):
+        options = self._state_cache.get().get("storage")
+        return merge_storage_options(options, column and column.get("storage"))
+
+    @contextmanager
+    def batch(self):
+        """Defers writing of the project's metadata (datasources, views and state)
+        until the end of the block, when each changed file is written once. If an
+        exception is raised inside the block, the metadata changes are discarded.
+        Changes to the data in the h5 file are not rolled back, but the file is
+        kept open for writing until the end of the block.
+        Batches can be nested, in which case only the outermost one writes the files.
+
+        Example:
+            with project.batch():
+                for col in columns:
+                    project.set_column("cells", col, data[col["field"]])
+        """
+        caches = [self._datasources_cache, self._views_cache, self._state_cache]
+        self._batch_depth += 1
+        if self._batch_depth == 1:
+            for c in caches:
+                c.deferred = True
+        try:
+            with self._h5.hold_write():
+                yield self
+        except BaseException:
+            if self._batch_depth == 1:
+                for c in caches:
+                    c.deferred = False
+                    c.invalidate()
+            raise
+        else:
+            if self._batch_depth == 1:
+                for c in caches:
+                    c.deferred = False
+                # every file is written, even if writing one of them fails
+                error = None
+                for c in caches:
+                    try:
+                        c.flush()
+                    except Exception as e:
+                        error = error or e
+                if error:
+                    raise error
+        finally:
+            self._batch_depth -= 1
 
     def set_editable(self, edit):
         c = self.state
@@ -115,38 +219,92 @@ class MDVProject:
     def lock(self, type="read"):
         return self._lock.read_lock() if type == "read" else self._lock.write_lock()
 
-    def get_column_metadata(self, datasource, column):
-        ds = self.get_datasource_metadata(datasource)
-        col = [x for x in ds["columns"] if x["field"] == column]
-        if len(col) == 0:
+    def _get_datasource(self, name):
+        """Returns the cached (not copied) metadata of the datasource - any changes
+        should be followed by a call to `_save_datasources()`"""
+        mds = self._datasources_cache.get()
+        i = self._datasource_index.find(mds, name)
+        if i == -1:
+            raise AttributeError(f"{name} datasource not found")
+        return mds[i]
+
+    def _get_field_index(self, datasource) -> "NameIndex":
+        index = self._field_indexes.get(datasource)
+        if not index:
+            index = self._field_indexes[datasource] = NameIndex("field")
+        return index
+
+    def _get_column(self, datasource, column):
+        """Returns the cached (not copied) metadata of the column"""
+        cols = self._get_datasource(datasource)["columns"]
+        i = self._get_field_index(datasource).find(cols, column)
+        if i == -1:
             raise AttributeError(
                 f"column {column} not found in {datasource} datasource"
             )
-        return col[0]
+        return cols[i]
+
+    def _replace_column(self, datasource, column):
+        """Replaces the column with the same field in the cached metadata
+        (or adds it if not present)"""
+        cols = self._get_datasource(datasource)["columns"]
+        self._get_field_index(datasource).replace(cols, column)
+
+    def _save_datasources(self):
+        self._datasources_cache.save()
+
+    def get_column_metadata(self, datasource, column):
+        return copy_json(self._get_column(datasource, column))
 
     def set_column_metadata(self, datasource, column, parameter, value):
-        ds = self.get_datasource_metadata(datasource)
-        col_index = [c for c, x in enumerate(ds["columns"]) if x["field"] == column]
-        if len(col_index) == 0:
-            raise AttributeError(
-                f"column {column} not found in {datasource} datasource"
-            )
-        ds["columns"][col_index[0]][parameter] = value
-        self.set_datasource_metadata(ds)
+        col = self._get_column(datasource, column)
+        col[parameter] = copy_json(value)
+        if parameter == "field":
+            self._get_field_index(datasource).invalidate()
+        self._save_datasources()
+
+    def get_datasource_as_dataframe(
+        self,
+        datasource: str,
+        columns: Optional[Cols] = None,
+        rows: Optional[slice | numpy.ndarray | list] = None,
+        categorical=True,
+    ) -> pandas.DataFrame:
+        """Gets the data in a datasource as a pandas dataframe, with the column names as headers.
 
-    def get_datasource_as_dataframe(self, datasource: str) -> pandas.DataFrame:
+        Args:
+            datasource (str): The name of the datasource.
+            columns (list, optional): The ids (fields) of the columns to include. Default is all columns.
+            rows (slice|array, optional): A slice, boolean mask or list of indexes specifying which rows
+                to include. Default is all rows.
+            categorical (bool, optional): If True (default), text columns will be pandas Categoricals,
+                built directly from the stored indexes, otherwise they will contain strings.
+        """
         ## nb, I'd quite like to have some 'DataSourceName' type alias so we know it's not just any string...
-        ds = self.get_datasource_metadata(datasource)
-        df = pandas.DataFrame()
-        for c in ds["columns"]:
-            data = self.get_column(datasource, c["field"])
-            df[c["name"]] = data
-        return df
+        if columns is None:
+            cols = self._get_datasource(datasource)["columns"]
+        else:
+            cols = [self._get_column(datasource, c) for c in columns]
+        data = {}
+        with self._get_h5_handle(read_only=True) as h5:
+            gr = h5[datasource]
+            if not isinstance(gr, h5py.Group):
+                raise AttributeError(
+                    f"cannot open datasource '{datasource}' in h5 file"
+                )
+            for c in cols:
+                dset = gr[c["field"]]
+                assert isinstance(dset, h5py.Dataset)
+                # multitext columns have stringLength values per row
+                width = c["stringLength"] if c["datatype"] == "multitext" else 1
+                raw_data = read_rows(dset, rows, width)
+                data[c["name"]] = decode_column(c, raw_data, categorical)
+        return pandas.DataFrame(data, copy=False)
 
     def check_columns_exist(self, datasource, columns):
-        md = self.get_datasource_metadata(datasource)
-        all_cols = set([x["field"] for x in md["columns"]])
-        return [x for x in columns if x not in all_cols]
+        cols = self._get_datasource(datasource)["columns"]
+        index = self._get_field_index(datasource)
+        return [x for x in columns if index.find(cols, x) == -1]
 
     def set_interactions(
         self,
@@ -212,19 +370,12 @@ class MDVProject:
             )
 
     def get_datasource_metadata(self, name):
-        ds = [x for x in self.datasources if x["name"] == name]
-        if len(ds) == 0:
-            raise AttributeError(f"{name} datasource not found")
-        return ds[0]
+        return copy_json(self._get_datasource(name))
 
     def set_datasource_metadata(self, ds):
-        mds = self.datasources
-        index = [c for c, x in enumerate(mds) if x["name"] == ds["name"]]
-        if len(index) == 0:
-            mds.append(ds)
-        else:
-            mds[index[0]] = ds
-        self.datasources = mds
+        mds = self._datasources_cache.get()
+        self._datasource_index.replace(mds, copy_json(ds))
+        self._save_datasources()
 
     def add_images_to_datasource(
         self,
@@ -269,47 +420,102 @@ class MDVProject:
         image_meta = ds_metadata["images"][p[1]]
         return join(image_meta["original_folder"], filename)
 
-    def _get_h5_handle(self, read_only=False, attempt=0) -> h5py.File:
-        mode = "r"
-        if not exists(self.h5file):
-            mode = "w"
-        elif not read_only:
-            mode = "a"
+    def _get_h5_handle(self, read_only=False):
+        """Returns a context manager giving a handle to the h5 file. Handles are shared,
+        so should not be closed by the caller.
+
+        Example:
+            with self._get_h5_handle(read_only=True) as h5:
+                data = h5[datasource][column][:]
+        """
+        return self._h5.read() if read_only else self._h5.write()
+
+    def get_h5_metrics(self):
+        """Returns the number of times the h5 file has been opened, closed etc."""
+        return dict(self._h5.metrics)
+
+    def close(self):
+        """Closes any open handles to the h5 file"""
+        self._h5.close()
+
+    def repack(self, storage_options: Optional[dict] = None):
+        """Rewrites the h5 file with every dataset stored using the project's storage
+        options (or the column's own options). This also reclaims the space used by
+        deleted or replaced data, which is never released from an h5 file.
+
+        Args:
+            storage_options (dict, optional): If supplied, the project's storage options
+                (see `storage_options`) are set to these first.
+        """
+        if storage_options is not None:
+            self.storage_options = storage_options
+        columns = {
+            (ds["name"], c["field"]): c
+            for ds in self._datasources_cache.get()
+            for c in ds["columns"]
+        }
+
+        def get_options(name: str):
+            return self._get_storage_options(columns.get(tuple(name.split("/"))))
+
+        temp = temp_file_name(self.h5file)
         try:
-            return h5py.File(self.h5file, mode)
-        except Exception:
-            # certain environments seem to have issues with the handle not being closed instantly
-            # if there is a better way to do this, please change it
-            # if there are multiple processes trying to access the file, this may also help
-            # (although if they're trying to write, who knows what bad things may happen to the project in general)
-            time.sleep(0.1)
-            attempt += 1
-            print(f"error opening h5 file, attempt {attempt}...")
-            return self._get_h5_handle(read_only, attempt)
-
-    def get_column(self, datasource: str, column, raw=False):
-        cm = self.get_column_metadata(datasource, column)
-        h5 = self._get_h5_handle()
-        gr = h5[datasource]
-        if not isinstance(gr, h5py.Group):
-            h5.close()
-            raise AttributeError(f"cannot open datasource '{datasource}' in h5 file")
-        raw_data = numpy.array(gr[column])
+            with self._get_h5_handle(read_only=True) as h5, h5py.File(temp, "w") as out:
+                copy_h5(h5, out, get_options)
+            self._h5.close()
+            os.replace(temp, self.h5file)
+        finally:
+            if exists(temp):
+                os.remove(temp)
+
+    def get_column(self, datasource: str, column, raw=False, as_array=False):
+        """Gets the values in a column
+
+        Args:
+            datasource (str): The name of the datasource.
+            column (str): The id (field) of the column.
+            raw (bool, optional): If True, the data is returned as stored in the h5 file
+                e.g. indexes into the column's values for text columns
+            as_array (bool, optional): If True, text columns are returned as a pandas
+                Categorical and all others as a numpy array, rather than as a list.
+        """
+        cm = self._get_column(datasource, column)
+        with self._get_h5_handle(read_only=True) as h5:
+            gr = h5[datasource]
+            if not isinstance(gr, h5py.Group):
+                raise AttributeError(
+                    f"cannot open datasource '{datasource}' in h5 file"
+                )
+            raw_data = numpy.array(gr[column])
         if raw:
             return raw_data
-        dt = cm["datatype"]
-        if dt == "text" or dt == "text16":
-            data = [cm["values"][x] for x in raw_data]
-        elif dt == "multitext":
-            chunksize = raw_data.shape[0] / cm["stringLength"]
-            arr = numpy.split(raw_data, chunksize)
-            data = [",".join([cm["values"][x] for x in y if x != 65535]) for y in arr]
-        elif dt == "unique":
-            data = [x.decode() for x in raw_data]
-        else:
-            data = list(raw_data)
-        h5.close()
-        return data
+        if as_array:
+            return decode_column(cm, raw_data)
+        data = decode_column(cm, raw_data, as_categorical=False)
+        # numeric values are returned as numpy scalars, as they always have been
+        return data.tolist() if data.dtype == object else list(data)
+
+    def get_column_sketch(self, datasource: str, column: str) -> QuantileSketch:
+        """Gets the quantile sketch of a numeric column, which can be merged with
+        sketches of other data, e.g. to estimate quantiles across datasources.
+        If no sketch was stored when the column was added, one is made from its data.
+
+        Args:
+            datasource (str): The name of the datasource.
+            column (str): The id (field) of the column.
+        """
+        cm = self._get_column(datasource, column)
+        if cm["datatype"] not in ("double", "integer", "int32"):
+            raise AttributeError(f"column '{column}' in {datasource} is not numeric")
+        with self._get_h5_handle(read_only=True) as h5:
+            dset = h5[datasource][column]
+            sketch = QuantileSketch.load(dset)
+            if sketch:
+                return sketch
+            data = numpy.array(dset)
+        sketch = QuantileSketch()
+        sketch.add(data[numpy.isfinite(data)])
+        return sketch
 
     def set_column_with_raw_data(self, datasource, column, raw_data):
         """Adds or updates a column with raw data
@@ -318,25 +524,20 @@ class MDVProject:
             column (dict): The complete metadata for the column
             raw_data (list|array): The raw binary data for the column
         """
-        h5 = self._get_h5_handle()
         cid = column["field"]
-        ds = h5[datasource]
-        if not isinstance(ds, h5py.Group):
-            raise AttributeError(f"{datasource} is not a group")
-        if ds.get(cid):
-            del ds[cid]
-        dt = numpy_dtypes.get(column["datatype"])
-        if not dt:
-            dt = h5py.string_dtype("utf-8", column["stringLength"])
-        ds.create_dataset(cid, len(raw_data), data=raw_data, dtype=dt)
-        ds = self.get_datasource_metadata(datasource)
-        cols = ds["columns"]
-        ind = [c for c, x in enumerate(cols) if x["field"] == cid]
-        if len(ind) == 0:
-            cols.append(column)
-        else:
-            cols[ind[0]] = column
-        self.set_datasource_metadata(ds)
+        with self._get_h5_handle() as h5:
+            ds = h5[datasource]
+            if not isinstance(ds, h5py.Group):
+                raise AttributeError(f"{datasource} is not a group")
+            if ds.get(cid):
+                del ds[cid]
+            dt = numpy_dtypes.get(column["datatype"])
+            if not dt:
+                dt = h5py.string_dtype("utf-8", column["stringLength"])
+            opts = dataset_options(self._get_storage_options(column), len(raw_data))
+            ds.create_dataset(cid, len(raw_data), data=raw_data, dtype=dt, **opts)
+        self._replace_column(datasource, copy_json(column))
+        self._save_datasources()
 
     def set_column(self, datasource, column, data):
         """Adds (or replaces an existing column) with the data supplied
@@ -353,25 +554,27 @@ class MDVProject:
             column = {"name": column}
         if not column.get("field"):
             column["field"] = column["name"]
-        ds = self.get_datasource_metadata(datasource)
-        ind = [c for c, x in enumerate(ds["columns"]) if x["field"] == column["field"]]
-        col_exists = len(ind) > 0
+        # check the datasource exists before writing any data
+        self._get_datasource(datasource)
         li = pandas.Series(data)
         if not column.get("datatype"):
             column["datatype"] = datatype_mappings.get(str(li.dtype), "text")
-        h5 = self._get_h5_handle()
-        gr = h5[datasource]
-        if not isinstance(gr, h5py.Group):
-            raise AttributeError(f"{datasource} is not a group")
-        if gr.get(column["field"]):
-            del gr[column["field"]]
-        add_column_to_group(column, li, gr, len(li), self.skip_column_clean)
-        h5.close()
-        if col_exists:
-            ds["columns"][ind[0]] = column
-        else:
-            ds["columns"].append(column)
-        self.set_datasource_metadata(ds)
+        with self._get_h5_handle() as h5:
+            gr = h5[datasource]
+            if not isinstance(gr, h5py.Group):
+                raise AttributeError(f"{datasource} is not a group")
+            if gr.get(column["field"]):
+                del gr[column["field"]]
+            add_column_to_group(
+                column,
+                li,
+                gr,
+                len(li),
+                self.skip_column_clean,
+                self._get_storage_options(column),
+            )
+        self._replace_column(datasource, copy_json(column))
+        self._save_datasources()
 
     def remove_column(self, datasource, column):
         """Removes the specified column
@@ -380,18 +583,19 @@ class MDVProject:
             datasource (str): The name of the data source.
             column (str): The id (field) of the column.
         """
-        ds = self.get_datasource_metadata(datasource)
-        cols = [x for x in ds["columns"] if x["field"] != column]
-        if len(cols) == len(ds["columns"]):
+        ds = self._get_datasource(datasource)
+        if self._get_field_index(datasource).find(ds["columns"], column) == -1:
             warnings.warn(f"deleting non existing column: {column} from {datasource}")
             return
+        cols = [x for x in ds["columns"] if x["field"] != column]
+        with self._get_h5_handle() as h5:
+            gr = h5[datasource]
+            if not isinstance(gr, h5py.Group):
+                raise AttributeError(f"{datasource} is not a group")
+            del gr[column]
         ds["columns"] = cols
-        h5 = self._get_h5_handle()
-        gr = h5[datasource]
-        if not isinstance(gr, h5py.Group):
-            raise AttributeError(f"{datasource} is not a group")
-        del gr[column]
-        self.set_datasource_metadata(ds)
+        self._get_field_index(datasource).invalidate()
+        self._save_datasources()
 
     def add_annotations(
         self,
@@ -424,20 +628,33 @@ class MDVProject:
             raise AttributeError(
                 f"index column {index_col} not found in {datasource} datasource"
             )
-        # py-right: dictionary key must be hashable
-        newdf = pandas.DataFrame({index_col: self.get_column(datasource, index_col)})  # type: ignore
-        h5 = self._get_h5_handle()
-        gr = h5[datasource]
-        assert isinstance(gr, h5py.Group)
-        for c in columns:
-            d = {k: v for k, v in zip(data.index, data[c["field"]])}
-            # v slow - needs improving
-            # py-right: `Argument of type "Series | Unknown | DataFrame" cannot be assigned to parameter "data" of type "Series"`
-            ncol = newdf.apply(lambda row: d.get(row[0], missing_value), axis=1)
-            add_column_to_group(c, ncol, gr, len(ncol), self.skip_column_clean)
-            ds["columns"].append(c)
-        self.set_datasource_metadata(ds)
-        h5.close()
+        # as with a dictionary, the last row with a given index value is used
+        data = data[~data.index.duplicated(keep="last")]
+        # the row in data for each row of the datasource (-1 if missing)
+        index = self.get_column(datasource, index_col, as_array=True)
+        if isinstance(index, pandas.Categorical):
+            # only look up each of the values once
+            rows = data.index.get_indexer(index.categories)[index.codes]
+        else:
+            rows = data.index.get_indexer(index)
+        size = len(rows)
+        with self.batch(), self._get_h5_handle() as h5:
+            gr = h5[datasource]
+            assert isinstance(gr, h5py.Group)
+            for c in columns:
+                # joined one at a time, so only one full length column is in memory
+                ncol = join_column(c, data[c["field"]], rows, missing_value)
+                ncol = pandas.Series(ncol, copy=False)
+                add_column_to_group(
+                    c,
+                    ncol,
+                    gr,
+                    size,
+                    self.skip_column_clean,
+                    self._get_storage_options(c),
+                )
+                ds["columns"].append(c)
+            self.set_datasource_metadata(ds)
 
     def set_column_group(self, datasource, groupname, columns):
         """Adds (or changes) a column group
@@ -480,17 +697,17 @@ class MDVProject:
         self.set_datasource_metadata(ds)
 
     def delete_datasource(self, name, delete_views=True):
-        h5 = self._get_h5_handle()
-        del h5[name]
-        h5.close()
-        self.datasources = [x for x in self.datasources if x["name"] != name]
-        # delete all views contining that datasource
-        if delete_views:
-            views = self.views
-            for view in views:
-                data = views[view]
-                if data["initialCharts"].get(name):
-                    self.set_view(view, None)
+        with self._get_h5_handle() as h5:
+            del h5[name]
+        with self.batch():
+            self.datasources = [x for x in self.datasources if x["name"] != name]
+            # delete all views contining that datasource
+            if delete_views:
+                views = self.views
+                for view in views:
+                    data = views[view]
+                    if data["initialCharts"].get(name):
+                        self.set_view(view, None)
 
     def add_genome_browser(
         self,
@@ -639,6 +856,9 @@ class MDVProject:
         replace_data=False,
         add_to_view: Optional[str] = "default",
         separator="\t",
+        workers=1,
+        chunksize: Optional[int] = None,
+        quantile_sketch=False,
     ) -> list[dict[str, str]]:
         """Adds a pandas dataframe to the project. Each column's datatype, will be deduced by the
         data it contains, but this is not always accurate. Hence, you can supply a list of column
@@ -646,13 +866,16 @@ class MDVProject:
 
         Args:
             name (string): The name of datasource
-            dataframe (dataframe|str): Either a pandas dataframe or the path of a text file
+            dataframe (dataframe|str): Either a pandas dataframe or the path of a text file (or a
+                file object)
             columns (list, optional) : A list of objects containing the column name and datatype.
                 e.g. [{"name":"column_1","datatype":"double"},]. If you want the column to have a
                 different label, the object requires a field (the column name in the dataframe) and
                 a name (the label seen by the user) e.g. {"field":"column_1","datatype":"double","name":"My Column 1"}
                 In the case of "multitext" columns, you can also supply a "separator" field, otherwise it will
                 default to a comma. <<< check this >>>
+                A column's "storage" (see `mdvtools.storage`) overrides the project's `storage_options`
+                for that column's dataset e.g. {"name":"x","storage":{"compression":"gzip"}}
             supplied_columns_only(bool, optional): If True, only the the subset of columns in the columns argument
                 will be added to the datasource. Default is False
             replace_data(bool, optional): If True, the existing datasource will be overwritten, Default is False,
@@ -662,11 +885,67 @@ class MDVProject:
                 a view.
             separator (str, optional): If a path to text file is supplied, then this should be the file's delimiter.
                 Defaults to a tab.
+            workers (int, optional): The number of processes used to encode columns. Encoded columns
+                are still written to the h5 file one at a time. Default is 1 (no extra processes).
+            chunksize (int, optional): If a text file is supplied, it will be read and added this many
+                rows at a time, rather than loading the whole file into memory. The datatype of any columns
+                not supplied is deduced from the first chunk, and an error is raised if a later chunk has
+                text in a column deduced to be numeric. Default is None (read the whole file).
+            quantile_sketch (bool, optional): If True, the quantiles of numeric columns are estimated
+                with a `QuantileSketch`, which is stored with the column's data (see `get_column_sketch`).
+                Default is False (exact quantiles). Sketches are always used if a chunksize is given.
         """
-        if isinstance(dataframe, str):
+        if chunksize and not isinstance(dataframe, pandas.DataFrame):
+            return self._add_datasource_chunked(
+                name,
+                dataframe,
+                columns,
+                supplied_columns_only,
+                replace_data,
+                add_to_view,
+                separator,
+                chunksize,
+            )
+        if not isinstance(dataframe, pandas.DataFrame):
             dataframe = pandas.read_csv(dataframe, sep=separator)
         # get the columns to add
         columns = get_column_info(columns, dataframe, supplied_columns_only)
+        self._check_new_datasource(name, replace_data)
+        size = len(dataframe)
+        dodgy_columns = []
+        # create the h5 group
+        with self._get_h5_handle() as h5:
+            gr = h5.create_group(name)
+            if not columns:
+                # we could set columns to an empty list, but it's probably better to throw an error
+                # seems unlikely a user would want to add a datasource with no columns
+                raise AttributeError("no columns to add")
+            encoded_columns = encode_columns(
+                columns,
+                dataframe,
+                size,
+                self.skip_column_clean,
+                workers,
+                quantile_sketch,
+            )
+            for col, get_encoded in encoded_columns:
+                try:
+                    new_col, data, dtype = get_encoded()
+                    # the metadata will be a copy if encoded in another process
+                    col.update(new_col)
+                    opts = self._get_storage_options(col)
+                    write_column(gr, col, data, dtype, size, opts)
+                except Exception as e:
+                    dodgy_columns.append(col["field"])
+                    warnings.warn(
+                        f"cannot add column '{col['field']}' to datasource '{name}':\n{repr(e)}"
+                    )
+
+        columns = [x for x in columns if x["field"] not in dodgy_columns]
+        self._add_datasource_metadata(name, columns, size, add_to_view)
+        return dodgy_columns
+
+    def _check_new_datasource(self, name: str, replace_data: bool):
         # does the datasource exist
         try:
             ds = self.get_datasource_metadata(name)
@@ -680,40 +959,58 @@ class MDVProject:
                 raise FileExistsError(
                     f"Trying to create {name} datasource, which already exits"
                 )
-        # create the h5 group
-        h5 = self._get_h5_handle()
-        gr = h5.create_group(name)
-        size = len(dataframe)
-        dodgy_columns = []
-        if not columns:
-            # we could set columns to an empty list, but it's probably better to throw an error
-            # seems unlikely a user would want to add a datasource with no columns
-            raise AttributeError("no columns to add")
-        for col in columns:
-            try:
-                add_column_to_group(
-                    col, dataframe[col["field"]], gr, size, self.skip_column_clean
-                )
-            except Exception as e:
-                dodgy_columns.append(col["field"])
-                warnings.warn(
-                    f"cannot add column '{col['field']}' to datasource '{name}':\n{repr(e)}"
-                )
 
-        h5.close()
-        columns = [x for x in columns if x["field"] not in dodgy_columns]
-        # add the metadata
-        ds = None
+    def _add_datasource_metadata(
+        self, name: str, columns: list, size: int, add_to_view: Optional[str]
+    ):
         ds = {"name": name, "columns": columns, "size": size}
-        self.set_datasource_metadata(ds)
-        # add it to the view
-        if add_to_view:
-            v = self.get_view(add_to_view)
-            if not v:
-                v = {"initialCharts": {}}
-            v["initialCharts"][name] = []
-            self.set_view(add_to_view, v)
-        return dodgy_columns
+        with self.batch():
+            self.set_datasource_metadata(ds)
+            # add it to the view
+            if add_to_view:
+                v = self.get_view(add_to_view)
+                if not v:
+                    v = {"initialCharts": {}}
+                v["initialCharts"][name] = []
+                self.set_view(add_to_view, v)
+
+    def _add_datasource_chunked(
+        self,
+        name: str,
+        source,
+        columns: Optional[list],
+        supplied_columns_only: bool,
+        replace_data: bool,
+        add_to_view: Optional[str],
+        separator: str,
+        chunksize: int,
+    ) -> list[str]:
+        # imported here as the ingest module uses functions from this one
+        from .ingest import read_chunks, ingest_chunks
+
+        self._check_new_datasource(name, replace_data)
+        chunks = read_chunks(source, separator, chunksize)
+        with self._get_h5_handle() as h5:
+            gr = h5.create_group(name)
+            try:
+                columns, size, errors = ingest_chunks(
+                    gr,
+                    chunks,
+                    columns,
+                    supplied_columns_only,
+                    self.skip_column_clean,
+                    self._get_storage_options(),
+                )
+            except Exception:
+                # don't leave a partially added datasource
+                del h5[name]
+                raise
+        for field, e in errors.items():
+            warnings.warn(
+                f"cannot add column '{field}' to datasource '{name}':\n{repr(e)}"
+            )
+        self._add_datasource_metadata(name, columns, size, add_to_view)
+        return list(errors)
 
     def insert_link(self, datasource, linkto, linktype, data):
         """
@@ -779,31 +1076,35 @@ class MDVProject:
         """ """
         name = name if name else stub
         label = label if label else name
-        h5 = self._get_h5_handle()
-        ds = h5[row_ds]
-        if not isinstance(ds, h5py.Group):
-            raise AttributeError(f"{row_ds} is not a group")
-        if name in ds:
-            raise
-        gr = ds.create_group(name)  # we could check for existing name first...
-        # sparse is passed as an argument - maybe we should infer it automatically from the data
-        # (isinstance of spmatrix)
-        if sparse:
-            gr.create_dataset(
-                "x", (len(data.data),), data=data.data, dtype=numpy.float32
-            )
-            gr.create_dataset(
-                "i", (len(data.indices),), data=data.indices, dtype=numpy.uint32
-            )
-            gr.create_dataset("p", (len(data.indptr),), data=data.indptr)
-        else:
-            length = data.shape[0]
-            # we should assert and test that the shape dimensions correspond to number of rows in row_ds & col_ds
-            total_len = data.shape[0] * data.shape[1]
-            gr.create_dataset(
-                "x", (total_len,), data=data.flatten("F"), dtype=numpy.float32
-            )
-            gr["length"] = [length]
+        with self._get_h5_handle() as h5:
+            ds = h5[row_ds]
+            if not isinstance(ds, h5py.Group):
+                raise AttributeError(f"{row_ds} is not a group")
+            if name in ds:
+                raise AttributeError(f"subgroup '{name}' already exists in {row_ds}")
+            gr = ds.create_group(name)  # we could check for existing name first...
+            # sparse is passed as an argument - maybe we should infer it automatically from the data
+            # (isinstance of spmatrix)
+            storage = self._get_storage_options()
+            if sparse:
+                gr.create_dataset(
+                    "x",
+                    (len(data.data),),
+                    data=data.data,
+                    dtype=numpy.float32,
+                    **dataset_options(storage, len(data.data)),
+                )
+                gr.create_dataset(
+                    "i",
+                    (len(data.indices),),
+                    data=data.indices,
+                    dtype=numpy.uint32,
+                    **dataset_options(storage, len(data.indices)),
+                )
+                gr.create_dataset("p", (len(data.indptr),), data=data.indptr)
+            else:
+                # we should assert and test that the shape dimensions correspond to number of rows in row_ds & col_ds
+                write_dense_subgroup(gr, data, storage)
         ds = self.get_datasource_metadata(row_ds)
         ds["links"][col_ds]["rows_as_columns"]["subgroups"][stub] = {
             "name": name,
@@ -811,7 +1112,6 @@ class MDVProject:
             "type": "sparse" if sparse else "dense",
         }
         self.set_datasource_metadata(ds)
-        h5.close()
 
     def get_links(self, datasource, filter=None):
         ds = self.get_datasource_metadata(datasource)
@@ -845,17 +1145,23 @@ class MDVProject:
         # end
         return config
 
-    def convert_to_static_page(self, outdir, include_sab_headers=True):
+    def convert_to_static_page(self, outdir, include_sab_headers=True, **kwargs):
+        """Creates a static site of the project in outdir. Any keyword arguments (level,
+        workers, progress) are passed to `convert_data_to_binary`."""
         fdir = split(os.path.abspath(__file__))[0]
         # consider adding an option to do a js build here
         tdir = join(fdir, "templates")
-        # copy everything except the data (todo options for images etc)
-        copytree(self.dir, outdir, ignore=ignore_patterns(*("*.h5", "*.ome.tiff")))
+        self.copy_project_files(outdir)
         # copy the js and images
         self.copy_images(outdir)
-        copytree(join(fdir, "static"), join(outdir, "static"))
+        copytree(
+            join(fdir, "static"),
+            join(outdir, "static"),
+            copy_function=copy_if_changed,
+            dirs_exist_ok=True,
+        )
         # create the static binary files
-        self.convert_data_to_binary(outdir)
+        self.convert_data_to_binary(outdir, **kwargs)
         # write out the index file
         page = "page.html"
         template = join(tdir, page)
@@ -882,6 +1188,30 @@ class MDVProject:
         with open(join(outdir, "index.html"), "w") as o:
             o.write(page)
 
+    def copy_project_files(self, outdir):
+        """Copies everything in the project's directory to outdir, except the data (todo
+        options for images etc) and any static export of it in the project's directory
+        (see `convert_data_to_binary`), which must not replace the export in outdir.
+        Files already in outdir (from a previous export) are only copied if changed."""
+        exported = {EXPORT_MANIFEST}
+        for ds in self.datasources:
+            exported.update((f"{ds['name']}.gz", f"{ds['name']}.json"))
+        ignore_data = ignore_patterns(*("*.h5", "*.ome.tiff"))
+
+        def ignore(path, names):
+            ignored = ignore_data(path, names)
+            if path == self.dir:
+                ignored.update(exported.intersection(names))
+            return ignored
+
+        copytree(
+            self.dir,
+            outdir,
+            ignore=ignore,
+            copy_function=copy_if_changed,
+            dirs_exist_ok=True,
+        )
+
     def copy_images(self, outdir):
         for ds in self.datasources:
             name = ds["name"]
@@ -896,10 +1226,19 @@ class MDVProject:
                 image_set = image_metadata[image_set_name]
                 print("copying", image_set_name)
                 original_folder = image_set["original_folder"]
-                copytree(original_folder, join(outdir, image_set["base_url"]))
+                copytree(
+                    original_folder,
+                    join(outdir, image_set["base_url"]),
+                    copy_function=copy_if_changed,
+                    dirs_exist_ok=True,
+                )
             # TODO also copy any linked avivator images
 
     def save_state(self, state):
+        with self.batch():
+            self._save_state(state)
+
+    def _save_state(self, state):
         # update/add or view
         # view will be deleted if view is null
         if state.get("currentView"):
@@ -957,14 +1296,13 @@ class MDVProject:
         self.set_datasource_metadata(ds)
 
     def get_view(self, view: str):
-        views = self.views
-        return views.get(view)
+        return copy_json(self._views_cache.get().get(view))
 
     def set_view(self, name: str, view: Optional[View | Any], make_default=False):
         """Sets the view with the given name to the supplied view data.
         If the view is None, then the view will be deleted.
         """
-        views = self.views
+        views = self._views_cache.get()
         # update or add the view
         if view:
             # clone, in case a calling script might get confused by the view being changed
@@ -984,9 +1322,9 @@ class MDVProject:
         else:
             if views.get(name):
                 del views[name]
-        self.views = views
+        self._views_cache.save()
 
-        state = self.state
+        state = self._state_cache.get()
         # add to list and make default
         if view:
             if name not in state["all_views"]:
@@ -1001,76 +1339,210 @@ class MDVProject:
             # change the default view to the first view in the list
             if iv:
                 state["initial_view"] = state["all_views"][0]
-        self.state = state
+        self._state_cache.save()
+
+    def convert_data_to_binary(
+        self,
+        outdir=None,
+        level: Optional[int] = None,
+        workers=1,
+        progress: Optional[Callable[[str, int, int], None]] = None,
+        incremental=True,
+        codec="gzip",
+    ):
+        """Writes the data of each datasource (for a static page) to a file, <name>.gz, of
+        the compressed data of each column and rows_as_columns entry, with an index
+        of their positions in the file (and the codec used), <name>.json. Columns larger
+        than `EXPORT_BLOCK_BYTES` are read and compressed a block at a time, straight to
+        the file, so memory use does not depend on the size of the columns.
 
-    def convert_data_to_binary(self, outdir=None):
+        Args:
+            outdir (str, optional): The directory to write the files to, default the project's
+            level (int, optional): The compression level, by default that of the codec (see
+                `mdvtools.binary_codecs`). For gzip it is 6, which is several times faster
+                than 9 for numeric data and barely larger.
+            workers (int, optional): The number of processes used to compress the data. The
+                data is still written in order, but columns larger than `EXPORT_BLOCK_BYTES`
+                are each read and compressed by one of the processes, which uses as much disk
+                space in outdir as their compressed data. Default is 1 (no extra processes).
+            progress (function, optional): Called with the datasource's name, the number of
+                items written and the total number of items, after each item is written.
+            incremental (bool, optional): If True (the default), a fingerprint of each item's
+                data is kept in a manifest (export_manifest.json, next to the files) and items
+                which are unchanged since the last export to outdir are copied from the
+                previous file rather than compressed again. Large columns are not read to
+                check this, unless the h5 file has been modified since the last export.
+            codec (str, optional): How the data is compressed - 'gzip' (the default),
+                'zstd' or 'raw' (not compressed), see `mdvtools.binary_codecs`.
+        """
+        level = check_codec(codec, level)
         if not outdir:
             outdir = self.dir
-        h5 = h5py.File(self.h5file)
-        dss = self.datasources
-        for ds in dss:
-            n = ds["name"]
-            gr = h5[n]
-            if not isinstance(gr, h5py.Group):
-                raise TypeError("Expected 'gr' to be of type h5py.Group.")
-            dfile = join(outdir, "{}.gz".format(n))
-            o = open(dfile, "wb")
-            index = {}
-            current_pos = 0
-            for c in ds["columns"]:
-                dt = gr.get(c["field"])
-                if not dt:
-                    continue
-                arr = numpy.array(dt)
-                comp = gzip.compress(arr.tobytes())
-                o.write(comp)
-                new_pos = current_pos + len(comp)
-                index[c["field"]] = [current_pos, new_pos - 1]
-                current_pos = new_pos
-
-            # add rows to columns gene score / tensors etc
-            lnks = self.get_links(n, "rows_as_columns")
-            for ln in lnks:
-                rc = ln["link"]["rows_as_columns"]
-                for sg in rc["subgroups"]:
-                    info = rc["subgroups"][sg]
-                    sgrp = gr[info["name"]]
-                    sparse = info.get("type") == "sparse"
-                    # get number of rows in linked datasource
-                    plen = [x["size"] for x in dss if x["name"] == ln["datasource"]][0]
-                    for i in range(0, plen):
-                        comp = gzip.compress(get_subgroup_bytes(sgrp, i, sparse))
-                        o.write(comp)
-                        new_pos = current_pos + len(comp)
-                        index[f"{sg}{i}"] = [current_pos, new_pos - 1]
-                        current_pos = new_pos
-
-            o.close()
-            ifile = dfile[: dfile.rindex(".")] + ".json"
-            i = open(ifile, "w")
-            i.write(json.dumps(index, allow_nan=False))
-            i.close()
+        manifest_file = join(outdir, EXPORT_MANIFEST)
+        previous = {}
+        if incremental and exists(manifest_file):
+            previous = get_json(manifest_file)
+        manifest = {}
+        with self._get_h5_handle(read_only=True) as h5:
+            dss = self.datasources
+            sizes = {x["name"]: x["size"] for x in dss}
+            for ds in dss:
+                n = ds["name"]
+                gr = h5[n]
+                if not isinstance(gr, h5py.Group):
+                    raise TypeError("Expected 'gr' to be of type h5py.Group.")
+                # rows to columns gene score / tensors etc
+                subgroups = []
+                lnks = self.get_links(n, "rows_as_columns")
+                for ln in lnks:
+                    rc = ln["link"]["rows_as_columns"]
+                    # the number of rows in linked datasource
+                    plen = sizes[ln["datasource"]]
+                    for sg in rc["subgroups"]:
+                        info = rc["subgroups"][sg]
+                        sparse = info.get("type") == "sparse"
+                        subgroups.append((sg, gr[info["name"]], sparse, plen))
+                fields = [c["field"] for c in ds["columns"] if gr.get(c["field"])]
+
+                # bound as defaults, so the generator does not depend on the loop variables
+                def get_items(gr=gr, fields=fields, subgroups=subgroups):
+                    for field in fields:
+                        dset = gr[field]
+                        if dset.nbytes > EXPORT_BLOCK_BYTES:
+                            # compressed as it is read, a block at a time
+                            yield field, DatasetBlocks(dset)
+                        else:
+                            yield field, dataset_buffer(dset)
+                    for sg, sgrp, sparse, plen in subgroups:
+                        sg_bytes = iter_subgroup_bytes(sgrp, plen, sparse)
+                        for i, data in enumerate(sg_bytes):
+                            yield f"{sg}{i}", data
+
+                total = len(fields) + sum(x[3] for x in subgroups)
+                manifest[n] = write_binary_data(
+                    outdir,
+                    n,
+                    get_items(),
+                    total,
+                    codec,
+                    level,
+                    workers,
+                    progress,
+                    previous.get(n) if incremental else None,
+                )
+        if incremental:
+            save_json(manifest_file, manifest)
+        elif exists(manifest_file):
+            os.remove(manifest_file)
 
     def get_byte_data(self, columns, group):
-        h5 = h5py.File(self.h5file, "r")
-        byte_list = []
-        gr = h5[group]
-        if not isinstance(gr, h5py.Group):
-            raise TypeError("Expected 'gr' to be of type h5py.Group.")
-        for column in columns:
-            sg = column.get("subgroup")
-            if sg:
-                sgindex = int(column["sgindex"])
-                byte_list.append(
-                    get_subgroup_bytes(
-                        gr[sg], sgindex, column.get("sgtype") == "sparse"
-                    )
-                )
-            else:
-                data = gr[column["field"]]
-                byte_list.append(numpy.array(data).tobytes())
-        h5.close()
-        return b"".join(byte_list)
+        return b"".join(self.get_byte_buffers(columns, group))
+
+    def get_byte_buffers(self, columns, group) -> list[memoryview | bytes]:
+        """Returns the data of each of the columns (as sent to the client by `get_byte_data`)
+        without joining it. The data is read while the h5 file's handle is held, so it is
+        not affected by later changes to the file.
+        """
+        return list(self.iter_byte_data(columns, group))
+
+    def iter_byte_data(self, columns, group) -> Iterator[memoryview | bytes]:
+        """Returns an iterator over the data of each of the columns (see `get_byte_buffers`),
+        which reads each column (or the columns of a subgroup) only when it is needed, so that
+        a response can be streamed without holding all the data in memory. The datasource,
+        columns and subgroup indexes are checked straight away, rather than when the iterator
+        is first used, so that the only errors while iterating are from the file being
+        changed at the same time.
+        """
+        with self._get_h5_handle(read_only=True) as h5:
+            subgroups, sparse = _check_byte_data_columns(h5, group, columns)
+
+        def iterate():
+            sg_bytes: dict[str, dict[int, bytes]] = {}
+            for column in columns:
+                sg = column.get("subgroup")
+                # the handle is only held while reading, so that writes (and other
+                # requests) aren't blocked while the data is sent
+                with self._get_h5_handle(read_only=True) as h5:
+                    version = self._h5.version
+                    self._check_cache_version(version)
+                    gr = h5[group]
+                    if sg:
+                        if sg not in sg_bytes:
+                            sg_bytes[sg] = self._read_subgroup_bytes(
+                                gr, group, sg, subgroups[sg], sparse[sg], version
+                            )
+                        data = sg_bytes[sg][int(column["sgindex"])]
+                    else:
+                        data = self._read_column_bytes(gr, group, column, version)
+                yield data
+
+        return iterate()
+
+    def get_byte_data_size(self, columns, group) -> int:
+        """Returns the number of bytes in the data of the columns (see `iter_byte_data`),
+        without reading it, e.g. for the Content-Length of a streamed response"""
+        with self._get_h5_handle(read_only=True) as h5:
+            subgroups, sparse = _check_byte_data_columns(h5, group, columns)
+            gr = h5[group]
+            size = 0
+            offsets = {sg: gr[sg]["p"][()] for sg in subgroups if sparse[sg]}
+            for column in columns:
+                sg = column.get("subgroup")
+                if not sg:
+                    size += gr[column["field"]].nbytes
+                elif sparse[sg]:
+                    # the number of values, then their indexes and values
+                    i = int(column["sgindex"])
+                    size += 4 + 8 * int(offsets[sg][i + 1] - offsets[sg][i])
+                else:
+                    x = gr[sg]["x"]
+                    length = x.shape[1] if x.ndim == 2 else int(gr[sg]["length"][0])
+                    size += 4 * length
+            return size
+
+    def _check_cache_version(self, version):
+        if self.byte_cache is not None and version != self._cached_version:
+            # free the memory used by data from an older version of the file
+            self.byte_cache.discard(
+                lambda k: k[0] is self._cache_id and k[1] != version
+            )
+            self._cached_version = version
+
+    def _cache_key(self, version, group, *item):
+        return (self._cache_id, version, group, *item)
+
+    def _read_column_bytes(self, gr, group, column, version):
+        dset = gr[column["field"]]
+        # contiguous data is read quickly (copied from a memory map of the file), so only
+        # chunked datasets are cached. The data is copied (once) while the handle is held,
+        # as the file may be changed (e.g. the dataset replaced) once it is released
+        if self.byte_cache is None or dset.chunks is None:
+            data = dataset_buffer(dset)
+            if isinstance(data.obj, numpy.memmap):
+                data = memoryview(numpy.array(data))
+            return data
+        key = self._cache_key(version, group, column["field"])
+        data = self.byte_cache.get(key)
+        if data is None:
+            data = dataset_buffer(dset)
+            self.byte_cache.put(key, data)
+        return data
+
+    def _read_subgroup_bytes(self, gr, group, sg, indexes, sparse, version):
+        """Returns index -> bytes for the subgroup's columns, only reading those
+        which aren't cached"""
+        if self.byte_cache is None:
+            return dict(zip(indexes, get_subgroup_bytes_list(gr[sg], indexes, sparse)))
+        found = {}
+        for i in indexes:
+            data = self.byte_cache.get(self._cache_key(version, group, sg, i))
+            if data is not None:
+                found[i] = data
+        missing = sorted(set(indexes) - set(found))
+        for i, data in zip(missing, get_subgroup_bytes_list(gr[sg], missing, sparse)):
+            self.byte_cache.put(self._cache_key(version, group, sg, i), data)
+            found[i] = data
+        return found
 
     def set_region_data(
         self,
@@ -1387,16 +1859,374 @@ def get_json(file):
     return json.loads(open(file).read())
 
 
+def copy_json(data):
+    """A faster equivalent of `copy.deepcopy` for objects parsed from json"""
+    if isinstance(data, dict):
+        return {k: copy_json(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [copy_json(v) for v in data]
+    return data
+
+
+class NameIndex:
+    """Maps the value of `key` in each item of a list of dicts to the item's position
+    in the list, so items can be looked up without scanning the list. The index is
+    rebuilt if it is used with a different list. Any change to the list other than
+    through `replace()` (removing, reordering or renaming items in place) must be
+    followed by a call to `invalidate()` - the index is also rebuilt if the list's
+    length has changed, or a name is found at the wrong position, but these checks
+    can't detect every change.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._items: Optional[list] = None
+        self._length = 0
+        self._index: dict[Any, int] = {}
+
+    def _check(self, items: list):
+        if items is self._items and len(items) == self._length:
+            return
+        self._index = {}
+        for i, item in enumerate(items):
+            # if there are duplicates, the first one is used
+            self._index.setdefault(item[self.key], i)
+        self._items = items
+        self._length = len(items)
+
+    def find(self, items: list, name) -> int:
+        """Returns the position of the item with the given name, or -1"""
+        self._check(items)
+        i = self._index.get(name, -1)
+        if i != -1 and items[i][self.key] != name:
+            # the list has been altered in place
+            self.invalidate()
+            self._check(items)
+            i = self._index.get(name, -1)
+        return i
+
+    def replace(self, items: list, item: dict):
+        """Replaces the item with the same name or, if there isn't one, appends it"""
+        i = self.find(items, item[self.key])
+        if i == -1:
+            items.append(item)
+            self._index[item[self.key]] = len(items) - 1
+            self._length = len(items)
+        else:
+            items[i] = item
+
+    def invalidate(self):
+        self._items = None
+
+
+class JsonFileCache:
+    """Keeps the parsed contents of a json file in memory. The file is only
+    re-read if its modification time or size has changed since it was last read
+    or written, so changes made by other processes will still be seen.
+    """
+
+    def __init__(self, file: str):
+        self.file = file
+        self.data: Any = None
+        self._stamp: Optional[tuple[int, int]] = None
+        # when deferred, save() only marks the data as changed and flush() writes it
+        self.deferred = False
+        self._dirty = False
+
+    def _file_stamp(self):
+        st = os.stat(self.file)
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self):
+        """Returns the cached object, which should not be modified unless
+        `save()` is called afterwards"""
+        # unsaved changes take precedence over the file
+        if self._dirty:
+            return self.data
+        stamp = self._file_stamp()
+        if self.data is None or stamp != self._stamp:
+            self.data = get_json(self.file)
+            self._stamp = stamp
+        return self.data
+
+    def set(self, value):
+        """Writes a copy of value to the file and caches it"""
+        self.data = copy_json(value)
+        self.save()
+
+    def save(self):
+        """Writes the (modified) cached object to the file"""
+        self._dirty = True
+        if not self.deferred:
+            self.flush()
+
+    def flush(self):
+        """Writes any unsaved changes to the file"""
+        if not self._dirty:
+            return
+        try:
+            save_json(self.file, self.data)
+        except Exception:
+            # the cached object no longer reflects what is on disk
+            self.invalidate()
+            raise
+        self._dirty = False
+        self._stamp = self._file_stamp()
+
+    def invalidate(self):
+        self.data = None
+        self._stamp = None
+        self._dirty = False
+
+
+def temp_file_name(file: str) -> str:
+    """A name for a temporary file to replace file with, unique to the process and
+    thread (e.g. for concurrent requests to the server)"""
+    return f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
 def save_json(file, data):
-    o = open(file, "w")
     try:
-        o.write(json.dumps(data, indent=2, allow_nan=False))
+        text = json.dumps(data, indent=2, allow_nan=False)
     except Exception as e:
-        print(
-            f"Error saving json to '{file}': some data cleaning may be necessary... project likely to be in a bad state."
-        )
+        print(f"Error saving json to '{file}': some data cleaning may be necessary...")
         raise (e)
-    o.close()
+    # write to a temporary file and then replace, so the file is never left half written
+    temp = temp_file_name(file)
+    with open(temp, "w") as o:
+        o.write(text)
+    os.replace(temp, file)
+
+
+def read_rows(dset: h5py.Dataset, rows=None, width=1) -> numpy.ndarray:
+    """Reads the specified rows of a dataset - a contiguous slice is read directly from
+    the file, any other selection (mask or indexes) is applied after reading.
+
+    Args:
+        dset (h5py.Dataset): The dataset holding the column's data
+        rows (slice|array, optional): The rows to read, default all rows
+        width (int, optional): The number of values per row (for multitext columns)
+    """
+    if rows is None:
+        return dset[()]
+    nrows = dset.shape[0] // width if width else 0
+    if isinstance(rows, slice) and rows.step in (None, 1):
+        start, stop, _ = rows.indices(nrows)
+        return dset[start * width : max(start, stop) * width]
+    data = dset[()]
+    if width == 1:
+        return data[rows]
+    return data.reshape(nrows, width)[rows].reshape(-1)
+
+
+def decode_column(col: dict, raw_data: numpy.ndarray, as_categorical=True):
+    """Converts the raw data of a column (as stored in the h5 file) to its values.
+    Text columns are returned as a pandas Categorical (or an object array if
+    as_categorical is False), multitext and unique columns as object arrays of
+    strings and numeric columns unchanged.
+    """
+    dt = col["datatype"]
+    if dt == "text" or dt == "text16":
+        if as_categorical and len(set(col["values"])) == len(col["values"]):
+            return pandas.Categorical.from_codes(raw_data, col["values"])  # type: ignore
+        return numpy.array(col["values"], dtype=object)[raw_data]
+    elif dt == "multitext":
+        # one row of value indexes per item, with unused slots set to 65535
+        # (or the uint32 maximum if there are too many values for uint16)
+        empty = numpy.iinfo(raw_data.dtype).max
+        codes = raw_data.reshape(-1, col["stringLength"])
+        if codes.shape[1] == 0:
+            return numpy.full(codes.shape[0], "", dtype=object)
+        # number each distinct combination of values, so each only has to be joined once
+        combos = pandas.factorize(codes[:, 0])[0]
+        for n in range(1, codes.shape[1]):
+            combos = pandas.factorize(combos * (int(empty) + 1) + codes[:, n])[0]
+        ncombos = int(combos.max()) + 1 if len(combos) else 0
+        first = numpy.empty(ncombos, dtype=numpy.int64)
+        first[combos[::-1]] = numpy.arange(len(combos) - 1, -1, -1)
+        values = col["values"]
+        joined = numpy.array(
+            [",".join([values[x] for x in codes[i] if x != empty]) for i in first],
+            dtype=object,
+        )
+        return joined[combos]
+    elif dt == "unique":
+        return numpy.char.decode(raw_data, "utf-8").astype(object)
+    return raw_data
+
+
+# the size of the blocks of a dense subgroup written at a time
+DENSE_BLOCK_BYTES = 64_000_000
+
+
+def write_dense_subgroup(gr: h5py.Group, data, storage: Optional[dict] = None):
+    """Writes a dense matrix (rows x columns e.g. cells x genes) to a rows_as_columns
+    subgroup. The values of each column are stored as a row of the 2D dataset 'x',
+    in its own chunk, so that any column can be read with a single chunk read.
+    The matrix is written a block of columns at a time, so no flattened/transposed
+    copy of the whole matrix is made. Scipy sparse matrices are also accepted.
+    """
+    length, ncols = data.shape
+    opts = dataset_options(storage, length)
+    if length:
+        # one column (of the matrix) per chunk
+        opts["chunks"] = (1, length)
+    x = gr.create_dataset("x", (ncols, length), dtype=numpy.float32, **opts)
+    step = max(1, DENSE_BLOCK_BYTES // (4 * max(length, 1)))
+    for start in range(0, ncols, step):
+        block = data[:, start : start + step]
+        block = block.toarray() if hasattr(block, "toarray") else numpy.asarray(block)
+        x[start : start + block.shape[1]] = numpy.ascontiguousarray(block.T)
+    # the number of rows, as stored by the original (flat) layout
+    gr["length"] = [length]
+
+
+def _check_byte_data_columns(h5: h5py.File, group: str, columns: list[dict]):
+    """Checks the columns (and subgroup indexes) requested from a datasource exist,
+    returning the indexes requested from each subgroup and whether it is sparse"""
+    gr = h5[group]
+    if not isinstance(gr, h5py.Group):
+        raise TypeError("Expected 'gr' to be of type h5py.Group.")
+    # the columns of each subgroup are read together
+    subgroups: dict[str, list[int]] = {}
+    sparse: dict[str, bool] = {}
+    for column in columns:
+        sg = column.get("subgroup")
+        if sg:
+            subgroups.setdefault(sg, []).append(int(column["sgindex"]))
+            sparse[sg] = column.get("sgtype") == "sparse"
+        elif column["field"] not in gr:
+            raise KeyError(f"column '{column['field']}' not in '{group}'")
+    for sg, indexes in subgroups.items():
+        if sg not in gr:
+            raise KeyError(f"subgroup '{sg}' not in '{group}'")
+        count = subgroup_count(gr[sg], sparse[sg])
+        bad = [i for i in indexes if not 0 <= i < count]
+        if bad:
+            raise KeyError(f"index {bad[0]} not in subgroup '{sg}'")
+    return subgroups, sparse
+
+
+def subgroup_count(grp: h5py.Group, sparse=False) -> int:
+    """Returns the number of columns stored in a subgroup"""
+    if sparse:
+        return grp["p"].shape[0] - 1
+    x = grp["x"]
+    if x.ndim == 2:
+        return x.shape[0]
+    # the original layout, a flattened (Fortran order) matrix
+    return x.shape[0] // int(grp["length"][0])
+
+
+def get_dense_subgroup_bytes(grp: h5py.Group, indexes: list[int]) -> list[bytes]:
+    """Returns the bytes of each of the (dense) subgroup's columns at the indexes.
+    The columns are read into a single array, each run of consecutive columns with
+    one read (a selection of all the columns at once is much slower in h5py)."""
+    x = grp["x"]
+    if x.ndim == 1:
+        # the original layout, a flattened (Fortran order) matrix
+        return [get_subgroup_bytes(grp, i) for i in indexes]
+    indexes = numpy.asarray(indexes, dtype=numpy.int64)
+    unique, inverse = numpy.unique(indexes, return_inverse=True)
+    rows = numpy.empty((len(unique), x.shape[1]), numpy.float32)
+    breaks = numpy.flatnonzero(numpy.diff(unique) != 1) + 1
+    runs = numpy.split(numpy.arange(len(unique)), breaks)
+    for run in runs:
+        if len(run):
+            s, e = run[0], run[-1] + 1
+            x.read_direct(rows, numpy.s_[unique[s] : unique[s] + e - s], numpy.s_[s:e])
+    return [rows[i].tobytes() for i in inverse]
+
+
+# ranges of a sparse subgroup's data closer than this (in values) are read together
+SPARSE_READ_GAP = 65536
+
+
+def get_sparse_subgroup_bytes(grp: h5py.Group, indexes: list[int]) -> list[bytes]:
+    """Returns the bytes of each of the (sparse) subgroup's columns at the indexes,
+    in the same format as `get_subgroup_bytes`. The offsets (p) of all the columns
+    are read at once and the columns' indices (i) and values (x) are read in as few
+    ranges as possible, by combining ranges which are close together."""
+    indexes = numpy.asarray(indexes, dtype=numpy.int64)
+    if len(indexes) == 0:
+        return []
+    unique, inverse = numpy.unique(indexes, return_inverse=True)
+    first = unique[0]
+    p = grp["p"][first : unique[-1] + 2]
+    starts = p[unique - first].astype(numpy.int64)
+    ends = p[unique - first + 1].astype(numpy.int64)
+    # the (non-empty) ranges to read, merging those separated by small gaps
+    nonempty = numpy.flatnonzero(ends > starts)
+    read_starts, read_ends = [], []
+    for s, e in zip(starts[nonempty], ends[nonempty]):
+        if read_ends and s - read_ends[-1] <= SPARSE_READ_GAP:
+            read_ends[-1] = max(read_ends[-1], e)
+        else:
+            read_starts.append(s)
+            read_ends.append(e)
+    i_data, x_data = grp["i"], grp["x"]
+    ranges = [
+        (s, i_data[s:e], numpy.asarray(x_data[s:e], numpy.float32))
+        for s, e in zip(read_starts, read_ends)
+    ]
+    # the range containing each column
+    which = numpy.searchsorted(read_starts, starts, side="right") - 1
+    payloads = []
+    for n in range(len(unique)):
+        s, e = starts[n], ends[n]
+        if e == s:
+            payloads.append(numpy.array([0], numpy.uint32).tobytes())
+            continue
+        offset, _indexes, _values = ranges[which[n]]
+        payloads.append(
+            numpy.array([e - s], numpy.uint32).tobytes()
+            + _indexes[s - offset : e - offset].tobytes()
+            + _values[s - offset : e - offset].tobytes()
+        )
+    return [payloads[i] for i in inverse]
+
+
+def get_subgroup_bytes_list(grp: h5py.Group, indexes: list[int], sparse=False):
+    """Returns the bytes of each of the subgroup's columns at the indexes (see
+    `get_dense_subgroup_bytes` and `get_sparse_subgroup_bytes`)"""
+    if sparse:
+        return get_sparse_subgroup_bytes(grp, indexes)
+    return get_dense_subgroup_bytes(grp, indexes)
+
+
+# the (approximate) maximum size of the data of a subgroup read at a time by
+# `iter_subgroup_bytes`
+SUBGROUP_WINDOW_BYTES = 64_000_000
+
+
+def iter_subgroup_bytes(grp: h5py.Group, count: int, sparse=False):
+    """Yields the bytes of each of the subgroup's first `count` columns in order (as
+    `get_subgroup_bytes`), reading windows of consecutive columns of at most about
+    `SUBGROUP_WINDOW_BYTES` at a time, so that memory use is bounded"""
+    if sparse:
+        p = grp["p"][: count + 1].astype(numpy.int64)
+        # index and value (4 bytes each) per non-zero value
+        budget = max(1, SUBGROUP_WINDOW_BYTES // 8)
+        s = 0
+        while s < count:
+            e = int(numpy.searchsorted(p, p[s] + budget, side="right")) - 1
+            e = min(max(e, s + 1), count)
+            yield from get_sparse_subgroup_bytes(grp, range(s, e))
+            s = e
+        return
+    x = grp["x"]
+    length = x.shape[1] if x.ndim == 2 else int(grp["length"][0])
+    window = max(1, SUBGROUP_WINDOW_BYTES // max(length * 4, 1))
+    for s in range(0, count, window):
+        e = min(s + window, count)
+        if x.ndim == 2:
+            rows = numpy.asarray(x[s:e], numpy.float32)
+        else:
+            # the original layout, a flattened (Fortran order) matrix
+            rows = numpy.asarray(x[s * length : e * length], numpy.float32)
+            rows = rows.reshape(e - s, length)
+        for row in rows:
+            yield row.tobytes()
 
 
 def get_subgroup_bytes(grp, index, sparse=False):
@@ -1411,9 +2241,12 @@ def get_subgroup_bytes(grp, index, sparse=False):
             + numpy.array(_values).tobytes()
         )
     else:
+        x = grp["x"]
+        if x.ndim == 2:
+            return numpy.array(x[index], numpy.float32).tobytes()
         _len = grp["length"][0]
         offset = index * _len
-        return numpy.array(grp["x"][offset : offset + _len], numpy.float32).tobytes()
+        return numpy.array(x[offset : offset + _len], numpy.float32).tobytes()
 
 
 def add_column_to_group(
@@ -1422,12 +2255,363 @@ def add_column_to_group(
     group: h5py.Group,
     length: int,
     skip_column_clean: bool,
+    storage: Optional[dict] = None,
 ):
     """
     col (dict): The column metadata (may be modified e.g. to add values)
     data (pandas.Series): The data to add
     group (h5py.Group): The group to add the data to
     length (int): The length of the data
+    storage (dict, optional): The chunking/compression of the dataset (see `mdvtools.storage`)
+    """
+    _, encoded, dtype = encode_column(col, data, length, skip_column_clean)
+    write_column(group, col, encoded, dtype, length, storage)
+
+
+def join_column(col: dict, data: pandas.Series, rows: numpy.ndarray, missing_value):
+    """Returns the values of data at the given positions (-1 for missing values)"""
+    if col["datatype"] in ("text", "text16"):
+        # only the (few) codes need to be taken, with the missing value as a category
+        # (NaN is stored as 'NaN', as with other text)
+        cat = pandas.Categorical(data.fillna("NaN"))
+        categories = cat.categories
+        missing = categories.get_indexer([missing_value])[0]
+        if missing == -1:
+            missing = len(categories)
+            categories = categories.append(pandas.Index([missing_value]))
+        codes = numpy.append(cat.codes.astype(numpy.int64), missing)[rows]
+        return pandas.Categorical.from_codes(codes, categories)
+    # numeric columns will be NaN
+    fill = missing_value if col["datatype"] in ("multitext", "unique") else numpy.nan
+    return pandas.api.extensions.take(
+        data.to_numpy(), rows, allow_fill=True, fill_value=fill
+    )
+
+
+def copy_if_changed(src, dst):
+    """Copies a file (with its modification time), unless dst has the same size and
+    modification time, i.e. was copied from the same version of the file"""
+    if exists(dst):
+        s, d = os.stat(src), os.stat(dst)
+        if s.st_size == d.st_size and s.st_mtime_ns == d.st_mtime_ns:
+            return dst
+    return shutil.copy2(src, dst)
+
+
+# records the fingerprints of the data in a static export, see `write_binary_data`
+EXPORT_MANIFEST = "export_manifest.json"
+
+
+def fingerprint(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+# columns larger than this are exported (see `write_binary_data`) in blocks of this size
+EXPORT_BLOCK_BYTES = 16_000_000
+
+# the size of the pieces of data compressed, or copied from a previous export, at a time
+# (the compressed data of a piece may be as large as the piece)
+EXPORT_PIECE_BYTES = 4_000_000
+
+# how long the h5 file must have been unmodified for `DatasetBlocks.stamp` to be used, so
+# that a later change is always given a different modification time
+EXPORT_STAMP_NS = 2_000_000_000
+
+
+class DatasetBlocks:
+    """The raw bytes of a dataset (as `dataset_buffer`), read as consecutive blocks
+    of rows of at most about `block_bytes` (but at least one row)"""
+
+    def __init__(self, dset: h5py.Dataset, block_bytes: Optional[int] = None):
+        self.dset = dset
+        self.nbytes = dset.nbytes
+        self.block_bytes = block_bytes or EXPORT_BLOCK_BYTES
+
+    def __iter__(self) -> Iterator[memoryview]:
+        rows = self.dset.shape[0] if self.dset.ndim else 1
+        row_bytes = max(self.nbytes // max(rows, 1), 1)
+        step = max(self.block_bytes // row_bytes, 1)
+        for s in range(0, rows, step):
+            block = numpy.ascontiguousarray(self.dset[s : s + step]).reshape(-1)
+            yield memoryview(block.view(numpy.uint8))
+            # not kept while the next block is read
+            del block
+
+    def fingerprint(self) -> str:
+        """The same as `fingerprint` of the whole data"""
+        h = hashlib.blake2b(digest_size=16)
+        for block in self:
+            h.update(block)
+        return h.hexdigest()
+
+    def stamp(self) -> Optional[list]:
+        """A key which changes with the data, without reading it - its size and the
+        modification time of the h5 file. None if the file was modified within the
+        last `EXPORT_STAMP_NS`, as a later change could have the same time."""
+        mtime = os.stat(self.dset.file.filename).st_mtime_ns
+        if time.time_ns() - mtime < EXPORT_STAMP_NS:
+            return None
+        return [self.nbytes, mtime]
+
+
+def compress_blocks(
+    blocks: DatasetBlocks, codec: str, level: int, h
+) -> Iterator[bytes]:
+    """Yields the compressed data of the blocks (decoded as a single payload), updating
+    the hash h with the data as it is read"""
+    c = compressobj(codec, level, blocks.nbytes)
+    for block in blocks:
+        for s in range(0, len(block), EXPORT_PIECE_BYTES):
+            piece = block[s : s + EXPORT_PIECE_BYTES]
+            h.update(piece)
+            yield c.compress(piece)
+        # not kept while the next block is read
+        block = piece = None
+    yield c.flush()
+
+
+def _compress_dataset(
+    file: str, path: str, block_bytes: int, codec: str, level: int, out: str
+) -> str:
+    """Writes the compressed data of a dataset (see `compress_blocks`) to the file out,
+    in a pool process, returning its fingerprint"""
+    h = hashlib.blake2b(digest_size=16)
+    with h5py.File(file, "r") as h5, open(out, "wb") as o:
+        blocks = DatasetBlocks(h5[path], block_bytes)
+        o.writelines(compress_blocks(blocks, codec, level, h))
+    return h.hexdigest()
+
+
+def write_binary_data(
+    outdir: str,
+    name: str,
+    items: Iterable[tuple[str, Union[bytes, memoryview, DatasetBlocks]]],
+    total: int,
+    codec="gzip",
+    level=6,
+    workers=1,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    previous: Optional[dict] = None,
+) -> dict:
+    """Writes the compressed data of each (key, data) item to <name>.gz in outdir and the
+    index of their positions to <name>.json (see `MDVProject.convert_data_to_binary`).
+    The data of `DatasetBlocks` items is compressed a block at a time as it is written,
+    rather than being held in memory. If workers > 1, each of these is compressed by a
+    pool process (to a temporary file in outdir), at the same time as the other items.
+
+    If the manifest entry of the previous export (`previous`) matches the existing files,
+    items whose data is unchanged are copied from the previous <name>.gz rather than being
+    compressed again. `DatasetBlocks` items whose `stamp` is unchanged are not read at
+    all. Returns the manifest entry for this export.
+    """
+    dfile = join(outdir, f"{name}.gz")
+    ifile = join(outdir, f"{name}.json")
+    old_index = {}
+    old_hashes = {}
+    old_stamps = {}
+    if (
+        previous
+        and previous.get("codec", "gzip") == codec
+        and previous.get("level") == level
+        and exists(dfile)
+        and exists(ifile)
+        and os.path.getsize(dfile) == previous.get("size")
+    ):
+        _, old_index = read_export_index(get_json(ifile))
+        old_hashes = previous["items"]
+        old_stamps = previous.get("stamps", {})
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    # the temporary files written by the pool
+    parts = []
+    # the key, fingerprint and previous position (if it can be reused) of each item, and
+    # the blocks of those to be streamed (or the pool's result), in the order they are
+    # read - other items to be compressed are read ahead
+    plan: deque[tuple[str, Optional[str], Optional[list], Any]] = deque()
+    stamps = {}
+
+    def to_compress():
+        for key, data in items:
+            reusable = key in old_hashes and key in old_index
+            if isinstance(data, DatasetBlocks):
+                stamp = data.stamp()
+                if stamp is not None:
+                    stamps[key] = stamp
+                if reusable and stamp is not None and old_stamps.get(key) == stamp:
+                    plan.append((key, old_hashes[key], old_index[key], None))
+                    continue
+                # only read twice if it may be unchanged
+                h = data.fingerprint() if reusable else None
+                if h is not None and old_hashes[key] == h:
+                    plan.append((key, h, old_index[key], None))
+                elif pool:
+                    dset = data.dset
+                    if dset.file.mode != "r":
+                        # any data written to this handle must be in the file
+                        dset.file.flush()
+                    parts.append(temp_file_name(f"{dfile}.{len(parts)}"))
+                    args = (dset.file.filename, dset.name, data.block_bytes)
+                    args += (codec, level, parts[-1])
+                    future = pool.submit(_compress_dataset, *args)
+                    plan.append((key, None, None, (parts[-1], future)))
+                else:
+                    plan.append((key, None, None, data))
+                continue
+            h = fingerprint(data)
+            if reusable and old_hashes[key] == h:
+                plan.append((key, h, old_index[key], None))
+            else:
+                plan.append((key, h, None, None))
+                yield data
+
+    index = {}
+    hashes = {}
+    current_pos = 0
+    done = 0
+    temp = temp_file_name(dfile)
+    old = open(dfile, "rb") if old_index else None
+    try:
+        with open(temp, "wb") as o:
+
+            def write(key, h, pieces):
+                nonlocal current_pos, done
+                start = current_pos
+                for piece in pieces:
+                    o.write(piece)
+                    current_pos += len(piece)
+                index[key] = [start, current_pos - 1]
+                hashes[key] = h
+                done += 1
+                if progress:
+                    progress(name, done, total)
+
+            def copy(f, start, end):
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    piece = f.read(min(EXPORT_PIECE_BYTES, remaining))
+                    remaining -= len(piece)
+                    yield piece
+
+            def write_blocks(key, blocks):
+                if isinstance(blocks, DatasetBlocks):
+                    h = hashlib.blake2b(digest_size=16)
+                    # the fingerprint is only known once all the blocks are read
+                    write(key, None, compress_blocks(blocks, codec, level, h))
+                    hashes[key] = h.hexdigest()
+                    return
+                part, future = blocks
+                h = future.result()
+                with open(part, "rb") as f:
+                    write(key, h, copy(f, 0, os.path.getsize(part) - 1))
+                os.remove(part)
+
+            def write_pending():
+                # the items before the next one compressed by compress_payloads
+                while plan and (plan[0][2] is not None or plan[0][3] is not None):
+                    key, h, old_range, blocks = plan.popleft()
+                    if old_range is not None:
+                        write(key, h, copy(old, *old_range))
+                    else:
+                        write_blocks(key, blocks)
+
+            payloads = compress_payloads(to_compress(), codec, level, workers, pool)
+            for comp in payloads:
+                write_pending()
+                key, h, _, _ = plan.popleft()
+                write(key, h, [comp])
+            write_pending()
+    except BaseException:
+        os.remove(temp)
+        raise
+    finally:
+        if old:
+            old.close()
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        for part in parts:
+            if exists(part):
+                os.remove(part)
+    os.replace(temp, dfile)
+    with open(ifile, "w") as i:
+        i.write(json.dumps(export_index(codec, index), allow_nan=False))
+    return {
+        "codec": codec,
+        "level": level,
+        "size": current_pos,
+        "items": hashes,
+        "stamps": stamps,
+    }
+
+
+def encode_columns(
+    columns: list[dict],
+    dataframe: pandas.DataFrame,
+    length: int,
+    skip_column_clean: bool,
+    workers=1,
+    quantile_sketch=False,
+):
+    """Encodes columns of the dataframe with `encode_column`, in a pool of `workers`
+    processes if workers > 1. Yields each column's metadata together with a function
+    returning the result of encoding it (or raising any error), in the same order as
+    `columns`. Only a few columns more than the number of workers are encoded ahead of
+    being consumed, to limit memory use.
+    """
+    if workers <= 1:
+        for col in columns:
+            data = dataframe[col["field"]]
+            args = (col, data, length, skip_column_clean, quantile_sketch)
+            yield col, functools.partial(encode_column, *args)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for col in columns:
+            data = dataframe[col["field"]]
+            args = (col, data, length, skip_column_clean, quantile_sketch)
+            future = executor.submit(encode_column, *args)
+            pending.append((col, future.result))
+            if len(pending) > workers * 2:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+def write_column(
+    group: h5py.Group,
+    col: dict,
+    data,
+    dtype,
+    length: int,
+    storage: Optional[dict] = None,
+):
+    """Writes the data returned by `encode_column` to the group, with the given
+    storage options (see `mdvtools.storage`)"""
+    # multitext columns have stringLength values per row
+    size = length * col["stringLength"] if col["datatype"] == "multitext" else length
+    opts = dataset_options(storage, size)
+    dset = group.create_dataset(col["field"], size, data=data, dtype=dtype, **opts)
+    # a quantile sketch is stored with the data rather than in the metadata
+    sketch = col.pop("_sketch", None)
+    if sketch:
+        QuantileSketch.from_dict(sketch).save(dset)
+
+
+def encode_column(
+    col: dict,
+    data: pandas.Series | pandas.DataFrame,
+    length: int,
+    skip_column_clean: bool,
+    quantile_sketch=False,
+):
+    """Converts a column's data to the form stored in the h5 file, and fills in the
+    column's metadata (values, minMax etc.). This does not use the h5 file, so can be
+    run in another process. If quantile_sketch is True, the quantiles of numeric data
+    are estimated with a `QuantileSketch`, which is added to the metadata (as
+    '_sketch') for `write_column` to store.
+
+    Returns:
+        (col, data, dtype): the column metadata (as it may be a copy if run in another
+        process), the data to write and its dtype.
     """
 
     if (
@@ -1436,7 +2620,8 @@ def add_column_to_group(
         or col["datatype"] == "text16"
     ):
         if data.dtype == "category":
-            data = data.cat.add_categories("ND")
+            if "ND" not in data.cat.categories:
+                data = data.cat.add_categories("ND")
             data = data.fillna("ND")
         else:
             # may need to double-check this...
@@ -1449,12 +2634,7 @@ def add_column_to_group(
             if not col.get("values"):
                 col["values"] = [x for x in values.index if values[x] != 0]
             vdict = {k: v for v, k in enumerate(col["values"])}
-            group.create_dataset(
-                col["field"],
-                length,
-                dtype=dtype,
-                data=data.map(vdict),  # type: ignore
-            )
+            encoded = data.map(vdict)  # type: ignore
             # convert to string
             col["values"] = [str(x) for x in col["values"]]
 
@@ -1463,67 +2643,97 @@ def add_column_to_group(
             utf8_type = h5py.string_dtype("utf-8", int(max_len))
             col["datatype"] = "unique"
             col["stringLength"] = max_len
-            group.create_dataset(col["field"], length, data=data, dtype=utf8_type)
+            encoded, dtype = data, utf8_type
     elif col["datatype"] == "multitext":
         delim = col.get("delimiter", ",")
-        value_set: set[str] = set()
-        maxv = 0
-        # first parse - get all possible values and max number
-        # of values in a single field
-        for v in data:
-            if not isinstance(v, str):
-                continue
-            vs = v.split(delim)
-            value_set.update([x.strip() for x in vs])
-            maxv = max(maxv, len(vs))
-
-        if "" in value_set:
-            value_set.remove("")
-        ndata = numpy.empty(shape=(length * maxv,), dtype=numpy.uint16)
-        ndata.fill(65535)
-        values = list(value_set)
-        # dict more efficient than index list
-        vmap = {k: v for v, k in enumerate(values)}
-        for i in range(0, length):
-            b = i * maxv
-            try:
-                v = data[i]  # may raise KeyError if data is None at this index
-                if v == "" or not isinstance(v, str):
-                    continue
-                vs = v.split(delim)
-                vs = [x.strip() for x in vs]
-            except Exception:
-                continue
-            vs.sort()
-            for n in range(0, len(vs)):
-                ndata[b + n] = vmap[vs[n]]
+        ndata, values, maxv = encode_multitext(data, delim)
         col["values"] = values
         col["stringLength"] = maxv
-        group.create_dataset(
-            col["field"], length * maxv, data=ndata, dtype=numpy.uint16
-        )
+        encoded, dtype = ndata, ndata.dtype
 
     else:
-        dt = numpy.int32 if col["datatype"] == "int32" else numpy.float32
-        clean = (
-            data
-            if skip_column_clean
-            else data.apply(pandas.to_numeric, errors="coerce")
-        )  # this is slooooow?
-        # faster but non=numeric values have to be certain values
-        # clean=data.replace("?",numpy.NaN).replace("ND",numpy.NaN).replace("None",numpy.NaN)
-        ds = group.create_dataset(col["field"], length, data=clean, dtype=dt)
-        # remove NaNs for min/max and quantiles - this needs to be tested with 'inf' as well.
-        na = numpy.array(ds)
-        na = na[numpy.isfinite(na)]
+        dtype = numpy.int32 if col["datatype"] == "int32" else numpy.float32
+        # non-numeric values become NaN
+        clean = data if skip_column_clean else pandas.to_numeric(data, errors="coerce")
+        encoded = numpy.asarray(clean, dtype=dtype)
+        # remove NaNs (and inf) for min/max and quantiles
+        na = encoded[numpy.isfinite(encoded)]
         col["minMax"] = [float(str(numpy.amin(na))), float(str(numpy.amax(na)))]
-        quantiles = [0.001, 0.01, 0.05]
-        col["quantiles"] = {}
-        for q in quantiles:
-            col["quantiles"][str(q)] = [
-                numpy.percentile(na, 100 * q),
-                numpy.percentile(na, 100 * (1 - q)),
-            ]
+        if quantile_sketch:
+            sketch = QuantileSketch()
+            sketch.add(na)
+            col["quantiles"] = sketch.quantiles()
+            col["_sketch"] = sketch.to_dict()
+        else:
+            col["quantiles"] = get_quantiles(na)
+    return col, encoded, dtype
+
+
+# the most different tags a multitext column can have - the web client reads the
+# indexes as uint16, with 65535 as the empty marker
+MAX_MULTITEXT_VALUES = 65535
+
+
+def encode_multitext(data: pandas.Series, delim=","):
+    """Encodes a column of delimited tags. Each row is given `maxv` slots (the most tags
+    in any row), which contain the (sorted) uint16 indexes of the row's tags in `values`,
+    followed by 'empty' markers (65535). An AttributeError is raised if there are more
+    than `MAX_MULTITEXT_VALUES` different tags.
+
+    Returns:
+        (ndata, values, maxv): the flattened array of indexes, the (sorted) tags and
+        the number of slots per row
+    """
+    # each distinct value only needs to be split once
+    codes, uniques = pandas.factorize(data.to_numpy())
+    # non-string values are treated as empty
+    is_text = numpy.array([isinstance(v, str) for v in uniques], dtype=bool)
+    texts = uniques[is_text]
+    # split all the values at once, keeping track of which value each tag came from
+    ntags = numpy.array([v.count(delim) + 1 for v in texts], dtype=numpy.int64)
+    tags = delim.join(texts).split(delim) if len(texts) else []
+    tags = list(map(str.strip, tags))
+    tag_ids, values = pandas.factorize(numpy.array(tags, dtype=object), sort=True)
+    tag_rows = numpy.repeat(numpy.flatnonzero(is_text), ntags)
+    if len(values) and values[0] == "":
+        # remove empty tags
+        keep = tag_ids != 0
+        tag_ids = tag_ids[keep] - 1
+        tag_rows = tag_rows[keep]
+        values = values[1:]
+    check_multitext_values(len(values))
+    dtype = numpy.uint16
+    counts = numpy.bincount(tag_rows, minlength=len(uniques))
+    maxv = int(counts.max()) if len(counts) else 0
+    if maxv == 0 and len(texts):
+        # only empty strings - still need a slot for each row
+        maxv = 1
+    # sort the tags within each value, and get their position in the value
+    order = numpy.lexsort((tag_ids, tag_rows))
+    starts = numpy.cumsum(counts) - counts
+    pos = numpy.arange(len(tag_ids)) - numpy.repeat(starts, counts)
+    # one row of sorted indexes for each distinct value, plus an empty row (used for
+    # missing values, which have a code of -1)
+    table = numpy.full((len(uniques) + 1, maxv), numpy.iinfo(dtype).max, dtype=dtype)
+    table[tag_rows[order], pos] = tag_ids[order]
+    ndata = table[codes].reshape(-1)
+    return ndata, [str(x) for x in values], maxv
+
+
+def check_multitext_values(count: int):
+    if count > MAX_MULTITEXT_VALUES:
+        raise AttributeError(
+            f"multitext columns can have at most {MAX_MULTITEXT_VALUES} different"
+            f" values, not {count}"
+        )
+
+
+def get_quantiles(na: numpy.ndarray, quantiles=QUANTILES):
+    """Returns the lower and upper quantiles of the (finite) values,
+    in the format used in column metadata e.g. {"0.01": [q_0.01, q_0.99], ...}
+    """
+    qs = numpy.quantile(na, [q for x in quantiles for q in (x, 1 - x)]).tolist()
+    return {str(q): qs[i * 2 : i * 2 + 2] for i, q in enumerate(quantiles)}
 
 
 def get_column_info(columns, dataframe, supplied_columns_only):
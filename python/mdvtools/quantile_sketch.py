@@ -0,0 +1,141 @@
+"""
+Approximate quantiles of numeric columns, which can be calculated a chunk at a time
+and merged, without having all the values in memory.
+"""
+
+import numpy
+import h5py
+from typing import Iterable
+
+# the quantiles stored in column metadata
+QUANTILES = (0.001, 0.01, 0.05)
+
+
+class QuantileSketch:
+    """A merging t-digest: values are summarised by weighted centroids, which are
+    smallest at the extremes (where the quantiles in column metadata are), so that
+    tail quantiles are accurate. At most about ``compression/2`` centroids are kept,
+    regardless of how many values are added. The exact min and max are also kept.
+
+    Args:
+        compression (int, optional): Higher values give more accurate quantiles but
+            larger sketches. Default is 1000.
+    """
+
+    def __init__(self, compression=1000):
+        self.compression = compression
+        self.means = numpy.empty(0)
+        self.weights = numpy.empty(0)
+        self.min = numpy.inf
+        self.max = -numpy.inf
+        self._buffer: list[numpy.ndarray] = []
+        self._buffered = 0
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum()) + self._buffered
+
+    def add(self, values: numpy.ndarray):
+        """Adds (finite) values to the sketch"""
+        if len(values) == 0:
+            return
+        self.min = min(self.min, float(numpy.amin(values)))
+        self.max = max(self.max, float(numpy.amax(values)))
+        # sorting (and merging) a slice at a time is quicker than all at once
+        step = self.compression * 100
+        for i in range(0, len(values), step):
+            self._buffer.append(values[i : i + step])
+            self._buffered += len(self._buffer[-1])
+            if self._buffered > step:
+                self._compress()
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """Adds the values summarised by another sketch to this one"""
+        other._compress()
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(other.means, other.weights)
+        return self
+
+    def _compress(self, means=None, weights=None):
+        if not self._buffer and means is None:
+            return
+        # nb. the values are sorted in their own dtype (faster for float32)
+        values = [numpy.sort(b).astype(numpy.float64) for b in self._buffer]
+        m = numpy.concatenate(
+            [self.means, *values] + ([] if means is None else [means])
+        )
+        w = numpy.concatenate(
+            [self.weights]
+            + [numpy.ones(len(v)) for v in values]
+            + ([] if weights is None else [weights])
+        )
+        self._buffer = []
+        self._buffered = 0
+        order = numpy.argsort(m, kind="stable")
+        m, w = m[order], w[order]
+        total = w.sum()
+        # centroids are merged if they start in the same unit of the scale function
+        # k(q) = compression/(2pi) * asin(2q - 1)
+        q = (numpy.cumsum(w) - w) / total
+        k = self.compression / (2 * numpy.pi) * (numpy.arcsin(2 * q - 1) + numpy.pi / 2)
+        bucket = numpy.floor(k)
+        starts = numpy.flatnonzero(numpy.r_[True, bucket[1:] != bucket[:-1]])
+        self.weights = numpy.add.reduceat(w, starts)
+        self.means = numpy.add.reduceat(m * w, starts) / self.weights
+
+    def quantile(self, qs: Iterable[float]) -> list[float]:
+        """Returns the estimated value at each of the quantiles (0 to 1)"""
+        self._compress()
+        if len(self.weights) == 0:
+            raise ValueError("no values in quantile sketch")
+        total = self.weights.sum()
+        # each centroid's mean is placed at the middle of its weight, and values
+        # in between are interpolated, with the min and max at each end. The ranks
+        # are those used by numpy.quantile, so single values give the same result
+        centers = numpy.cumsum(self.weights) - self.weights / 2
+        x = numpy.r_[0, centers, total]
+        y = numpy.r_[self.min, self.means, self.max]
+        ranks = numpy.asarray(qs) * (total - 1) + 0.5
+        return numpy.interp(ranks, x, y).tolist()
+
+    def quantiles(self, quantiles=QUANTILES) -> dict[str, list[float]]:
+        """Returns quantiles in the same format as `mdvproject.get_quantiles`"""
+        qs = self.quantile([q for x in quantiles for q in (x, 1 - x)])
+        return {str(q): qs[i * 2 : i * 2 + 2] for i, q in enumerate(quantiles)}
+
+    def to_dict(self) -> dict:
+        self._compress()
+        return {
+            "compression": self.compression,
+            "min": self.min,
+            "max": self.max,
+            "means": self.means.tolist(),
+            "weights": self.weights.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "QuantileSketch":
+        sketch = cls(d["compression"])
+        sketch.min = d["min"]
+        sketch.max = d["max"]
+        sketch.means = numpy.asarray(d["means"], dtype=numpy.float64)
+        sketch.weights = numpy.asarray(d["weights"], dtype=numpy.float64)
+        return sketch
+
+    def save(self, dset: h5py.Dataset):
+        """Stores the sketch as attributes of a column's dataset"""
+        for k, v in self.to_dict().items():
+            dset.attrs[f"sketch_{k}"] = v
+
+    @classmethod
+    def load(cls, dset: h5py.Dataset):
+        """Returns the sketch stored with a column's dataset, or None"""
+        if "sketch_means" not in dset.attrs:
+            return None
+        return cls.from_dict(
+            {
+                k: dset.attrs[f"sketch_{k}"]
+                for k in ("compression", "min", "max", "means", "weights")
+            }
+        )
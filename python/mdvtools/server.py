@@ -3,26 +3,78 @@ from flask import (
     # Blueprint,
     render_template,
     request,
-    make_response,
-    send_file,
     Response,
     jsonify,
 )
 import webbrowser
-import mimetypes
 import json
-import sys
-import re
+import zlib
 from werkzeug.security import safe_join
 from mdvtools.websocket import mdv_socketio
 from mdvtools.mdvproject import MDVProject
+from mdvtools.file_ranges import send_file_range, send_cached_file, CACHE_CONTROL
 from mdvtools.project_router import ProjectBlueprint as Blueprint
 import os
-import pandas as pd
 from typing import Optional
 from datetime import datetime
 
 routes = set()
+# rows of an uploaded csv file added to a datasource at a time - the datatypes of
+# columns are deduced from the first chunk, and the upload fails (with a 400 naming the
+# row) if a later chunk has text in a column deduced to be numeric
+UPLOAD_CHUNKSIZE = 100_000
+
+
+# the size of the pieces of data sent at a time by `iter_buffers`
+RESPONSE_PIECE_SIZE = 1_048_576
+
+
+def iter_buffers(buffers):
+    """Yields the data in the buffers (e.g. the columns of a datasource) in pieces, so the whole
+    response is never copied into memory at once. The pieces are views of the buffers, so
+    nothing is copied here (see `as_bytes`)."""
+    for b in buffers:
+        b = memoryview(b).cast("B")
+        for i in range(0, len(b), RESPONSE_PIECE_SIZE):
+            yield b[i : i + RESPONSE_PIECE_SIZE]
+
+
+def as_bytes(pieces):
+    """Converts pieces of data (e.g. from `iter_buffers`) to bytes, which is all WSGI servers
+    accept. Each piece is only copied as it is sent, and bytes are passed on as they are."""
+    for piece in pieces:
+        yield piece if isinstance(piece, bytes) else bytes(piece)
+
+
+def abort_on_error(pieces):
+    """Passes on the pieces of a streamed response, logging any error raised while they
+    are produced (e.g. a column deleted while it is sent) before re-raising it. The status
+    and headers have already been sent by then, so the server closes the connection without
+    completing the body, and the client sees a failed request rather than accepting a
+    short response as complete."""
+    try:
+        yield from pieces
+    except Exception as e:
+        print(f"error while sending data, aborting the response: {e!r}")
+        raise
+
+
+# compression modes of /get_data responses and the zlib wbits of each:
+# 'gzip' - sent with Content-Encoding: gzip (if accepted), so decoded by the browser
+# 'zlib' - a zlib stream, to be inflated by the client (see decompressData in DataLoaders.js)
+RESPONSE_COMPRESSION = {"gzip": 31, "zlib": 15}
+# favour speed, as the data is compressed as it is sent
+RESPONSE_COMPRESSION_LEVEL = 1
+
+
+def compress_pieces(pieces, wbits: int, level=RESPONSE_COMPRESSION_LEVEL):
+    """Compresses a stream of bytes as it is sent"""
+    c = zlib.compressobj(level, zlib.DEFLATED, wbits)
+    for piece in pieces:
+        out = c.compress(piece)
+        if out:
+            yield out
+    yield c.flush()
 
 
 # consider using flask_cors...
@@ -36,44 +88,10 @@ def add_safe_headers(resp):
     return resp
 
 
-# flask send_file can't always cope with relative paths
-# sets the cwd to the python path for some reason
-def _send_file(f):
-    if not os.path.isabs(f):
-        f = os.path.join(os.getcwd(), f)
-    return send_file(f)
-
-
 def get_range(file_name, range_header):
-    file = open(file_name, "rb")
-    size = sys.getsizeof(file_name)
-    byte1, byte2 = 0, None
-
-    m = re.search(r"(\d+)-(\d*)", range_header)
-    if not m:
-        raise Exception("Invalid Range Header")
-    g = m.groups()
-
-    if g[0]:
-        byte1 = int(g[0])
-    if g[1]:
-        byte2 = int(g[1])
-
-    length = size - byte1
-    if byte2 is not None:
-        length = byte2 - byte1 + 1
-
-    file.seek(byte1)
-    data = file.read(length)
-    rv = Response(
-        data, 206, mimetype=mimetypes.guess_type(file_name)[0], direct_passthrough=True
-    )
-    rv.headers.add(
-        "Content-Range", "bytes {0}-{1}/{2}".format(byte1, byte1 + length - 1, size)
-    )
-    rv.headers.add("Accept-Ranges", "bytes")
-    file.close()
-    return rv
+    """Responds with the requested ranges of the file (or the whole file), see
+    `mdvtools.file_ranges`"""
+    return send_file_range(file_name, range_header, request.environ)
 
 
 def create_app(
@@ -123,8 +141,9 @@ def create_app(
     def get_binary_file(file):
         # should this now b '.gz'?
         file_name = safe_join(project.dir, file + ".b")
-        range_header = request.headers.get("Range", None)
-        return get_range(file_name, range_header)
+        if file_name is None or not os.path.exists(file_name):
+            return "File not found", 404
+        return send_cached_file(file_name, CACHE_CONTROL["data"], ranges=True)
 
     # duplicate of above, but for .gz files in case that's needed.
     # (there was some reason for changing to this, but I can't fully remember the status
@@ -132,8 +151,9 @@ def create_app(
     @project_bp.route("/<file>.gz")
     def get_binary_file_gz(file):
         file_name = safe_join(project.dir, file + ".gz")
-        range_header = request.headers.get("Range", None)
-        return get_range(file_name, range_header)
+        if file_name is None or not os.path.exists(file_name):
+            return "File not found", 404
+        return send_cached_file(file_name, CACHE_CONTROL["data"], ranges=True)
 
     @project_bp.route("/<file>.json")
     def get_json_file(file: str):
@@ -142,7 +162,7 @@ def create_app(
         path = safe_join(project.dir, file + ".json")
         if path is None or not os.path.exists(path):
             return "File not found", 404
-        return send_file(path)
+        return send_cached_file(path, CACHE_CONTROL["json"])
 
     # gets the raw byte data and packages it in the correct response
     @project_bp.route("/get_data", methods=["POST"])
@@ -153,21 +173,50 @@ def create_app(
                 raise Exception(
                     "Request must contain JSON with 'columns' and 'data_source'"
                 )
-            bytes_ = project.get_byte_data(data["columns"], data["data_source"])
-            response = make_response(bytes_)
+            compression = data.get("compression")
+            if compression and compression not in RESPONSE_COMPRESSION:
+                raise Exception(f"unknown compression '{compression}'")
+            if compression == "gzip" and "gzip" not in request.accept_encodings:
+                compression = None
+            # columns are read as they are sent, so the response is never held in
+            # memory. The columns are checked first, so an error while sending (see
+            # abort_on_error) is unlikely, but the client can still tell the response
+            # is incomplete - from the Content-Length, or the (chunked) compressed data
+            columns, ds = data["columns"], data["data_source"]
+            pieces = iter_buffers(project.iter_byte_data(columns, ds))
+            size = None
+            if compression:
+                pieces = compress_pieces(pieces, RESPONSE_COMPRESSION[compression])
+            else:
+                pieces = as_bytes(pieces)
+                size = project.get_byte_data_size(columns, ds)
+            response = Response(abort_on_error(pieces))
+            response.content_length = size
             response.headers.set("Content-Type", "application/octet-stream")
+            if compression == "gzip":
+                response.headers.set("Content-Encoding", "gzip")
+                response.headers.set("Vary", "Accept-Encoding")
             return response
         except Exception as e:
             print(e)
             return "Problem handling request", 400
 
+    # the hit rate etc. of the (server wide) cache of column data used by get_data
+    @project_bp.route("/data_cache_stats", methods=["GET"])
+    def data_cache_stats():
+        if project.byte_cache is None:
+            return jsonify({})
+        return jsonify(project.byte_cache.stats())
+
     # images contained in the project
     @project_bp.route("/images/<path:path>")
     def images(path):
         try:
-            return _send_file(project.get_image(path))
+            return send_cached_file(project.get_image(path), CACHE_CONTROL["images"])
         except Exception:
-            return _send_file(safe_join(project.imagefolder, path))
+            return send_cached_file(
+                safe_join(project.imagefolder, path), CACHE_CONTROL["images"]
+            )
 
     # All the project's metadata
     @project_bp.route("/get_configs", methods=["GET", "POST"])
@@ -225,10 +274,9 @@ def create_app(
     @project_bp.route("/tracks/<path:path>")
     def send_track(path):
         file_name = safe_join(project.trackfolder, path)
-        range_header = request.headers.get("Range", None)
-        if not range_header:
-            return _send_file(file_name)
-        return get_range(file_name, range_header)
+        if file_name is None or not os.path.exists(file_name):
+            return "File not found", 404
+        return get_range(file_name, request.headers.get("Range", None))
 
     @project_bp.route("/save_state", methods=["POST"])
     def save_data():
@@ -281,14 +329,17 @@ def create_app(
                 return "File must be a CSV", 400
             file.seek(0)
             # will this work? can we return progress to the client?
-            df = pd.read_csv(file.stream)
+            # the upload is read and added a chunk at a time, so it is never all in memory
+            # (datatypes are deduced from the first chunk, see UPLOAD_CHUNKSIZE)
             project.add_datasource(
                 name,
-                df,
+                file.stream,
                 # cols,
                 add_to_view=view,
                 supplied_columns_only=supplied_only,
                 replace_data=replace,
+                separator=",",
+                chunksize=UPLOAD_CHUNKSIZE,
             )
 
         except Exception as e:
@@ -356,14 +407,16 @@ def add_datasource_backend(project):
         # Read file and add the datasource
         file.seek(0)
         # will this work? can we return progress to the client?
-        df = pd.read_csv(file.stream)
+        # (datatypes are deduced from the first chunk, see UPLOAD_CHUNKSIZE)
         project.add_datasource(
             name,
-            df,
+            file.stream,
             # cols,
             add_to_view=view,
             supplied_columns_only=supplied_only,
             replace_data=replace,
+            separator=",",
+            chunksize=UPLOAD_CHUNKSIZE,
         )
 
         # database operations
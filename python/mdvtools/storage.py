@@ -0,0 +1,133 @@
+"""
+How datasets are laid out in a project's h5 file - chunking and compression.
+
+Options are dictionaries (stored in the project's state and optionally in a
+column's metadata as 'storage'), with the following (optional) keys:
+
+    chunks (int): The number of values in each chunk. Required for compression,
+        if not given h5py will guess a chunk size.
+    compression (str): 'gzip', 'lzf' or 'blosc' (which requires the hdf5plugin package).
+    level (int): The compression level (gzip 0-9, blosc 0-9).
+    cname (str): The blosc compressor, 'lz4' by default.
+    shuffle (bool): Whether to apply the byte shuffle filter before compression,
+        which often improves the compression of numeric data.
+
+e.g. {"chunks": 65536, "compression": "gzip", "level": 4, "shuffle": True}
+"""
+
+import h5py
+from typing import Callable, Optional
+
+COMPRESSION = ("gzip", "lzf", "blosc")
+
+
+def check_storage_options(options: Optional[dict]):
+    if not options:
+        return
+    unknown = set(options) - {"chunks", "compression", "level", "shuffle", "cname"}
+    if unknown:
+        raise AttributeError(f"unknown storage options: {', '.join(sorted(unknown))}")
+    compression = options.get("compression")
+    if compression and compression not in COMPRESSION:
+        raise AttributeError(
+            f"unknown compression '{compression}', must be one of {', '.join(COMPRESSION)}"
+        )
+    if compression == "blosc":
+        _get_hdf5plugin()
+    chunks = options.get("chunks")
+    if chunks is not None and (not isinstance(chunks, int) or chunks < 1):
+        raise AttributeError("chunks must be a positive integer")
+
+
+def _get_hdf5plugin():
+    try:
+        import hdf5plugin
+    except ImportError:
+        raise AttributeError("the hdf5plugin package is required for blosc compression")
+    return hdf5plugin
+
+
+def dataset_options(options: Optional[dict], length: int, resizable=False) -> dict:
+    """Returns the keyword arguments for `h5py.Group.create_dataset` to create a
+    (1D) dataset of the given length with the storage options. Empty datasets
+    are always contiguous, unless they are resizable (which requires chunks).
+    """
+    if not options:
+        return {"chunks": True} if resizable else {}
+    if length == 0 and not resizable:
+        return {}
+    kw = {}
+    compression = options.get("compression")
+    shuffle = bool(options.get("shuffle"))
+    if compression == "blosc":
+        hdf5plugin = _get_hdf5plugin()
+        kw.update(
+            hdf5plugin.Blosc(
+                cname=options.get("cname", "lz4"),
+                clevel=options.get("level", 5),
+                shuffle=hdf5plugin.Blosc.SHUFFLE
+                if shuffle
+                else hdf5plugin.Blosc.NOSHUFFLE,
+            )
+        )
+    elif compression:
+        kw["compression"] = compression
+        if compression == "gzip" and options.get("level") is not None:
+            kw["compression_opts"] = options["level"]
+        kw["shuffle"] = shuffle
+    elif shuffle:
+        kw["shuffle"] = True
+    chunks = options.get("chunks")
+    if chunks:
+        # chunks can't be larger than a (fixed size) dataset
+        kw["chunks"] = (chunks if resizable else max(1, min(chunks, length)),)
+    elif kw or resizable:
+        kw["chunks"] = True
+    return kw
+
+
+def merge_storage_options(
+    project: Optional[dict], column: Optional[dict]
+) -> Optional[dict]:
+    """Column options override the project's"""
+    if not column:
+        return project
+    return {**(project or {}), **column}
+
+
+# values copied at a time when repacking
+COPY_SIZE = 4_000_000
+
+
+def copy_h5(
+    source: h5py.File, dest: h5py.File, get_options: Callable[[str], Optional[dict]]
+):
+    """Copies everything in the source file to the destination, with each 1D or 2D
+    dataset stored with the options returned by `get_options(name)` (the dataset's
+    path in the file). 2D datasets (dense subgroups) keep their chunk shape. Other
+    datasets keep their existing layout."""
+    dest.attrs.update(source.attrs)
+
+    def copy(name, obj):
+        if isinstance(obj, h5py.Group):
+            dest.require_group(name).attrs.update(obj.attrs)
+            return
+        if obj.ndim not in (1, 2):
+            source.copy(
+                obj, dest.require_group(obj.parent.name), obj.name.split("/")[-1]
+            )
+            return
+        length = obj.shape[-1]
+        opts = dataset_options(get_options(name), length)
+        step = COPY_SIZE
+        if obj.ndim == 2:
+            step = max(1, COPY_SIZE // max(length, 1))
+            if length and (obj.chunks or "chunks" in opts):
+                # chunked by row if not already chunked
+                opts["chunks"] = obj.chunks or (1, length)
+        new = dest.create_dataset(name, obj.shape, dtype=obj.dtype, **opts)
+        for s in range(0, obj.shape[0], step):
+            new[s : s + step] = obj[s : s + step]
+        new.attrs.update(obj.attrs)
+
+    source.visititems(copy)
@@ -0,0 +1,35 @@
+from mdvtools.mdvproject import MDVProject
+from tempfile import TemporaryDirectory
+import pandas as pd
+import numpy as np
+
+
+def test_add_annotations():
+    cells = pd.DataFrame(
+        {
+            "cluster": ["c1", "c2", "c3", "c1", "c4"],
+            "barcode": ["b1", "b2", "b3", "b4", "b5"],
+        }
+    )
+    annotations = pd.DataFrame(
+        {
+            "cluster": ["c1", "c2", "c3", "c2"],
+            "cell_type": ["T", "B", "NK", "B2"],
+            "score": [0.5, 1.5, 2.5, 3.5],
+        }
+    )
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("cells", cells, [{"name": "barcode", "datatype": "unique"}])
+        p.add_annotations("cells", annotations)
+        fields = [c["field"] for c in p.get_datasource_metadata("cells")["columns"]]
+        assert fields == ["cluster", "barcode", "cell_type", "score"]
+        # the last of duplicated index values is used, and missing ones are 'ND'/NaN
+        assert p.get_column("cells", "cell_type") == ["T", "B2", "NK", "T", "ND"]
+        score = p.get_column("cells", "score")
+        assert score[:4] == [0.5, 3.5, 2.5, 0.5] and np.isnan(score[4])
+
+        # indexed by a unique column
+        by_barcode = pd.DataFrame({"barcode": ["b5", "b1"], "qc": ["fail", "pass"]})
+        p.add_annotations("cells", by_barcode, missing_value="none")
+        assert p.get_column("cells", "qc") == ["pass", "none", "none", "none", "fail"]
@@ -0,0 +1,62 @@
+from mdvtools.mdvproject import MDVProject
+from mdvtools.byte_cache import ByteCache
+from tempfile import TemporaryDirectory
+import pandas as pd
+import numpy as np
+
+
+def test_byte_cache():
+    cache = ByteCache(30)
+    cache.put("a", b"x" * 7)
+    cache.put("b", b"y" * 7)
+    assert cache.get("a") == b"x" * 7
+    # larger than a quarter of the budget
+    cache.put("big", b"z" * 8)
+    assert cache.get("big") is None
+    for k in "cde":
+        cache.put(k, b"z" * 7)
+    # "b" is the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    stats = cache.stats()
+    assert stats["bytes"] == 28 and stats["items"] == 4
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["evictions"] == 1
+    assert stats["hit_rate"] == 0.5
+    cache.discard(lambda k: k in ("a", "c"))
+    assert cache.stats()["items"] == 2 and cache.size == 14
+
+
+def test_project_byte_cache():
+    df = pd.DataFrame({"num": np.arange(100, dtype=float), "id": ["a", "b"] * 50})
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.byte_cache = ByteCache()
+        p.add_datasource(
+            "cells",
+            df,
+            columns=[
+                {"name": "num", "datatype": "double", "storage": {"chunks": 10}},
+                {"name": "id", "datatype": "text"},
+            ],
+        )
+        p.add_datasource("genes", pd.DataFrame({"name": ["g1", "g2"]}))
+        p.add_rows_as_columns_link("cells", "genes", "name", "Gene Expr")
+        matrix = np.arange(200, dtype=np.float32).reshape(100, 2)
+        p.add_rows_as_columns_subgroup("cells", "genes", "gs", matrix)
+        columns = [
+            {"field": "num"},
+            {"field": "id"},
+            {"subgroup": "gs", "sgindex": 1},
+        ]
+        data = p.get_byte_data(columns, "cells")
+        # the chunked column and the subgroup column, but not the contiguous one
+        assert p.byte_cache.stats()["items"] == 2
+        assert p.get_byte_data(columns, "cells") == data
+        assert p.byte_cache.metrics["hits"] == 2
+        assert p.byte_cache.metrics["misses"] == 2
+
+        # changes to the data invalidate the cache
+        p.set_column("cells", {"name": "num", "datatype": "double"}, df["num"] * 2)
+        data = p.get_byte_data([{"field": "num"}], "cells")
+        assert data == (df["num"] * 2).to_numpy(np.float32).tobytes()
+        assert p.byte_cache.stats()["items"] == 0
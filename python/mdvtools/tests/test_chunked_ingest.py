@@ -0,0 +1,93 @@
+from mdvtools.mdvproject import MDVProject
+from tempfile import TemporaryDirectory
+import os
+import pandas as pd
+import numpy as np
+import pytest
+
+
+def test_add_datasource_chunked():
+    rng = np.random.default_rng(1)
+    n = 1000
+    df = pd.DataFrame(
+        {
+            "text": rng.choice(["a", "b", "c", None], n),
+            "tags": rng.choice(["x,y", "", "y", "z,x,y", "w"], n),
+            "id": [f"id_{i}" for i in range(n)],
+            "int": rng.integers(0, 100, n),
+            "num": rng.normal(size=n),
+        }
+    )
+    # only a few rows have many tags
+    df.loc[n - 1, "tags"] = "p,q,r,s,t"
+    columns = [
+        {"name": "tags", "datatype": "multitext"},
+        {"name": "id", "datatype": "unique"},
+    ]
+    with TemporaryDirectory() as dir:
+        file = os.path.join(dir, "data.tsv")
+        df.to_csv(file, sep="\t", index=False)
+        p = MDVProject(dir)
+        p.add_datasource("whole", file, columns=[dict(x) for x in columns])
+        p.add_datasource(
+            "chunked", file, columns=[dict(x) for x in columns], chunksize=128
+        )
+        whole = p.get_datasource_metadata("whole")
+        chunked = p.get_datasource_metadata("chunked")
+        assert chunked["size"] == n
+        for c1, c2 in zip(whole["columns"], chunked["columns"]):
+            assert c1["datatype"] == c2["datatype"]
+            if c1["datatype"] in ("text", "multitext"):
+                assert sorted(c1["values"]) == sorted(c2["values"])
+            if c1["datatype"] == "text":
+                assert c1["values"][0] == c2["values"][0]
+            if "minMax" in c1:
+                assert c1["minMax"] == c2["minMax"]
+            assert p.get_column("whole", c1["field"]) == p.get_column(
+                "chunked", c1["field"]
+            )
+        with p._get_h5_handle(read_only=True) as h5:
+            assert "__ingest" not in h5["chunked"]
+        # the temporary h5 file is removed
+        assert not [f for f in os.listdir(dir) if f.endswith(".tmp")]
+
+
+def test_chunked_ingest_errors():
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        file = os.path.join(dir, "data.csv")
+        # more tags than the client can read
+        n = 70000
+        df = pd.DataFrame({"tags": [f"t{i}" for i in range(n)], "x": np.arange(n)})
+        df.to_csv(file, index=False)
+        columns = [{"name": "tags", "datatype": "multitext"}]
+        # in one chunk, or only once the chunks are combined
+        for chunksize in (100_000, 40_000):
+            with pytest.warns(UserWarning, match="65535"):
+                bad = p.add_datasource(
+                    "t",
+                    file,
+                    columns=[dict(x) for x in columns],
+                    separator=",",
+                    chunksize=chunksize,
+                    replace_data=True,
+                )
+            assert bad == ["tags"]
+            fields = [c["field"] for c in p.get_datasource_metadata("t")["columns"]]
+            assert fields == ["x"]
+
+        # text after the first chunk of a column deduced to be numeric
+        df = pd.DataFrame({"x": [str(i) for i in range(300)]})
+        df.loc[250, "x"] = "abc"
+        df.to_csv(file, index=False)
+        with pytest.raises(AttributeError, match="row 251 has the value 'abc'"):
+            p.add_datasource("t2", file, separator=",", chunksize=100)
+        assert "t2" not in [ds["name"] for ds in p.datasources]
+        # unless its datatype is supplied
+        columns = [{"name": "x", "datatype": "text"}]
+        p.add_datasource("t2", file, columns=columns, separator=",", chunksize=100)
+        assert p.get_column("t2", "x")[250] == "abc"
+
+
+if __name__ == "__main__":
+    test_add_datasource_chunked()
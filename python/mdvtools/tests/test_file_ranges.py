@@ -0,0 +1,97 @@
+from mdvtools.file_ranges import send_file_range, send_cached_file, CACHE_CONTROL
+from tempfile import TemporaryDirectory
+from os.path import join
+from flask import Flask
+import os
+import re
+
+
+def body(rv):
+    # direct passthrough responses have to be iterated
+    data = b"".join(rv.response)
+    rv.close()
+    return data
+
+
+def test_send_file_range():
+    data = bytes(range(256)) * 40
+    with TemporaryDirectory() as dir:
+        path = join(dir, "track.bb")
+        with open(path, "wb") as f:
+            f.write(data)
+        rv = send_file_range(path, "bytes=10-19", {})
+        assert rv.status_code == 206
+        assert body(rv) == data[10:20]
+        assert rv.headers["Content-Range"] == f"bytes 10-19/{len(data)}"
+        assert rv.content_length == 10
+        # open ended and suffix ranges, past the end of the file
+        rv = send_file_range(path, "bytes=10000-20000", {})
+        assert body(rv) == data[10000:]
+        rv = send_file_range(path, "bytes=-5", {})
+        assert body(rv) == data[-5:]
+        # no header - the whole file
+        rv = send_file_range(path, None, {})
+        assert rv.status_code == 200 and body(rv) == data
+        # nothing in the file
+        rv = send_file_range(path, "bytes=20000-", {})
+        assert rv.status_code == 416
+        assert rv.headers["Content-Range"] == f"bytes */{len(data)}"
+
+        # multiple ranges
+        rv = send_file_range(path, "bytes=0-3,100-103", {})
+        assert rv.status_code == 206
+        boundary = re.search("boundary=(.*)", rv.headers["Content-Type"]).group(1)
+        content = body(rv)
+        assert rv.content_length == len(content)
+        parts = content.split(f"--{boundary}".encode())
+        assert len(parts) == 4 and parts[-1] == b"--\r\n"
+        assert parts[1].endswith(b"\r\n\r\n" + data[0:4] + b"\r\n")
+        assert b"Content-Range: bytes 100-103/10240" in parts[2]
+        assert parts[2].endswith(data[100:104] + b"\r\n")
+
+
+def test_send_cached_file():
+    data = bytes(range(256)) * 4
+    with TemporaryDirectory() as dir:
+        path = join(dir, "ds.b")
+        with open(path, "wb") as f:
+            f.write(data)
+        app = Flask(__name__)
+
+        @app.route("/data")
+        def get_data():
+            return send_cached_file(path, CACHE_CONTROL["data"], ranges=True)
+
+        @app.route("/image")
+        def get_image():
+            return send_cached_file(path, CACHE_CONTROL["images"])
+
+        client = app.test_client()
+        rv = client.get("/data")
+        assert rv.status_code == 200 and rv.data == data
+        etag = rv.headers["ETag"]
+        assert etag and rv.headers["Last-Modified"]
+        assert rv.headers["Cache-Control"] == "no-cache"
+        assert client.get("/image").headers["Cache-Control"] == CACHE_CONTROL["images"]
+
+        # the client's copy is current
+        rv = client.get("/data", headers={"If-None-Match": etag})
+        assert rv.status_code == 304 and rv.data == b""
+        assert rv.headers["ETag"] == etag
+        assert rv.headers["Cache-Control"] == "no-cache"
+        # a range of the current version
+        rv = client.get("/data", headers={"Range": "bytes=0-9", "If-Range": etag})
+        assert rv.status_code == 206 and rv.data == data[:10]
+
+        # the file is changed, so the old ETag no longer matches
+        with open(path, "wb") as f:
+            f.write(data[::-1])
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        rv = client.get("/data", headers={"If-None-Match": etag})
+        assert rv.status_code == 200 and rv.data == data[::-1]
+        assert rv.headers["ETag"] != etag
+        # a range of the old version - the whole (new) file is sent instead
+        rv = client.get("/data", headers={"Range": "bytes=0-9", "If-Range": etag})
+        assert rv.status_code == 200 and rv.data == data[::-1]
+        assert "Content-Range" not in rv.headers
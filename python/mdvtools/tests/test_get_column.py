@@ -0,0 +1,141 @@
+from mdvtools.mdvproject import MDVProject
+from tempfile import TemporaryDirectory
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_get_column():
+    df = pd.DataFrame(
+        {
+            "text": ["a", "b", "a", None],
+            "tags": ["x,y", "", "y", "z,x,y"],
+            "id": ["id_1", "id_2", "id_3", "id_40"],
+            "num": [1.5, 2, np.nan, 4],
+        }
+    )
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource(
+            "t",
+            df,
+            columns=[
+                {"name": "tags", "datatype": "multitext"},
+                {"name": "id", "datatype": "unique"},
+            ],
+        )
+        assert p.get_column("t", "text") == ["a", "b", "a", "NaN"]
+        assert p.get_column("t", "tags") == ["x,y", "", "y", "x,y,z"]
+        assert p.get_column("t", "id") == ["id_1", "id_2", "id_3", "id_40"]
+        num = p.get_column("t", "num")
+        assert num[0] == 1.5 and np.isnan(num[2])
+
+        text = p.get_column("t", "text", as_array=True)
+        assert isinstance(text, pd.Categorical)
+        assert list(text) == ["a", "b", "a", "NaN"]
+        num = p.get_column("t", "num", as_array=True)
+        assert isinstance(num, np.ndarray) and num.dtype == np.float32
+        tags = p.get_column("t", "tags", as_array=True)
+        assert list(tags) == ["x,y", "", "y", "x,y,z"]
+
+
+def test_get_datasource_as_dataframe():
+    df = pd.DataFrame(
+        {
+            "text": ["a", "b", "a", "c"],
+            "tags": ["x,y", "", "y", "z,x"],
+            "num": [1.5, 2, 3, 4],
+        }
+    )
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("t", df, columns=[{"name": "tags", "datatype": "multitext"}])
+        all = p.get_datasource_as_dataframe("t")
+        assert list(all.columns) == ["text", "tags", "num"]
+        assert all["text"].dtype == "category"
+        assert list(all["tags"]) == ["x,y", "", "y", "x,z"]
+
+        some = p.get_datasource_as_dataframe(
+            "t", ["tags", "text"], slice(1, 3), categorical=False
+        )
+        assert list(some.columns) == ["tags", "text"]
+        assert list(some["tags"]) == ["", "y"]
+        assert list(some["text"]) == ["b", "a"]
+
+        mask = np.array([True, False, False, True])
+        masked = p.get_datasource_as_dataframe("t", rows=mask)
+        assert list(masked["tags"]) == ["x,y", "x,z"]
+        assert list(masked["num"]) == [1.5, 4]
+        assert list(p.get_datasource_as_dataframe("t", rows=[2])["text"]) == ["a"]
+
+
+def test_add_datasource_workers():
+    df = pd.DataFrame(
+        {
+            "text": ["a", "b", "a", "c"] * 50,
+            "tags": ["x,y", "", "y", "z,x"] * 50,
+            "num": np.arange(200, dtype=float),
+            "bad": [np.nan] * 200,
+        }
+    )
+    columns = [{"name": "tags", "datatype": "multitext"}]
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("serial", df, columns=columns)
+        bad = p.add_datasource("parallel", df, columns=columns, workers=2)
+        assert bad == ["bad"]
+        assert p.datasources[0]["columns"] == p.datasources[1]["columns"]
+        for c in ["text", "tags", "num"]:
+            assert p.get_column("serial", c) == p.get_column("parallel", c)
+
+
+def test_get_byte_buffers():
+    df = pd.DataFrame({"num": np.arange(1000, dtype=float), "text": ["a", "b"] * 500})
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource(
+            "t",
+            df,
+            columns=[
+                {
+                    "name": "num",
+                    "datatype": "double",
+                    "storage": {"compression": "gzip"},
+                }
+            ],
+        )
+        p.set_column("t", {"name": "num2", "datatype": "double"}, df["num"])
+        columns = [{"field": "num"}, {"field": "text"}, {"field": "num2"}]
+        buffers = p.get_byte_buffers(columns, "t")
+        expected = [p.get_column("t", c["field"], raw=True).tobytes() for c in columns]
+        assert [bytes(b) for b in buffers] == expected
+        # copied once out of the file, not left as a memory map of it
+        assert not any(isinstance(b.obj, np.memmap) for b in buffers)
+        assert p.get_byte_data(columns, "t") == b"".join(expected)
+        # the data is copied from the file before its handle is released, so is not
+        # changed by later writes
+        p.set_column("t", {"name": "num2", "datatype": "double"}, df["num"] * 2)
+        p.repack()
+        assert [bytes(b) for b in buffers] == expected
+
+
+def test_iter_byte_data():
+    df = pd.DataFrame({"a": np.arange(100, dtype=float), "b": np.ones(100)})
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("t", df)
+        columns = [{"field": "a"}, {"field": "b"}]
+        it = p.iter_byte_data(columns, "t")
+        # columns are read one at a time, and the h5 handle isn't held in between
+        first = next(it)
+        with ThreadPoolExecutor(1) as ex:
+            assert ex.submit(p.get_column, "t", "b").result(timeout=10) is not None
+        assert bytes(first) == p.get_column("t", "a", raw=True).tobytes()
+        assert bytes(next(it)) == p.get_column("t", "b", raw=True).tobytes()
+        assert next(it, None) is None
+        # missing columns are reported before anything is sent
+        try:
+            p.iter_byte_data([{"field": "a"}, {"field": "missing"}], "t")
+            assert False
+        except KeyError:
+            pass
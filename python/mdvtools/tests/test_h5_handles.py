@@ -0,0 +1,93 @@
+from mdvtools.mdvproject import MDVProject
+from mdvtools.h5_handles import H5Handles
+from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import threading
+import os
+import pytest
+
+
+def test_h5_handles():
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("t", pd.DataFrame({"a": [1, 2, 3], "b": [4, 5, 6]}))
+        opened = p.get_h5_metrics()["opened"]
+        # readers share one handle
+        for _ in range(5):
+            p.get_column("t", "a")
+            p.get_byte_data([{"field": "b"}], "t")
+        assert p.get_h5_metrics()["opened"] == opened + 1
+        # which is reopened after a write
+        p.set_column("t", "c", [7, 8, 9])
+        assert list(p.get_column("t", "c")) == [7, 8, 9]
+        assert p.get_h5_metrics()["opened"] == opened + 3
+        # the write handle is kept open for a batch
+        with p.batch():
+            for i in range(5):
+                p.set_column("t", f"d{i}", [i, i, i])
+            assert list(p.get_column("t", "d0")) == [0, 0, 0]
+        assert p.get_h5_metrics()["opened"] == opened + 4
+        p.close()
+        m = p.get_h5_metrics()
+        assert m["opened"] == m["closed"]
+
+
+def test_h5_handles_retry():
+    with TemporaryDirectory() as dir:
+        h = H5Handles(os.path.join(dir, "missing", "datafile.h5"), 3, 0.001)
+        with pytest.raises(Exception):
+            with h.write():
+                pass
+        assert h.metrics["retries"] == 2
+
+
+def test_h5_handles_version():
+    with TemporaryDirectory() as dir:
+        h = H5Handles(os.path.join(dir, "datafile.h5"))
+        with h.write() as h5:
+            h5["a"] = [1, 2, 3]
+        version = h.version
+        assert h.version == version
+        # released at the end of a batch
+        with h.hold_write():
+            with h.write() as h5:
+                h5["b"] = [4, 5, 6]
+            version = h.version
+        assert h.version > version
+        # changed by another process, with no handle open
+        version = h.version
+        st = os.stat(h.file)
+        os.utime(h.file, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        assert h.version > version
+        h.close()
+
+
+def test_h5_handles_concurrent_reads():
+    with TemporaryDirectory() as dir:
+        h = H5Handles(os.path.join(dir, "datafile.h5"))
+        with h.write() as h5:
+            h5["a"] = [1, 2, 3]
+        written = threading.Event()
+
+        def read():
+            with h.read() as h5:
+                return h5["a"][()].tolist()
+
+        def write():
+            with h.write() as h5:
+                h5["b"] = [4, 5, 6]
+            written.set()
+
+        with ThreadPoolExecutor(2) as ex:
+            with h.read() as h5:
+                # other threads can read at the same time
+                assert ex.submit(read).result(timeout=10) == [1, 2, 3]
+                # but a write waits until the handle isn't being used
+                ex.submit(write)
+                assert not written.wait(0.2)
+                assert h5["a"][()].tolist() == [1, 2, 3]
+            assert written.wait(10)
+        with h.read() as h5:
+            assert h5["b"][()].tolist() == [4, 5, 6]
+        h.close()
@@ -0,0 +1,97 @@
+from mdvtools.mdvproject import MDVProject
+from tempfile import TemporaryDirectory
+import pandas as pd
+
+
+def test_metadata_cache():
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("t", pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "x"]}))
+        # returned metadata are copies, changing them should not affect the project
+        ds = p.get_datasource_metadata("t")
+        ds["columns"] = []
+        p.get_column_metadata("t", "a")["name"] = "changed"
+        p.datasources[0]["name"] = "changed"
+        assert p.datasources[0]["name"] == "t"
+        assert p.get_column_metadata("t", "a")["name"] == "a"
+        assert len(p.get_datasource_metadata("t")["columns"]) == 2
+
+        # changes made by another instance (or process) should be picked up
+        p2 = MDVProject(dir)
+        p2.set_column_metadata("t", "a", "name", "A")
+        p2.set_view("other", {"initialCharts": {"t": []}})
+        assert p.get_column_metadata("t", "a")["name"] == "A"
+        assert p.get_view("other") is not None
+        assert "other" in p.state["all_views"]
+        assert list(p.get_column("t", "b")) == ["x", "y", "x"]
+
+
+def test_metadata_batch():
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("t", pd.DataFrame({"a": [1, 2, 3]}))
+        before = p.datasources
+        with p.batch():
+            p.set_column("t", "b", [4, 5, 6])
+            p.set_column_metadata("t", "b", "name", "B")
+            # nothing written until the end of the batch
+            assert MDVProject(dir).datasources == before
+            assert p.get_column_metadata("t", "b")["name"] == "B"
+        assert MDVProject(dir).get_column_metadata("t", "b")["name"] == "B"
+
+        # metadata changes are discarded if there is an error
+        try:
+            with p.batch():
+                p.set_column_metadata("t", "a", "name", "A")
+                p.set_view("other", {"initialCharts": {"t": []}})
+                raise ValueError()
+        except ValueError:
+            pass
+        assert p.get_column_metadata("t", "a")["name"] == "a"
+        assert p.get_view("other") is None
+        assert "other" not in p.state["all_views"]
+
+        # if writing one file fails, the others are still written and nothing is deferred
+        def fail():
+            raise OSError("disk full")
+
+        p._datasources_cache.flush = fail
+        try:
+            with p.batch():
+                p.set_column_metadata("t", "a", "name", "A")
+                p.set_view("other", {"initialCharts": {"t": []}})
+            assert False
+        except OSError:
+            pass
+        assert MDVProject(dir).get_view("other") is not None
+        del p._datasources_cache.flush
+        assert not p._datasources_cache.deferred and not p._views_cache.deferred
+        p.set_column_metadata("t", "b", "name", "BB")
+        assert MDVProject(dir).get_column_metadata("t", "b")["name"] == "BB"
+
+
+def test_column_lookup():
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("t", pd.DataFrame({"a": [1, 2, 3]}))
+        with p.batch():
+            for i in range(20):
+                p.set_column("t", {"name": f"c{i}", "datatype": "double"}, [i] * 3)
+        assert p.check_columns_exist("t", ["a", "c0", "c19", "x"]) == ["x"]
+        p.remove_column("t", "c5")
+        assert p.check_columns_exist("t", ["c4", "c5", "c6"]) == ["c5"]
+        assert p.get_column_metadata("t", "c6")["minMax"] == [6, 6]
+        # replacing an existing column keeps its position
+        p.set_column("t", {"name": "c0", "datatype": "double"}, [7, 8, 9])
+        assert p.datasources[0]["columns"][1]["minMax"] == [7, 9]
+        assert len(p.datasources[0]["columns"]) == 20
+        # changes to the list in place are seen, whichever name is looked up first
+        p.set_column_metadata("t", "c1", "field", "renamed")
+        assert p.check_columns_exist("t", ["renamed", "c1"]) == ["c1"]
+        assert p.get_column_metadata("t", "renamed")["name"] == "c1"
+        # as are datasources replaced in the same order, with different names
+        dss = p.datasources
+        dss[0]["name"] = "u"
+        p.datasources = dss
+        assert p.get_datasource_metadata("u")["name"] == "u"
+        assert p.check_columns_exist("u", ["renamed", "c2"]) == []
@@ -1,6 +1,7 @@
-from mdvtools.mdvproject import MDVProject
+from mdvtools.mdvproject import MDVProject, encode_multitext
 from tempfile import TemporaryDirectory
 import pandas as pd
+import numpy as np
 
 
 def test_compliant_multitext():
@@ -33,5 +34,24 @@ def test_compliant_multitext():
         # todo catch the error with __tags saved from frontend...
 
 
+def test_multitext_encoding():
+    data = pd.Series(["b, a", None, "", "c,a,b", "a", 1.0])
+    ndata, values, maxv = encode_multitext(data)
+    assert values == ["a", "b", "c"]
+    assert maxv == 3
+    assert ndata.dtype == np.uint16
+    e = 65535
+    assert ndata.tolist() == [0, 1, e, e, e, e, e, e, e, 0, 1, 2, 0, e, e, e, e, e]
+    # the most tags that fit in uint16 (with 65535 as the empty marker)
+    ndata, values, maxv = encode_multitext(pd.Series([f"t{i}" for i in range(65535)]))
+    assert ndata.dtype == np.uint16 and ndata.max() == 65534
+    # too many tags for the client to read
+    try:
+        encode_multitext(pd.Series([f"t{i}" for i in range(70000)]))
+        assert False
+    except AttributeError as e:
+        assert "65535" in str(e)
+
+
 if __name__ == "__main__":
     test_compliant_multitext()
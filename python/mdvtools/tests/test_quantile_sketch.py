@@ -0,0 +1,69 @@
+from mdvtools.mdvproject import MDVProject, get_quantiles
+from mdvtools.quantile_sketch import QuantileSketch
+from tempfile import TemporaryDirectory
+import pandas as pd
+import numpy as np
+
+
+def rank_error(sorted_values, quantiles):
+    n = len(sorted_values)
+    errors = []
+    for q, (lo, hi) in quantiles.items():
+        q = float(q)
+        errors.append(abs(np.searchsorted(sorted_values, lo) / n - q))
+        errors.append(abs(np.searchsorted(sorted_values, hi) / n - (1 - q)))
+    return max(errors)
+
+
+def test_quantile_sketch():
+    rng = np.random.default_rng(0)
+    values = rng.lognormal(size=200_000)
+    s = np.sort(values)
+    whole = QuantileSketch()
+    whole.add(values)
+    assert whole.min == s[0] and whole.max == s[-1]
+    assert rank_error(s, whole.quantiles()) < 0.0005
+    assert len(whole.means) <= whole.compression / 2 + 1
+
+    # merged from chunks added to different sketches
+    parts = [QuantileSketch() for _ in range(3)]
+    for i, chunk in enumerate(np.array_split(values, 20)):
+        parts[i % 3].add(chunk)
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    assert merged.count == len(values)
+    assert rank_error(s, merged.quantiles()) < 0.0005
+
+    # the same as numpy.quantile if there are fewer values than the compression
+    small = QuantileSketch()
+    small.add(values[:100])
+    assert np.allclose(
+        list(small.quantiles().values()), list(get_quantiles(values[:100]).values())
+    )
+
+    copy = QuantileSketch.from_dict(merged.to_dict())
+    assert copy.quantiles() == merged.quantiles()
+
+
+def test_stored_sketch():
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({"a": rng.normal(size=5000), "b": rng.normal(size=5000)})
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("exact", df)
+        p.add_datasource("sketch", df, quantile_sketch=True)
+        for c1, c2 in zip(
+            p.get_datasource_metadata("exact")["columns"],
+            p.get_datasource_metadata("sketch")["columns"],
+        ):
+            assert "_sketch" not in c2
+            assert c1["minMax"] == c2["minMax"]
+            assert np.allclose(
+                list(c1["quantiles"].values()),
+                list(c2["quantiles"].values()),
+                atol=0.05,
+            )
+        stored = p.get_column_sketch("sketch", "a")
+        assert stored.count == 5000
+        # made from the data if not stored
+        made = p.get_column_sketch("exact", "a")
+        assert made.quantiles() == stored.quantiles()
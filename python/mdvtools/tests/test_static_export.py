@@ -0,0 +1,221 @@
+from mdvtools.mdvproject import MDVProject
+from mdvtools import binary_codecs, mdvproject
+from tempfile import TemporaryDirectory
+from os.path import join, exists
+import pandas as pd
+import numpy as np
+import pytest
+import gzip
+import json
+import os
+import time
+
+
+def get_decoder(codec):
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress
+    return gzip.decompress if codec == "gzip" else bytes
+
+
+def read_export(dir, name):
+    index = json.load(open(join(dir, f"{name}.json")))
+    data = open(join(dir, f"{name}.gz"), "rb").read()
+    codec, items = binary_codecs.read_export_index(index)
+    decode = get_decoder(codec)
+    return {k: decode(data[s : e + 1]) for k, (s, e) in items.items()}
+
+
+def test_convert_data_to_binary():
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        df = pd.DataFrame({"id": [f"c{i}" for i in range(50)], "x": np.arange(50.0)})
+        p.add_datasource("cells", df)
+        p.add_datasource("genes", pd.DataFrame({"name": ["g1", "g2", "g3"]}))
+        p.add_rows_as_columns_link("cells", "genes", "name", "Gene Expr")
+        matrix = np.arange(150, dtype=np.float32).reshape(50, 3)
+        p.add_rows_as_columns_subgroup("cells", "genes", "gs", matrix)
+
+        out1, out2 = join(dir, "out1"), join(dir, "out2")
+        for out in (out1, out2):
+            os.mkdir(out)
+        calls = []
+        p.convert_data_to_binary(out1, progress=lambda *x: calls.append(x))
+        # two columns and three genes, then one column
+        assert ("cells", 5, 5) in calls and calls[-1] == ("genes", 1, 1)
+        assert len(calls) == 6
+        items = read_export(out1, "cells")
+        assert items["x"] == p.get_byte_data([{"field": "x"}], "cells")
+        assert items["gs2"] == matrix[:, 2].tobytes()
+        # the same files, whatever the number of processes
+        p.convert_data_to_binary(out2, level=6, workers=2)
+        for f in ("cells.gz", "cells.json", "genes.gz"):
+            assert open(join(out1, f), "rb").read() == open(join(out2, f), "rb").read()
+
+
+def test_incremental_export(monkeypatch):
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        df = pd.DataFrame({"a": np.arange(50.0), "b": np.ones(50), "c": np.zeros(50)})
+        p.add_datasource("t", df)
+        out = join(dir, "out")
+        os.mkdir(out)
+        p.convert_data_to_binary(out)
+        compressed = []
+        compress_payload = binary_codecs.compress_payload
+        monkeypatch.setattr(
+            binary_codecs,
+            "compress_payload",
+            lambda data, *args: (
+                compressed.append(data) or compress_payload(data, *args)
+            ),
+        )
+        # nothing has changed
+        p.convert_data_to_binary(out)
+        assert compressed == []
+        # only the changed column is compressed again
+        p.set_column("t", {"name": "b", "datatype": "double"}, df["b"] * 2)
+        p.convert_data_to_binary(out)
+        assert len(compressed) == 1
+        items = read_export(out, "t")
+        for c in ("a", "b", "c"):
+            assert items[c] == p.get_byte_data([{"field": c}], "t")
+        # a different level can't reuse anything
+        p.convert_data_to_binary(out, level=1)
+        assert len(compressed) == 4
+
+
+def test_export_codecs():
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        # columns named like the index's fields
+        df = pd.DataFrame({"a": np.arange(50.0), "codec": np.ones(50), "items": 2.0})
+        p.add_datasource("t", df)
+        p.convert_data_to_binary(dir, codec="raw")
+        items = read_export(dir, "t")
+        for c in df.columns:
+            assert items[c] == p.get_byte_data([{"field": c}], "t")
+        # codecs can't be switched incrementally
+        p.convert_data_to_binary(dir)
+        assert json.load(open(join(dir, "t.json")))["codec"] == "gzip"
+        assert read_export(dir, "t") == items
+        # the index of older exports only has the positions of the (gzip) data
+        index = json.load(open(join(dir, "t.json")))["items"]
+        assert binary_codecs.read_export_index(index) == ("gzip", index)
+        try:
+            p.convert_data_to_binary(dir, codec="lz4")
+            assert False
+        except AttributeError:
+            pass
+
+
+def test_streamed_export(monkeypatch):
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        df = pd.DataFrame(
+            {"a": np.arange(50.0), "b": np.ones(50), "c": ["x", "y"] * 25}
+        )
+        p.add_datasource("t", df)
+        out = join(dir, "out")
+        os.mkdir(out)
+        p.convert_data_to_binary(out)
+        items = read_export(out, "t")
+        # the (200 byte) numeric columns are read in blocks of 25 rows, not the text column
+        monkeypatch.setattr(mdvproject, "EXPORT_BLOCK_BYTES", 100)
+        streamed = []
+        compressobj = mdvproject.compressobj
+        monkeypatch.setattr(
+            mdvproject,
+            "compressobj",
+            lambda *args: streamed.append(args) or compressobj(*args),
+        )
+        # the fingerprints of the blocks match those of the whole columns
+        p.convert_data_to_binary(out)
+        assert streamed == []
+        p.convert_data_to_binary(out, incremental=False)
+        assert len(streamed) == 2
+        assert read_export(out, "t") == items
+        # without a manifest, everything is compressed again
+        p.convert_data_to_binary(out)
+        assert len(streamed) == 4
+        p.set_column("t", {"name": "b", "datatype": "double"}, df["b"] * 2)
+        p.convert_data_to_binary(out)
+        assert len(streamed) == 5
+        assert read_export(out, "t")["b"] == p.get_byte_data([{"field": "b"}], "t")
+        # the same files when each column is compressed by the pool
+        out2 = join(dir, "out2")
+        os.mkdir(out2)
+        p.convert_data_to_binary(out2, workers=2)
+        for f in ("t.gz", "t.json"):
+            assert open(join(out, f), "rb").read() == open(join(out2, f), "rb").read()
+        assert [f for f in os.listdir(out2) if f.endswith(".tmp")] == []
+
+
+def test_export_stamps(monkeypatch):
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        df = pd.DataFrame({"a": np.arange(50.0), "b": np.ones(50)})
+        p.add_datasource("t", df)
+        monkeypatch.setattr(mdvproject, "EXPORT_BLOCK_BYTES", 100)
+        reads = []
+        blocks_iter = mdvproject.DatasetBlocks.__iter__
+        monkeypatch.setattr(
+            mdvproject.DatasetBlocks,
+            "__iter__",
+            lambda self: reads.append(self.dset.name) or blocks_iter(self),
+        )
+        # recently modified, so the data is read to check it is unchanged
+        p.convert_data_to_binary(dir)
+        p.convert_data_to_binary(dir)
+        assert len(reads) == 4
+        # a file that hasn't been modified for a while
+        old = time.time() - 60
+        os.utime(p.h5file, (old, old))
+        p.convert_data_to_binary(dir)
+        assert len(reads) == 6
+        items = read_export(dir, "t")
+        p.convert_data_to_binary(dir)
+        assert len(reads) == 6
+        assert read_export(dir, "t") == items
+        # modified since
+        p.set_column("t", {"name": "b", "datatype": "double"}, df["b"] * 2)
+        p.convert_data_to_binary(dir)
+        assert len(reads) == 9
+        assert read_export(dir, "t")["b"] == p.get_byte_data([{"field": "b"}], "t")
+
+
+def test_zstd_codec(monkeypatch):
+    pytest.importorskip("zstandard")
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        df = pd.DataFrame({"a": np.arange(500.0), "b": np.ones(500)})
+        p.add_datasource("t", df)
+        p.convert_data_to_binary(dir, codec="zstd")
+        items = read_export(dir, "t")
+        for c in df.columns:
+            assert items[c] == p.get_byte_data([{"field": c}], "t")
+        # and when streamed, a block at a time
+        monkeypatch.setattr(mdvproject, "EXPORT_BLOCK_BYTES", 500)
+        p.convert_data_to_binary(dir, codec="zstd", incremental=False)
+        assert read_export(dir, "t") == items
+
+
+def test_copy_project_files():
+    with TemporaryDirectory() as dir:
+        p = MDVProject(join(dir, "project"))
+        p.add_datasource("t", pd.DataFrame({"a": np.arange(50.0)}))
+        out = join(dir, "out")
+        os.mkdir(out)
+        p.convert_data_to_binary(out)
+        items = read_export(out, "t")
+        # an older export in the project's directory
+        p.set_column("t", {"name": "a", "datatype": "double"}, np.ones(50))
+        p.convert_data_to_binary()
+        p.set_column("t", {"name": "a", "datatype": "double"}, np.arange(50.0))
+        # is not copied over the export in out, or mistaken for it
+        p.copy_project_files(out)
+        assert exists(join(out, "datasources.json"))
+        assert read_export(out, "t") == items
+        p.convert_data_to_binary(out)
+        assert read_export(out, "t") == items
@@ -0,0 +1,64 @@
+from mdvtools.mdvproject import MDVProject
+from mdvtools.storage import dataset_options
+from tempfile import TemporaryDirectory
+import os
+import pandas as pd
+import numpy as np
+import pytest
+
+
+def test_dataset_options():
+    assert dataset_options(None, 100) == {}
+    assert dataset_options(None, 0, resizable=True) == {"chunks": True}
+    opts = {"chunks": 1000, "compression": "gzip", "level": 6, "shuffle": True}
+    assert dataset_options(opts, 100) == {
+        "compression": "gzip",
+        "compression_opts": 6,
+        "shuffle": True,
+        "chunks": (100,),
+    }
+    assert dataset_options({"compression": "lzf"}, 100)["chunks"] is True
+
+
+def test_storage_options():
+    rng = np.random.default_rng(0)
+    n = 100_000
+    df = pd.DataFrame(
+        {
+            "a": rng.integers(0, 10, n),
+            "b": rng.normal(size=n),
+            "t": ["x", "y"] * (n // 2),
+        }
+    )
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        with pytest.raises(AttributeError):
+            p.storage_options = {"compression": "zip"}
+        p.storage_options = {"chunks": 10_000, "compression": "gzip", "shuffle": True}
+        p.add_datasource(
+            "t",
+            df,
+            columns=[
+                {"name": "b", "datatype": "double", "storage": {"compression": None}}
+            ],
+        )
+        with p._get_h5_handle(read_only=True) as h5:
+            assert h5["t"]["a"].compression == "gzip" and h5["t"]["a"].chunks == (
+                10_000,
+            )
+            assert h5["t"]["b"].compression is None
+        a = p.get_column("t", "a")
+
+        # repack without compression, and then with lzf
+        p.repack({})
+        assert p.storage_options is None
+        size = os.path.getsize(p.h5file)
+        with p._get_h5_handle(read_only=True) as h5:
+            assert h5["t"]["a"].chunks is None
+        p.repack({"compression": "lzf"})
+        assert os.path.getsize(p.h5file) < size
+        with p._get_h5_handle(read_only=True) as h5:
+            assert h5["t"]["a"].compression == "lzf"
+            assert h5["t"]["b"].compression is None
+        assert p.get_column("t", "a") == a
+        assert p.get_column("t", "t") == list(df["t"])
@@ -0,0 +1,139 @@
+from mdvtools.mdvproject import (
+    MDVProject,
+    get_subgroup_bytes,
+    iter_subgroup_bytes,
+    subgroup_count,
+)
+from tempfile import TemporaryDirectory
+import pandas as pd
+import numpy as np
+import scipy.sparse
+
+
+def make_project(dir):
+    p = MDVProject(dir)
+    p.add_datasource("cells", pd.DataFrame({"id": ["c1", "c2", "c3", "c4", "c5"]}))
+    p.add_datasource("genes", pd.DataFrame({"name": ["g1", "g2", "g3"]}))
+    p.add_rows_as_columns_link("cells", "genes", "name", "Gene Expr")
+    return p
+
+
+def test_dense_subgroup():
+    matrix = np.arange(15, dtype=np.float32).reshape(5, 3)
+    with TemporaryDirectory() as dir:
+        p = make_project(dir)
+        p.add_rows_as_columns_subgroup("cells", "genes", "gs", matrix)
+        with p._get_h5_handle(read_only=True) as h5:
+            x = h5["cells"]["gs"]["x"]
+            assert x.shape == (3, 5) and x.chunks == (1, 5)
+            assert get_subgroup_bytes(h5["cells"]["gs"], 1) == matrix[:, 1].tobytes()
+        columns = [
+            {"subgroup": "gs", "sgindex": i, "sgtype": "dense"} for i in (2, 0, 2)
+        ] + [{"field": "id"}]
+        data = p.get_byte_data(columns, "cells")
+        assert p.get_byte_data_size(columns, "cells") == len(data)
+        expected = matrix[:, [2, 0, 2]].T.tobytes()
+        assert data[: len(expected)] == expected
+        assert len(data) == len(expected) + 5
+
+        # compressed when repacked, with the same layout
+        p.repack({"compression": "gzip"})
+        with p._get_h5_handle(read_only=True) as h5:
+            x = h5["cells"]["gs"]["x"]
+            assert x.compression == "gzip" and x.chunks == (1, 5)
+        assert p.get_byte_data(columns, "cells") == data
+
+        # sparse matrices can also be stored densely
+        p.add_rows_as_columns_subgroup(
+            "cells", "genes", "gs2", scipy.sparse.csc_matrix(matrix)
+        )
+        columns = [{"subgroup": "gs2", "sgindex": 1}]
+        assert p.get_byte_data(columns, "cells") == matrix[:, 1].tobytes()
+        try:
+            p.add_rows_as_columns_subgroup("cells", "genes", "gs", matrix)
+            assert False
+        except AttributeError:
+            pass
+        # indexes outside the subgroup are reported before anything is read
+        try:
+            p.iter_byte_data([{"subgroup": "gs", "sgindex": 3}], "cells")
+            assert False
+        except KeyError:
+            pass
+
+
+def test_flat_dense_subgroup():
+    # the original layout
+    matrix = np.arange(15, dtype=np.float32).reshape(5, 3)
+    with TemporaryDirectory() as dir:
+        p = make_project(dir)
+        with p._get_h5_handle() as h5:
+            gr = h5["cells"].create_group("gs")
+            gr.create_dataset("x", data=matrix.flatten("F"))
+            gr["length"] = [5]
+        columns = [{"subgroup": "gs", "sgindex": i} for i in (1, 2)]
+        assert p.get_byte_data(columns, "cells") == matrix[:, [1, 2]].T.tobytes()
+        assert p.get_byte_data_size(columns, "cells") == 2 * 5 * 4
+        with p._get_h5_handle(read_only=True) as h5:
+            data = list(iter_subgroup_bytes(h5["cells"]["gs"], 3))
+            assert subgroup_count(h5["cells"]["gs"]) == 3
+        assert data == [matrix[:, i].tobytes() for i in range(3)]
+
+
+def test_sparse_subgroup(monkeypatch):
+    import mdvtools.mdvproject as mdvproject
+
+    rng = np.random.default_rng(0)
+    ngenes, ncells = 50, 40
+    matrix = scipy.sparse.random(ngenes, ncells, density=0.2, random_state=0).tocsr()
+    # an empty gene
+    keep = np.ones(ngenes)
+    keep[7] = 0
+    matrix = (scipy.sparse.diags(keep) @ matrix).tocsr()
+    matrix.eliminate_zeros()
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("cells", pd.DataFrame({"id": np.arange(ncells)}))
+        p.add_datasource(
+            "genes", pd.DataFrame({"name": [f"g{i}" for i in range(ngenes)]})
+        )
+        p.add_rows_as_columns_link("cells", "genes", "name", "Gene Expr")
+        p.add_rows_as_columns_subgroup("cells", "genes", "sp", matrix, sparse=True)
+        indexes = [int(i) for i in rng.choice(ngenes, 20)] + [7, 49, 0, 7]
+        with p._get_h5_handle(read_only=True) as h5:
+            expected = [get_subgroup_bytes(h5["cells"]["sp"], i, True) for i in indexes]
+            assert subgroup_count(h5["cells"]["sp"], True) == ngenes
+        columns = [
+            {"subgroup": "sp", "sgindex": i, "sgtype": "sparse"} for i in indexes
+        ]
+        for gap in (0, 10, 65536):
+            # read as separate and merged ranges
+            monkeypatch.setattr(mdvproject, "SPARSE_READ_GAP", gap)
+            assert p.get_byte_data(columns, "cells") == b"".join(expected)
+        assert p.get_byte_data_size(columns, "cells") == len(b"".join(expected))
+
+
+def test_iter_subgroup_bytes(monkeypatch):
+    import mdvtools.mdvproject as mdvproject
+
+    ngenes, ncells = 30, 20
+    matrix = scipy.sparse.random(ngenes, ncells, density=0.3, random_state=1).tocsr()
+    with TemporaryDirectory() as dir:
+        p = MDVProject(dir)
+        p.add_datasource("cells", pd.DataFrame({"id": np.arange(ncells)}))
+        p.add_datasource(
+            "genes", pd.DataFrame({"name": [f"g{i}" for i in range(ngenes)]})
+        )
+        p.add_rows_as_columns_link("cells", "genes", "name", "Gene Expr")
+        p.add_rows_as_columns_subgroup("cells", "genes", "sp", matrix, sparse=True)
+        p.add_rows_as_columns_subgroup("cells", "genes", "ds", matrix.T.toarray())
+        for window in (1, 100, 10_000_000):
+            # one column, a few columns and all the columns at a time
+            monkeypatch.setattr(mdvproject, "SUBGROUP_WINDOW_BYTES", window)
+            with p._get_h5_handle(read_only=True) as h5:
+                for sg, sparse in (("sp", True), ("ds", False)):
+                    grp = h5["cells"][sg]
+                    expected = [
+                        get_subgroup_bytes(grp, i, sparse) for i in range(ngenes)
+                    ]
+                    assert list(iter_subgroup_bytes(grp, ngenes, sparse)) == expected
@@ -151,11 +151,20 @@ class CompressedBinaryDataLoader {
         this.size = size;
     }
     async getColumnData(cols,size) {
-        const {default:pako} = await import ("pako");
         if (!this.index) {
             const iurl = this.url.replace(".gz", '.json')
             const resp = await fetch(iurl);
-            this.index = await resp.json();
+            const index = await resp.json();
+            //older exports only have the positions of the (gzip) data
+            if (typeof index.codec === "string"){
+                this.codec = index.codec;
+                this.index = index.items;
+            }
+            else{
+                this.codec = "gzip";
+                this.index = index;
+            }
+            checkCodec(this.codec);
         }
         //unable to request multiple ranges, which would be more efficient
         //send off request for each column separately and then return all of them
@@ -186,7 +195,7 @@ class CompressedBinaryDataLoader {
                 console.warn(`Expected ${expectedLength} bytes but got ${bytes.byteLength} for ${c.field}... is the server correctly configured to Accept-Ranges?`);
             }
             try {
-                const output = pako.inflate(bytes);
+                const output = await decodeBytes(bytes, this.codec);
     
                 if (c.sgtype==="sparse"){
                     const b = output.buffer;
@@ -216,6 +225,38 @@ class CompressedBinaryDataLoader {
     }
 }
 
+//the codecs of static exports which can be decoded (see mdvtools.binary_codecs)
+const CODECS = ["gzip", "zstd", "raw"];
+
+/**
+* Checks that the data of a static export can be decoded
+* @param {string} codec - How the data was encoded
+**/
+function checkCodec(codec){
+    if (!CODECS.includes(codec)){
+        throw new Error(`Cannot decode '${codec}' data - the project needs to be exported with one of ${CODECS.join(", ")}`);
+    }
+}
+
+/**
+* Decodes the data of a column in a static export
+* @param {ArrayBuffer} bytes - The encoded data
+* @param {string} codec - How it was encoded ('gzip', 'zstd' or 'raw')
+* @returns {Uint8Array} The decoded data
+**/
+async function decodeBytes(bytes, codec){
+    if (codec === "raw"){
+        return new Uint8Array(bytes);
+    }
+    if (codec === "zstd"){
+        //browsers don't decode zstd natively
+        const {zstdDecompress} = await import ("./zstd.js");
+        return zstdDecompress(new Uint8Array(bytes));
+    }
+    const {default:pako} = await import ("pako");
+    return pako.inflate(bytes);
+}
+
 async function decompressData(buffer){
     const {default:pako} = await import ("pako");
     return pako.inflate(buffer).buffer;
@@ -0,0 +1,722 @@
+/**
+* A decoder for zstd data (RFC 8878), for static exports made with the 'zstd'
+* codec (see mdvtools.binary_codecs), as browsers don't decode zstd natively.
+* Only what the exports need is supported - frames without a dictionary, whose
+* content checksum (if any) is not verified.
+* @module zstd
+**/
+
+const FRAME_MAGIC = 0xfd2fb528;
+
+//the baseline and number of extra bits of the literals length and match length codes
+const LL_BASE = Uint32Array.of(
+    0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 18, 20, 22, 24, 28,
+    32, 40, 48, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 65536,
+);
+const LL_BITS = Uint8Array.of(
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 3, 3, 4, 6,
+    7, 8, 9, 10, 11, 12, 13, 14, 15, 16,
+);
+const ML_BASE = Uint32Array.of(
+    3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23,
+    24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 37, 39, 41, 43, 47, 51, 59,
+    67, 83, 99, 131, 259, 515, 1027, 2051, 4099, 8195, 16387, 32771, 65539,
+);
+const ML_BITS = Uint8Array.of(
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 3, 3, 4, 4, 5, 7, 8, 9, 10, 11, 12, 13,
+    14, 15, 16,
+);
+
+//the predefined distributions of the sequence codes
+const LL_DEFAULT = [
+    4, 3, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2, 2, 3,
+    2, 1, 1, 1, 1, 1, -1, -1, -1, -1,
+];
+const ML_DEFAULT = [
+    1, 4, 3, 2, 2, 2, 2, 2, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
+    1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, -1, -1, -1, -1,
+    -1, -1, -1,
+];
+const OF_DEFAULT = [
+    1, 1, 1, 1, 1, 1, 2, 2, 2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, -1,
+    -1, -1, -1, -1,
+];
+
+function fail(msg) {
+    throw new Error(`invalid zstd data: ${msg}`);
+}
+
+function highBit(n) {
+    return 31 - Math.clz32(n);
+}
+
+/**
+* Reads a bitstream backwards from its end, as zstd writes Huffman and FSE
+* coded data. Bits before the start of the stream are read as zeros.
+**/
+class BackwardBits {
+    constructor(data, start, end) {
+        if (end <= start || data[end - 1] === 0) {
+            fail("bad bitstream end");
+        }
+        this.data = data;
+        this.start = start;
+        this.end = end;
+        //the position (in bits from the start) below the final marker bit
+        this.pos = (end - 1 - start) * 8 + highBit(data[end - 1]);
+    }
+
+    byte(i) {
+        return i >= 0 && i < this.end - this.start ? this.data[this.start + i] : 0;
+    }
+
+    //the n (<=24) bits at bit position p
+    bitsAt(p, n) {
+        const b = p >> 3;
+        const i = this.start + b;
+        if (p >= 0 && i + 3 < this.end) {
+            const d = this.data;
+            const v = d[i] | (d[i + 1] << 8) | (d[i + 2] << 16) | (d[i + 3] << 24);
+            return (v >>> (p & 7)) & ((1 << n) - 1);
+        }
+        const v =
+            this.byte(b) |
+            (this.byte(b + 1) << 8) |
+            (this.byte(b + 2) << 16) |
+            (this.byte(b + 3) << 24);
+        return (v >>> (p & 7)) & ((1 << n) - 1);
+    }
+
+    read(n) {
+        if (n > 24) {
+            const high = this.read(n - 24);
+            return high * 16777216 + this.read(24);
+        }
+        //the 4 bytes ending with the one holding the highest bit read
+        const top = this.pos - 1;
+        this.pos -= n;
+        if (top >= 24) {
+            const d = this.data;
+            const i = this.start + (top >> 3) - 3;
+            const v = d[i] | (d[i + 1] << 8) | (d[i + 2] << 16) | (d[i + 3] << 24);
+            return (v >>> ((top & 7) + 25 - n)) & ((1 << n) - 1);
+        }
+        return this.bitsAt(this.pos, n);
+    }
+
+    peek(n) {
+        return this.bitsAt(this.pos - n, n);
+    }
+}
+
+/**
+* Reads an FSE table description (the normalized probabilities of each symbol)
+* @returns {object} the probabilities, accuracy log and the number of bytes read
+**/
+function readProbabilities(data, start, end, maxSymbol) {
+    let bitPos = 0;
+    //the next n bits, which may be past the end of the description
+    const bits = (n) => {
+        let v = 0;
+        for (let i = 0; i < n; i++) {
+            const p = bitPos + i;
+            const b = start + (p >> 3);
+            if (b < end) {
+                v |= ((data[b] >> (p & 7)) & 1) << i;
+            }
+        }
+        return v;
+    };
+    const accuracyLog = bits(4) + 5;
+    bitPos = 4;
+    let remaining = (1 << accuracyLog) + 1;
+    let threshold = 1 << accuracyLog;
+    let nbBits = accuracyLog + 1;
+    const probs = [];
+    let previous0 = false;
+    while (remaining > 1 && probs.length <= maxSymbol) {
+        if (previous0) {
+            //runs of zero probabilities
+            let repeat;
+            do {
+                repeat = bits(2);
+                bitPos += 2;
+                for (let i = 0; i < repeat; i++) probs.push(0);
+            } while (repeat === 3);
+            if (probs.length > maxSymbol) {
+                break;
+            }
+        }
+        const max = 2 * threshold - 1 - remaining;
+        let count;
+        const low = bits(nbBits - 1);
+        if (low < max) {
+            count = low;
+            bitPos += nbBits - 1;
+        } else {
+            count = bits(nbBits);
+            if (count >= threshold) {
+                count -= max;
+            }
+            bitPos += nbBits;
+        }
+        count--;
+        remaining -= Math.abs(count);
+        probs.push(count);
+        previous0 = count === 0;
+        while (remaining < threshold) {
+            nbBits--;
+            threshold >>= 1;
+        }
+    }
+    if (remaining !== 1 || bitPos > (end - start) * 8) {
+        fail("bad probabilities");
+    }
+    return { probs, accuracyLog, size: (bitPos + 7) >> 3 };
+}
+
+/**
+* Builds the FSE decoding table of the probabilities
+* @returns {object} the symbol, number of bits and baseline of each state
+**/
+function buildFSETable(probs, accuracyLog) {
+    const size = 1 << accuracyLog;
+    const symbols = new Uint8Array(size);
+    const nbBits = new Uint8Array(size);
+    const baselines = new Uint16Array(size);
+    const next = new Uint16Array(probs.length);
+    let high = size - 1;
+    for (let s = 0; s < probs.length; s++) {
+        if (probs[s] === -1) {
+            symbols[high--] = s;
+            next[s] = 1;
+        } else {
+            next[s] = probs[s];
+        }
+    }
+    const step = (size >> 1) + (size >> 3) + 3;
+    let pos = 0;
+    for (let s = 0; s < probs.length; s++) {
+        for (let i = 0; i < probs[s]; i++) {
+            symbols[pos] = s;
+            do {
+                pos = (pos + step) & (size - 1);
+            } while (pos > high);
+        }
+    }
+    if (pos !== 0) {
+        fail("bad FSE table");
+    }
+    for (let u = 0; u < size; u++) {
+        const n = next[symbols[u]]++;
+        nbBits[u] = accuracyLog - highBit(n);
+        baselines[u] = (n << nbBits[u]) - size;
+    }
+    return { symbols, nbBits, baselines, accuracyLog };
+}
+
+function rleTable(symbol) {
+    return {
+        symbols: Uint8Array.of(symbol),
+        nbBits: new Uint8Array(1),
+        baselines: new Uint16Array(1),
+        accuracyLog: 0,
+    };
+}
+
+/**
+* Reads a Huffman tree description
+* @returns {object} the decoding table and the number of bytes read
+**/
+function readHuffmanTable(data, start, end) {
+    const header = data[start];
+    const weights = [];
+    let size;
+    if (header < 128) {
+        //FSE compressed weights, decoded with two interleaved states
+        size = header + 1;
+        if (start + size > end) {
+            fail("truncated Huffman tree");
+        }
+        const desc = readProbabilities(data, start + 1, start + size, 255);
+        if (desc.accuracyLog > 6) {
+            fail("bad Huffman weights");
+        }
+        const table = buildFSETable(desc.probs, desc.accuracyLog);
+        const bits = new BackwardBits(data, start + 1 + desc.size, start + size);
+        const states = [bits.read(table.accuracyLog), bits.read(table.accuracyLog)];
+        for (let i = 0; ; i = 1 - i) {
+            const s = states[i];
+            weights.push(table.symbols[s]);
+            states[i] = table.baselines[s] + bits.read(table.nbBits[s]);
+            if (bits.pos < 0) {
+                weights.push(table.symbols[states[1 - i]]);
+                break;
+            }
+            if (weights.length > 255) {
+                fail("bad Huffman weights");
+            }
+        }
+    } else {
+        //4 bit weights
+        const n = header - 127;
+        size = 1 + ((n + 1) >> 1);
+        if (start + size > end) {
+            fail("truncated Huffman tree");
+        }
+        for (let i = 0; i < n; i++) {
+            const b = data[start + 1 + (i >> 1)];
+            weights.push(i & 1 ? b & 15 : b >> 4);
+        }
+    }
+    //the weight of the last symbol is implied by the others
+    let total = 0;
+    for (const w of weights) {
+        if (w > 0) {
+            total += 1 << (w - 1);
+        }
+    }
+    if (total === 0) {
+        fail("bad Huffman weights");
+    }
+    const maxBits = highBit(total) + 1;
+    const left = (1 << maxBits) - total;
+    if (left & (left - 1)) {
+        fail("bad Huffman weights");
+    }
+    weights.push(highBit(left) + 1);
+    if (maxBits > 11) {
+        fail("bad Huffman weights");
+    }
+    //codes are assigned in order of weight and then symbol
+    const symbols = new Uint8Array(1 << maxBits);
+    const nbBits = new Uint8Array(1 << maxBits);
+    let pos = 0;
+    for (let w = 1; w <= maxBits; w++) {
+        for (let s = 0; s < weights.length; s++) {
+            if (weights[s] !== w) {
+                continue;
+            }
+            const n = 1 << (w - 1);
+            symbols.fill(s, pos, pos + n);
+            nbBits.fill(maxBits + 1 - w, pos, pos + n);
+            pos += n;
+        }
+    }
+    return { table: { symbols, nbBits, maxBits }, size };
+}
+
+/**
+* Decodes Huffman coded streams into consecutive parts of out. The streams are
+* independent, so are decoded together, a symbol from each in turn.
+* @param {number[][]} streams - the start and end of each stream in data
+* @param {number} each - the number of symbols in each stream, except the last
+**/
+function decodeHuffmanStreams(data, streams, table, out, each, count) {
+    const { symbols, nbBits, maxBits } = table;
+    const mask = (1 << maxBits) - 1;
+    const n = streams.length;
+    const readers = streams.map(([start, end]) => new BackwardBits(data, start, end));
+    const pos = readers.map((r) => r.pos);
+    const counts = streams.map((_, i) => (i < n - 1 ? each : count - (n - 1) * each));
+    const offsets = streams.map((_, i) => i * each);
+    //codes are at most 11 bits, so are in the 3 bytes ending with the one holding
+    //the next bit (while there are 3 bytes)
+    let done = 0;
+    if (n === 4) {
+        const minCount = Math.min(...counts);
+        let [p0, p1, p2, p3] = pos;
+        const [s0, s1, s2, s3] = streams.map((s) => s[0] - 2);
+        const [o0, o1, o2, o3] = offsets;
+        for (; done < minCount; done++) {
+            if (p0 < 24 || p1 < 24 || p2 < 24 || p3 < 24) {
+                break;
+            }
+            const b0 = s0 + ((p0 - 1) >> 3);
+            const b1 = s1 + ((p1 - 1) >> 3);
+            const b2 = s2 + ((p2 - 1) >> 3);
+            const b3 = s3 + ((p3 - 1) >> 3);
+            const w0 = data[b0] | (data[b0 + 1] << 8) | (data[b0 + 2] << 16);
+            const w1 = data[b1] | (data[b1 + 1] << 8) | (data[b1 + 2] << 16);
+            const w2 = data[b2] | (data[b2 + 1] << 8) | (data[b2 + 2] << 16);
+            const w3 = data[b3] | (data[b3 + 1] << 8) | (data[b3 + 2] << 16);
+            const v0 = (w0 >>> (((p0 - 1) & 7) + 17 - maxBits)) & mask;
+            const v1 = (w1 >>> (((p1 - 1) & 7) + 17 - maxBits)) & mask;
+            const v2 = (w2 >>> (((p2 - 1) & 7) + 17 - maxBits)) & mask;
+            const v3 = (w3 >>> (((p3 - 1) & 7) + 17 - maxBits)) & mask;
+            out[o0 + done] = symbols[v0];
+            out[o1 + done] = symbols[v1];
+            out[o2 + done] = symbols[v2];
+            out[o3 + done] = symbols[v3];
+            p0 -= nbBits[v0];
+            p1 -= nbBits[v1];
+            p2 -= nbBits[v2];
+            p3 -= nbBits[v3];
+        }
+        pos.splice(0, 4, p0, p1, p2, p3);
+    }
+    //the rest of each stream
+    for (let k = 0; k < n; k++) {
+        const r = readers[k];
+        let p = pos[k];
+        for (let j = done; j < counts[k]; j++) {
+            const v = r.bitsAt(p - maxBits, maxBits);
+            out[offsets[k] + j] = symbols[v];
+            p -= nbBits[v];
+        }
+        if (p !== 0) {
+            fail("bad Huffman stream");
+        }
+    }
+}
+
+/**
+* Decodes a frame's blocks, keeping the state they share
+**/
+class FrameDecoder {
+    constructor(out) {
+        this.out = out;
+        this.huffman = null;
+        this.tables = [null, null, null];
+        this.offsets = [1, 4, 8];
+    }
+
+    literals(data, start, end) {
+        const b0 = data[start];
+        const type = b0 & 3;
+        const format = (b0 >> 2) & 3;
+        if (type < 2) {
+            //raw or RLE
+            let size;
+            let header;
+            if ((format & 1) === 0) {
+                size = b0 >> 3;
+                header = 1;
+            } else if (format === 1) {
+                size = (b0 >> 4) + (data[start + 1] << 4);
+                header = 2;
+            } else {
+                size = (b0 >> 4) + (data[start + 1] << 4) + (data[start + 2] << 12);
+                header = 3;
+            }
+            const p = start + header;
+            if (type === 0) {
+                if (p + size > end) {
+                    fail("truncated literals");
+                }
+                return { literals: data.subarray(p, p + size), next: p + size };
+            }
+            return { literals: new Uint8Array(size).fill(data[p]), next: p + 1 };
+        }
+        const header = format < 2 ? 3 : format + 2;
+        const sizeBits = [10, 10, 14, 18][format];
+        let h = 0;
+        for (let i = header - 1; i >= 0; i--) {
+            h = h * 256 + data[start + i];
+        }
+        const mask = 2 ** sizeBits;
+        const size = Math.floor(h / 16) % mask;
+        const compressed = Math.floor(h / 16 / mask) % mask;
+        let p = start + header;
+        const streamsEnd = p + compressed;
+        if (streamsEnd > end) {
+            fail("truncated literals");
+        }
+        if (type === 2) {
+            const huf = readHuffmanTable(data, p, streamsEnd);
+            this.huffman = huf.table;
+            p += huf.size;
+        } else if (!this.huffman) {
+            fail("no previous Huffman table");
+        }
+        const literals = new Uint8Array(size);
+        if (format === 0) {
+            decodeHuffmanStreams(data, [[p, streamsEnd]], this.huffman, literals, size, size);
+        } else {
+            const sizes = [
+                data[p] | (data[p + 1] << 8),
+                data[p + 2] | (data[p + 3] << 8),
+                data[p + 4] | (data[p + 5] << 8),
+            ];
+            p += 6;
+            sizes.push(streamsEnd - p - sizes[0] - sizes[1] - sizes[2]);
+            const streams = [];
+            for (const n of sizes) {
+                if (n <= 0) {
+                    fail("bad literal streams");
+                }
+                streams.push([p, p + n]);
+                p += n;
+            }
+            const each = (size + 3) >> 2;
+            if (size < 3 * each) {
+                fail("bad literal streams");
+            }
+            decodeHuffmanStreams(data, streams, this.huffman, literals, each, size);
+        }
+        return { literals, next: streamsEnd };
+    }
+
+    table(i, mode, data, p, end) {
+        const maxSymbol = [35, 31, 52][i];
+        if (mode === 0) {
+            const probs = [LL_DEFAULT, OF_DEFAULT, ML_DEFAULT][i];
+            this.tables[i] = buildFSETable(probs, i === 1 ? 5 : 6);
+            return p;
+        }
+        if (mode === 1) {
+            this.tables[i] = rleTable(data[p]);
+            return p + 1;
+        }
+        if (mode === 2) {
+            const desc = readProbabilities(data, p, end, maxSymbol);
+            if (desc.accuracyLog > (i === 1 ? 8 : 9)) {
+                fail("bad sequence table");
+            }
+            this.tables[i] = buildFSETable(desc.probs, desc.accuracyLog);
+            return p + desc.size;
+        }
+        if (!this.tables[i]) {
+            fail("no previous sequence table");
+        }
+        return p;
+    }
+
+    compressedBlock(data, start, end) {
+        const { literals, next } = this.literals(data, start, end);
+        let p = next;
+        let count = data[p];
+        if (count < 128) {
+            p += 1;
+        } else if (count < 255) {
+            count = ((count - 128) << 8) + data[p + 1];
+            p += 2;
+        } else {
+            count = data[p + 1] + (data[p + 2] << 8) + 0x7f00;
+            p += 3;
+        }
+        const out = this.out;
+        let lit = 0;
+        if (count > 0) {
+            const modes = data[p++];
+            p = this.table(0, modes >> 6, data, p, end);
+            p = this.table(1, (modes >> 4) & 3, data, p, end);
+            p = this.table(2, (modes >> 2) & 3, data, p, end);
+            const [llt, oft, mlt] = this.tables;
+            const bits = new BackwardBits(data, p, end);
+            let ll = bits.read(llt.accuracyLog);
+            let of = bits.read(oft.accuracyLog);
+            let ml = bits.read(mlt.accuracyLog);
+            const rep = this.offsets;
+            for (let i = 0; i < count; i++) {
+                const ofCode = oft.symbols[of];
+                const mlCode = mlt.symbols[ml];
+                const llCode = llt.symbols[ll];
+                if (mlCode > 52 || llCode > 35 || ofCode > 31) {
+                    fail("bad sequence code");
+                }
+                const ofValue = ofCode < 25
+                    ? (1 << ofCode) + bits.read(ofCode)
+                    : 2 ** ofCode + bits.read(ofCode);
+                const matchLength = ML_BASE[mlCode] + bits.read(ML_BITS[mlCode]);
+                const litLength = LL_BASE[llCode] + bits.read(LL_BITS[llCode]);
+                let offset;
+                if (ofValue > 3) {
+                    offset = ofValue - 3;
+                    rep[2] = rep[1];
+                    rep[1] = rep[0];
+                    rep[0] = offset;
+                } else {
+                    //repeated offsets, shifted by one when there are no literals
+                    const r = litLength === 0 ? ofValue : ofValue - 1;
+                    if (r === 0) {
+                        offset = rep[0];
+                    } else {
+                        offset = r === 3 ? rep[0] - 1 : rep[r];
+                        if (r !== 1) {
+                            rep[2] = rep[1];
+                        }
+                        rep[1] = rep[0];
+                        rep[0] = offset;
+                    }
+                }
+                if (i < count - 1) {
+                    ll = llt.baselines[ll] + bits.read(llt.nbBits[ll]);
+                    ml = mlt.baselines[ml] + bits.read(mlt.nbBits[ml]);
+                    of = oft.baselines[of] + bits.read(oft.nbBits[of]);
+                }
+                if (lit + litLength > literals.length) {
+                    fail("too many literals");
+                }
+                out.writeFrom(literals, lit, lit + litLength);
+                lit += litLength;
+                out.copyMatch(offset, matchLength);
+            }
+            if (bits.pos !== 0) {
+                fail("bad sequences");
+            }
+        }
+        out.write(literals.subarray(lit));
+    }
+
+    decode(data, p) {
+        for (;;) {
+            if (p + 3 > data.length) {
+                fail("truncated block");
+            }
+            const h = data[p] | (data[p + 1] << 8) | (data[p + 2] << 16);
+            p += 3;
+            const last = h & 1;
+            const type = (h >> 1) & 3;
+            const size = h >>> 3;
+            if (type === 1) {
+                this.out.fill(data[p], size);
+                p += 1;
+            } else {
+                if (p + size > data.length) {
+                    fail("truncated block");
+                }
+                if (type === 0) {
+                    this.out.write(data.subarray(p, p + size));
+                } else if (type === 2) {
+                    this.compressedBlock(data, p, p + size);
+                } else {
+                    fail("reserved block type");
+                }
+                p += size;
+            }
+            if (last) {
+                return p;
+            }
+        }
+    }
+}
+
+/**
+* The decoded data, in a buffer which grows as needed
+**/
+class Output {
+    constructor(size) {
+        this.buffer = new Uint8Array(size || 65536);
+        this.length = 0;
+    }
+
+    reserve(n) {
+        if (this.length + n > this.buffer.length) {
+            const b = new Uint8Array(Math.max(this.length + n, this.buffer.length * 2));
+            b.set(this.buffer.subarray(0, this.length));
+            this.buffer = b;
+        }
+    }
+
+    write(bytes) {
+        this.reserve(bytes.length);
+        this.buffer.set(bytes, this.length);
+        this.length += bytes.length;
+    }
+
+    //writes bytes start to end of src, without making a view of them
+    writeFrom(src, start, end) {
+        const n = end - start;
+        if (n > 32) {
+            this.write(src.subarray(start, end));
+            return;
+        }
+        this.reserve(n);
+        const b = this.buffer;
+        for (let i = start, j = this.length; i < end; i++, j++) {
+            b[j] = src[i];
+        }
+        this.length += n;
+    }
+
+    fill(byte, n) {
+        this.reserve(n);
+        this.buffer.fill(byte, this.length, this.length + n);
+        this.length += n;
+    }
+
+    copyMatch(offset, n) {
+        if (offset > this.length || offset === 0) {
+            fail("bad match offset");
+        }
+        this.reserve(n);
+        const b = this.buffer;
+        let from = this.length - offset;
+        if (offset >= n && n > 32) {
+            b.copyWithin(this.length, from, from + n);
+        } else {
+            //short, or overlapping the data it repeats
+            for (let i = 0; i < n; i++) {
+                b[this.length + i] = b[from++];
+            }
+        }
+        this.length += n;
+    }
+}
+
+/**
+* Decodes zstd data (one or more frames)
+* @param {Uint8Array} data - The encoded data
+* @returns {Uint8Array} The decoded data
+**/
+function zstdDecompress(data) {
+    let out = null;
+    let p = 0;
+    while (p < data.length) {
+        if (p + 4 > data.length) {
+            fail("truncated frame");
+        }
+        const magic = (data[p] | (data[p + 1] << 8) | (data[p + 2] << 16) | (data[p + 3] << 24)) >>> 0;
+        p += 4;
+        if ((magic & 0xfffffff0) >>> 0 === 0x184d2a50) {
+            //skippable frame
+            const size = (data[p] | (data[p + 1] << 8) | (data[p + 2] << 16) | (data[p + 3] << 24)) >>> 0;
+            p += 4 + size;
+            continue;
+        }
+        if (magic !== FRAME_MAGIC) {
+            fail("unknown frame");
+        }
+        const desc = data[p++];
+        const fcsFlag = desc >> 6;
+        const single = (desc >> 5) & 1;
+        const checksum = (desc >> 2) & 1;
+        const dictFlag = desc & 3;
+        if (!single) {
+            p++; //the window size, which doesn't matter as the output is kept
+        }
+        const dictBytes = [0, 1, 2, 4][dictFlag];
+        let dictId = 0;
+        for (let i = dictBytes - 1; i >= 0; i--) {
+            dictId = dictId * 256 + data[p + i];
+        }
+        if (dictId) {
+            fail("dictionaries are not supported");
+        }
+        p += dictBytes;
+        const fcsBytes = [single, 2, 4, 8][fcsFlag];
+        let contentSize = 0;
+        for (let i = fcsBytes - 1; i >= 0; i--) {
+            contentSize = contentSize * 256 + data[p + i];
+        }
+        if (fcsBytes === 2) {
+            contentSize += 256;
+        }
+        p += fcsBytes;
+        if (!out) {
+            out = new Output(fcsBytes ? contentSize : 0);
+        } else if (fcsBytes) {
+            out.reserve(contentSize);
+        }
+        p = new FrameDecoder(out).decode(data, p);
+        p += checksum ? 4 : 0;
+    }
+    if (!out) {
+        return new Uint8Array(0);
+    }
+    return out.buffer.length === out.length ? out.buffer : out.buffer.slice(0, out.length);
+}
+
+export { zstdDecompress };